@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import os
 
@@ -190,6 +191,83 @@ LOGOUT_REDIRECT_URL = 'login'
 CELERY_BROKER_URL = os.getenv('REDIS_URL')
 CELERY_RESULT_BACKEND = os.getenv('REDIS_URL')
 
+CELERY_BEAT_SCHEDULE = {
+    'verify-subscribed-listings': {
+        'task': 'subscriptions.tasks.verify_subscribed_listings',
+        'schedule': 30.0,
+    },
+    'process-paystack-events': {
+        'task': 'payments.tasks.process_paystack_events',
+        'schedule': 60.0,
+    },
+    'dispatch-vacancy-notifications': {
+        'task': 'subscriptions.tasks.dispatch_vacancy_notifications',
+        'schedule': 30.0,
+    },
+    'expire-subscriptions': {
+        'task': 'subscriptions.tasks.expire_subscriptions',
+        'schedule': 300.0,
+    },
+    'purge-deleted-media': {
+        'task': 'listings.tasks.purge_deleted_media',
+        'schedule': 300.0,
+    },
+}
+
+# unverified subscribed listings not reported within this window get verified
+SUBSCRIBED_LISTING_VERIFICATION_WINDOW = timedelta(
+    seconds=int(os.getenv('SUBSCRIBED_LISTING_VERIFICATION_WINDOW', 60))
+)
+
+# uploads wait here for the image pipeline, has to be shared by the
+# web and worker hosts
+IMAGE_UPLOAD_STAGING_DIR = os.getenv(
+    'IMAGE_UPLOAD_STAGING_DIR', os.path.join(BASE_DIR, 'media', 'staging'))
+
+# widths of the resized variants of lodge and room images
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+
+# uploads always go to a temporary file, the pipeline moves it
+# to staging instead of holding it in memory
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# rendered listing cards of the subscribed listings page, keyed by updated_at
+SUBSCRIBED_LISTING_FRAGMENT_TTL = int(
+    os.getenv('SUBSCRIBED_LISTING_FRAGMENT_TTL', 60 * 60 * 24))
+
+# how long a subscription stays active after payment
+SUBSCRIPTION_DURATION = timedelta(
+    days=int(os.getenv('SUBSCRIPTION_DURATION_DAYS', 30))
+)
+
+# vacancy changes are only notified once a room has been left alone this long
+VACANCY_NOTIFICATION_DEBOUNCE = timedelta(
+    seconds=int(os.getenv('VACANCY_NOTIFICATION_DEBOUNCE', 30))
+)
+
+# how long room facet counts are cached per filter combination
+ROOM_FACETS_CACHE_TTL = int(os.getenv('ROOM_FACETS_CACHE_TTL', 30))
+
+
+# cache settings, shared across workers through redis when available
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
+# paystack settings, point PAYSTACK_BASE_URL at `manage.py paystack_stub` to test offline
+PAYSTACK_BASE_URL = os.getenv('PAYSTACK_BASE_URL', 'https://api.paystack.co')
+PAYSTACK_POOL_MAXSIZE = int(os.getenv('PAYSTACK_POOL_MAXSIZE', 10))
+PAYSTACK_MAX_RETRIES = int(os.getenv('PAYSTACK_MAX_RETRIES', 3))
+PAYSTACK_RESOLUTION_CACHE_TTL = int(
+    os.getenv('PAYSTACK_RESOLUTION_CACHE_TTL', 60 * 60 * 24)
+)
+
 # Email Creds
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -15,6 +15,55 @@ class BaseModel(models.Model):
         abstract = True
 
 
+class TrackedFieldsMixin:
+    '''
+    Remembers the values of tracked_fields as loaded from the database,
+    so saves and signals can see what changed without querying the old row
+    '''
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.track_fields()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None or not hasattr(self, '_loaded_fields'):
+            self.track_fields()
+            return
+        # deferred loads refresh single fields, keep the rest of the snapshot
+        for name in fields:
+            attname = self._meta.get_field(name).attname
+            if attname in self.tracked_fields:
+                self._loaded_fields[attname] = self.__dict__.get(attname)
+
+    def track_fields(self):
+        """Snapshot the tracked fields, e.g after bulk_create which skips from_db"""
+        self._loaded_fields = {
+            name: self.__dict__.get(name) for name in self.tracked_fields
+        }
+
+    def get_loaded_value(self, name):
+        """Returns the stored value of a tracked field, None when not saved yet"""
+        return getattr(self, '_loaded_fields', {}).get(name)
+
+    def tracked_fields_changed(self, *names):
+        """Check if the tracked fields, or the given ones, differ from the stored values"""
+        loaded = getattr(self, '_loaded_fields', None)
+        if loaded is None:
+            return True
+        return any(
+            loaded[name] != self.__dict__.get(name)
+            for name in names or self.tracked_fields
+        )
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.track_fields()
+
+
 # class ImageOptimizationModel(models.Model):
 #     def save(self, *args, **kwargs):
 #         from cloudinary.uploader import upload
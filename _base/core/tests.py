@@ -1,3 +1,98 @@
 from django.test import TestCase
+from uuid import uuid4
 
-# Create your tests here.
+from listings.models import (
+    State,
+    School,
+    Region,
+    Lodge,
+    RoomType,
+    RoomProfile
+)
+from payments.models import CreatorTransferInfo, Transaction
+from subscriptions.models import Subscription
+from users.models import Client, Creator
+
+
+# Shared fixtures for the app test suites
+
+
+def create_client(**kwargs):
+    """creates a client without reaching out to paystack"""
+    uid = uuid4().hex[:12]
+    kwargs.setdefault('email', f'client-{uid}@upperoom.test')
+    kwargs.setdefault('username', f'client{uid}')
+    kwargs.setdefault('customer_code', f'CUS_{uid}')
+    return Client.objects.create(**kwargs)
+
+
+def create_creator(**kwargs):
+    """creates a creator without reaching out to paystack"""
+    uid = uuid4().hex[:12]
+    kwargs.setdefault('email', f'creator-{uid}@upperoom.test')
+    kwargs.setdefault('username', f'creator{uid}')
+    kwargs.setdefault('customer_code', f'CUS_{uid}')
+    return Creator.objects.create(**kwargs)
+
+
+def create_region(name='Choba'):
+    state = State.objects.create(name='Rivers')
+    school = School.objects.create(
+        name='University of Port Harcourt',
+        abbr='UNIPORT',
+        state=state
+    )
+    return Region.objects.create(name=name, state=state, school=school)
+
+
+def create_lodge(region, creator, **kwargs):
+    kwargs.setdefault('name', 'Test Lodge')
+    kwargs.setdefault('phone_number', '08000000000')
+    return Lodge.objects.create(
+        region=region,
+        state=region.state,
+        school=region.school,
+        creator=creator,
+        **kwargs
+    )
+
+
+def create_room_profile(lodge, room_type=None, **kwargs):
+    if room_type is None:
+        room_type, _ = RoomType.objects.get_or_create(
+            name=RoomType.Type.ONE_ROOM)
+    return RoomProfile.objects.create(
+        lodge=lodge,
+        room_type=room_type,
+        **kwargs
+    )
+
+
+def create_subscription(region, client=None, **kwargs):
+    if client is None:
+        client = create_client()
+    transaction = Transaction.objects.create(
+        amount=1500,
+        reference=uuid4().hex[:12],
+        client=client,
+        is_fully_paid=True
+    )
+    transaction.regions.add(region)
+    return Subscription.objects.create(
+        client=client,
+        transaction=transaction,
+        **kwargs
+    )
+
+
+def create_transfer_profile(creator, **kwargs):
+    """creates transfer info without resolving the account on paystack"""
+    kwargs.setdefault('account_number', '0123456789')
+    kwargs.setdefault('bank_code', '058')
+    kwargs.setdefault('bvn', '12345678901')
+    kwargs.setdefault('currency', 'NGN')
+    kwargs.setdefault('is_validated', True)
+    transfer_profile, = CreatorTransferInfo.objects.bulk_create([
+        CreatorTransferInfo(creator=creator, **kwargs)
+    ])
+    return CreatorTransferInfo.objects.get(pk=transfer_profile.pk)
@@ -1,14 +1,14 @@
 from django.contrib import messages
 from django.shortcuts import render
 from django.views.decorators.http import require_http_methods
-from listings.models import School
+from listings import geography
 from django.http import HttpResponse
 
 
 @require_http_methods('GET')
 def get_home(request):
 
-    schools = School.objects.all()
+    schools = geography.get_schools()
     context = {
         'schools': schools
     }
@@ -7,7 +7,7 @@ from .models import (
     Lodge,
     RoomType,
     RoomProfile,
-
+    DeletedMedia,
 )
 
 from .admin_models import (
@@ -17,6 +17,7 @@ from .admin_models import (
     SchoolAdmin,
     LodgeAdmin,
     RoomProfileAdmin,
+    DeletedMediaAdmin,
 )
 
 admin.site.register(State, StateAdmin)
@@ -27,3 +28,4 @@ admin.site.register(School, SchoolAdmin)
 admin.site.register(Lodge, LodgeAdmin)
 admin.site.register(RoomType)
 admin.site.register(RoomProfile, RoomProfileAdmin)
+admin.site.register(DeletedMedia, DeletedMediaAdmin)
@@ -58,3 +58,10 @@ class LandmarkAdmin(admin.ModelAdmin):
 class RegionAdmin(admin.ModelAdmin):
     list_display = ('name', 'state', 'school')
     inlines = [LandmarkInline]
+
+
+class DeletedMediaAdmin(admin.ModelAdmin):
+    list_display = ('name', 'attempts', 'created_at')
+    list_filter = ('attempts',)
+    search_fields = ('name',)
+    readonly_fields = ('name', 'created_at', 'last_error')
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(sender, **kwargs):
+    from listings.search import create_search_index
+    create_search_index()
 
 
 class ListingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'listings'
+
+    def ready(self):
+        import listings.signals
+        post_migrate.connect(create_search_index, sender=self)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Faceted filtering of vacant rooms
+
+Rooms are filtered on the vacancy index by school, region, room type,
+price band and vacancy. The count of every facet value is computed in
+one aggregate query, each facet counted with the other facets' filters
+applied so the counts show what picking the value would return.
+Counts are cached briefly per filter combination.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from . import geography
+from .models import RoomType, VacantRoom
+
+FACETS_KEY_PREFIX = 'listings:facets:'
+
+# (key, label, lowest price, highest price) in naira, None is unbounded
+PRICE_BANDS = (
+    ('under-100k', 'Under ₦100k', None, 99999),
+    ('100k-200k', '₦100k - ₦200k', 100000, 199999),
+    ('200k-400k', '₦200k - ₦400k', 200000, 399999),
+    ('400k-up', '₦400k and above', 400000, None),
+)
+
+# (key, label, lowest vacancy)
+VACANCY_BUCKETS = (
+    ('1', '1 room or more', 1),
+    ('2', '2 rooms or more', 2),
+    ('5', '5 rooms or more', 5),
+)
+
+
+def parse_filters(params):
+    """
+    Reads the selected facet values from request params,
+    unknown values are dropped
+
+    Returns:
+        dict: school, regions, room_types, price_bands and vacancy.
+    """
+    school = geography.get_school(params.get('school') or '')
+    region_pks = {
+        str(region.pk) for region in
+        (geography.get_regions_for_school(school.pk) if school else [])
+    }
+    room_type_pks = {
+        str(room_type.pk) for room_type in geography.get_snapshot().room_types.values()
+    }
+    bands = {key for key, _, _, _ in PRICE_BANDS}
+    buckets = {key for key, _, _ in VACANCY_BUCKETS}
+
+    vacancy = params.get('vacancy')
+    return {
+        'school': str(school.pk) if school else None,
+        'regions': sorted(set(params.getlist('regions')) & region_pks),
+        'room_types': sorted(set(params.getlist('room_types')) & room_type_pks),
+        'price_bands': sorted(set(params.getlist('price_bands')) & bands),
+        'vacancy': vacancy if vacancy in buckets else None,
+    }
+
+
+def _price_band_q(key):
+    for band_key, _, lowest, highest in PRICE_BANDS:
+        if band_key == key:
+            q = Q()
+            if lowest is not None:
+                q &= Q(price__gte=lowest)
+            if highest is not None:
+                q &= Q(price__lte=highest)
+            return q
+    return Q()
+
+
+def _vacancy_q(key):
+    for bucket_key, _, lowest in VACANCY_BUCKETS:
+        if bucket_key == key:
+            return Q(vacancy__gte=lowest)
+    return Q()
+
+
+def _facet_filters(filters):
+    """The filter of each facet, to be combined as needed"""
+    price_bands = Q()
+    for key in filters['price_bands']:
+        price_bands |= _price_band_q(key)
+
+    return {
+        'regions': Q(region__in=filters['regions']) if filters['regions'] else Q(),
+        'room_types': (Q(room_type__in=filters['room_types'])
+                       if filters['room_types'] else Q()),
+        'price_bands': price_bands,
+        'vacancy': _vacancy_q(filters['vacancy']),
+    }
+
+
+def _excluding(facet_filters, facet):
+    q = Q()
+    for name, facet_q in facet_filters.items():
+        if name != facet:
+            q &= facet_q
+    return q
+
+
+def filter_rooms(filters):
+    """Returns the vacancy index rows matching every selected facet"""
+    if not filters['school']:
+        return VacantRoom.objects.none()
+    q = _excluding(_facet_filters(filters), None)
+    return VacantRoom.objects.filter(school_id=filters['school']).filter(q)
+
+
+def get_facet_counts(filters):
+    """
+    Counts the rooms behind every facet value in one query
+
+    Returns:
+        dict: {'total': n, 'regions': {pk: n}, 'room_types': {pk: n},
+               'price_bands': {key: n}, 'vacancy': {key: n}}
+    """
+    if not filters['school']:
+        return None
+
+    key = FACETS_KEY_PREFIX + '|'.join(
+        f'{name}={",".join(value) if isinstance(value, list) else value}'
+        for name, value in sorted(filters.items())
+    )
+    counts = cache.get(key)
+    if counts is not None:
+        return counts
+
+    facet_filters = _facet_filters(filters)
+    facet_values = {
+        'regions': {
+            str(region.pk): Q(region=region.pk)
+            for region in geography.get_regions_for_school(filters['school'])
+        },
+        'room_types': {
+            str(room_type.pk): Q(room_type=room_type.pk)
+            for room_type in geography.get_snapshot().room_types.values()
+        },
+        'price_bands': {key: _price_band_q(key) for key, _, _, _ in PRICE_BANDS},
+        'vacancy': {key: _vacancy_q(key) for key, _, _ in VACANCY_BUCKETS},
+    }
+
+    aggregates = {'total': Count('pk', filter=_excluding(facet_filters, None))}
+    labels = {}
+    for facet, values in facet_values.items():
+        others = _excluding(facet_filters, facet)
+        for index, (value, value_q) in enumerate(values.items()):
+            alias = f'{facet}_{index}'
+            aggregates[alias] = Count('pk', filter=others & value_q)
+            labels[alias] = (facet, value)
+
+    row = VacantRoom.objects.filter(
+        school_id=filters['school']).aggregate(**aggregates)
+
+    counts = {'total': row.pop('total')}
+    for facet in facet_values:
+        counts[facet] = {}
+    for alias, count in row.items():
+        facet, value = labels[alias]
+        counts[facet][value] = count
+
+    cache.set(key, counts, settings.ROOM_FACETS_CACHE_TTL)
+    return counts
+
+
+def get_facets(filters):
+    """
+    Facet values with their labels, counts and whether they are selected,
+    ready for the filter partial
+
+    Returns:
+        dict: facet name -> list of (value, label, count, selected)
+    """
+    counts = get_facet_counts(filters)
+    if counts is None:
+        return None
+
+    regions = geography.get_regions_for_school(filters['school'])
+    room_types = sorted(
+        geography.get_snapshot().room_types.values(),
+        key=lambda room_type: RoomType.VALID_TYPES.index(room_type.name)
+        if room_type.name in RoomType.VALID_TYPES else len(RoomType.VALID_TYPES)
+    )
+    return {
+        'total': counts['total'],
+        'regions': [
+            (str(region.pk), region.name, counts['regions'].get(str(region.pk), 0),
+             str(region.pk) in filters['regions'])
+            for region in sorted(regions, key=lambda region: region.name)
+        ],
+        'room_types': [
+            (str(room_type.pk), room_type.get_name_display(),
+             counts['room_types'].get(str(room_type.pk), 0),
+             str(room_type.pk) in filters['room_types'])
+            for room_type in room_types
+        ],
+        'price_bands': [
+            (key, label, counts['price_bands'][key], key in filters['price_bands'])
+            for key, label, _, _ in PRICE_BANDS
+        ],
+        'vacancy': [
+            (key, label, counts['vacancy'][key], key == filters['vacancy'])
+            for key, label, _ in VACANCY_BUCKETS
+        ],
+    }
@@ -1,5 +1,6 @@
 from django import forms
 from django.core.validators import RegexValidator
+from django.db import transaction
 
 from .models import (
     Lodge,
@@ -9,11 +10,41 @@ from .models import (
     Landmark,
     School
 )
+from . import geography
+from .signals import lodge_registered
+
+
+class GeographyChoiceField(forms.ModelChoiceField):
+    '''ModelChoiceField that resolves the selected value from the geography cache'''
+
+    def __init__(self, lookup, *args, **kwargs):
+        self.lookup = lookup
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        instance = self.lookup(value)
+        if instance is None:
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value}
+            )
+        return instance
 
 
 class LodgeRegistrationForm(forms.ModelForm):
     '''set basic info about lodge'''
 
+    state = GeographyChoiceField(geography.get_state, queryset=State.objects.all())
+    school = GeographyChoiceField(
+        geography.get_school, queryset=School.objects.all())
+    region = GeographyChoiceField(
+        geography.get_region, queryset=Region.objects.all())
+    landmark = GeographyChoiceField(
+        geography.get_landmark, queryset=Landmark.objects.all(), required=False)
+
     name = forms.CharField(
         # help_text="N/B: If lodge has no name, use the alias field below instead",
         required=False
@@ -43,6 +74,8 @@ class LodgeRegistrationForm(forms.ModelForm):
             'school',
             'region',
             'landmark',
+            'latitude',
+            'longitude',
             'room_types',
             # 'info'
         ]
@@ -52,21 +85,12 @@ class LodgeRegistrationForm(forms.ModelForm):
         }
 
     def save(self, creator, commit=True):
-        state_name = self.cleaned_data.get('state')
-        state = State.objects.all().filter(name=state_name).first()
-
-        school_name = self.cleaned_data.get('school')
-        school = School.objects.all().filter(name=school_name).first()
-
-        region_name = self.cleaned_data.get('region')
-        region = Region.objects.all().filter(name=region_name).first()
-
-        landmark_name = self.cleaned_data.get('landmark')
-        if landmark_name:
-            landmark = Landmark.objects.get(name=landmark_name)
-        else:
-            landmark = None
-
+        """
+        Registers the lodge with a room profile per room type.
+        The geography is taken from the cleaned fields, and the room
+        profiles are bulk created and announced with one lodge_registered
+        signal instead of per room save signals.
+        """
         room_types = self.cleaned_data.get('room_types')
         cover_image = self.cleaned_data.get('cover_image')
         rear_image = self.cleaned_data.get('rear_image')
@@ -79,19 +103,23 @@ class LodgeRegistrationForm(forms.ModelForm):
             lodge.alias = lodge.alias.title()
 
         lodge.creator = creator
-        lodge.state = state
-        lodge.school = school
-        lodge.region = region
-        lodge.landmark = landmark
 
         if commit:
-            lodge.save()
-            lodge.room_types.set(room_types)
-
-            for room_type in lodge.room_types.all():
-                RoomProfile.objects.create(
+            with transaction.atomic():
+                lodge.save()
+                lodge.room_types.set(room_types)
+
+                room_profiles = RoomProfile.objects.bulk_create([
+                    RoomProfile(lodge=lodge, room_type=room_type)
+                    for room_type in room_types
+                ])
+                for room_profile in room_profiles:
+                    room_profile.track_fields()
+
+                lodge_registered.send(
+                    sender=Lodge,
                     lodge=lodge,
-                    room_type=room_type
+                    room_profiles=room_profiles
                 )
             if cover_image:
                 lodge.cover_image = cover_image
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Geohash proximity index for lodges
+
+Lodges store the geohash of their coordinates in an indexed column.
+A radius search picks the geohash length whose cells are at least as
+large as the radius, so the circle always fits in the 3x3 block of
+cells around the centre, and reads each cell as an index range scan.
+Candidates are then checked with the haversine distance. Works on any
+database, no PostGIS needed.
+"""
+from math import asin, cos, radians, sin, sqrt
+
+from django.db.models import Q
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_LENGTH = 12
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def encode(latitude, longitude, length=GEOHASH_LENGTH):
+    """Returns the geohash of a point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < length:
+        value, interval = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def cell_size(length):
+    """Returns the (height, width) of a geohash cell in degrees"""
+    bits = length * 5
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Returns the distance between two points in km"""
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = (sin((lat2 - lat1) / 2) ** 2 +
+         cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def search_length(latitude, radius_km):
+    """The longest geohash whose cells are at least radius_km across"""
+    for length in range(GEOHASH_LENGTH, 0, -1):
+        height, width = cell_size(length)
+        height_km = height * KM_PER_DEGREE
+        width_km = width * KM_PER_DEGREE * cos(radians(latitude))
+        if height_km >= radius_km and width_km >= radius_km:
+            return length
+    return 1
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Returns the geohash cells covering the circle around the point"""
+    length = search_length(latitude, radius_km)
+    height, width = cell_size(length)
+    return sorted({
+        encode(
+            max(min(latitude + dlat * height, 90.0), -90.0),
+            (longitude + dlng * width + 180.0) % 360.0 - 180.0,
+            length
+        )
+        for dlat in (-1, 0, 1)
+        for dlng in (-1, 0, 1)
+    })
+
+
+def cells_q(cells, field='geohash'):
+    """
+    Range filter matching every geohash under the cells, ranges keep
+    the index usable where LIKE 'prefix%' would not be on sqlite
+    """
+    q = Q()
+    for cell in cells:
+        q |= Q(**{f'{field}__gte': cell, f'{field}__lt': cell + '~'})
+    return q
+
+
+def lodges_within(latitude, longitude, radius_km, queryset=None):
+    """
+    Returns the lodges within radius_km of the point, closest first
+
+    Returns:
+        list: (lodge_pk, distance_km) tuples.
+    """
+    from .models import Lodge
+
+    queryset = Lodge.objects.all() if queryset is None else queryset
+    candidates = queryset.filter(
+        cells_q(covering_cells(latitude, longitude, radius_km))
+    ).values_list('pk', 'latitude', 'longitude')
+
+    found = []
+    for pk, lodge_latitude, lodge_longitude in candidates:
+        distance = haversine(latitude, longitude, lodge_latitude, lodge_longitude)
+        if distance <= radius_km:
+            found.append((pk, distance))
+    found.sort(key=lambda lodge: lodge[1])
+    return found
+
+
+def vacant_rooms_near_school(school, radius_km):
+    """
+    Returns the vacancy index rows of lodges within radius_km of the
+    school, closest lodge first
+    """
+    from .models import VacantRoom
+
+    if school.latitude is None or school.longitude is None:
+        return []
+    distances = dict(lodges_within(school.latitude, school.longitude, radius_km))
+    vacant_rooms = list(
+        VacantRoom.objects.filter(lodge_id__in=distances).select_related(
+            'room_profile', 'room_type', 'lodge')
+    )
+    vacant_rooms.sort(key=lambda vacant_room: distances[vacant_room.lodge_id])
+    return vacant_rooms
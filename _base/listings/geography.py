@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+In-process cache of the geography hierarchy
+
+States, schools, regions, landmarks and room types are small and
+rarely change, so each worker loads them once and serves lookups from
+memory. Saves and deletes bump a shared version and publish it on a
+Redis channel, every worker listening drops its copy and reloads on
+the next lookup.
+
+Cached instances are shared by every request in the worker,
+treat them as read-only.
+"""
+from collections import defaultdict
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+from django.core.cache import cache
+
+from .models import Landmark, Region, RoomType, School, State
+
+logger = logging.getLogger('listings')
+
+VERSION_KEY = 'listings:geography:version'
+INVALIDATION_CHANNEL = 'listings:geography:invalidate'
+
+_lock = threading.Lock()
+_snapshot = None
+_listener_pid = None
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'loads': 0, 'invalidations': 0}
+
+
+class GeographySnapshot:
+    """One loaded copy of the hierarchy with its lookup tables"""
+
+    def __init__(self, version):
+        self.version = version
+
+        self.states = {str(state.pk): state for state in State.objects.all()}
+        self.schools = {str(school.pk): school for school in School.objects.all()}
+        self.regions = {str(region.pk): region for region in Region.objects.all()}
+        self.landmarks = {
+            str(landmark.pk): landmark for landmark in Landmark.objects.all()
+        }
+        self.room_types = {
+            str(room_type.pk): room_type for room_type in RoomType.objects.all()
+        }
+
+        self.schools_by_abbr = {
+            school.abbr: school for school in self.schools.values() if school.abbr
+        }
+        self.regions_by_school = defaultdict(list)
+        for region in self.regions.values():
+            self.regions_by_school[str(region.school_id)].append(region)
+
+        self.by_name = {
+            State: _index_by_name(self.states),
+            School: _index_by_name(self.schools),
+            Region: _index_by_name(self.regions),
+            Landmark: _index_by_name(self.landmarks),
+            RoomType: _index_by_name(self.room_types),
+        }
+
+
+def _index_by_name(instances):
+    # the first instance wins, like .filter(name=...).first()
+    index = {}
+    for instance in sorted(instances.values(), key=lambda i: i.created_at):
+        index.setdefault(instance.name, instance)
+    return index
+
+
+def _increment(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_stats():
+    """Returns the hit, miss, load and invalidation counters of this worker"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['version'] = _snapshot.version if _snapshot else None
+    return stats
+
+
+def reset_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def get_snapshot():
+    """Returns the loaded hierarchy, loading it when missing"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None:
+        _increment('hits')
+        return snapshot
+
+    _increment('misses')
+    with _lock:
+        if _snapshot is None:
+            _start_listener()
+            # read the version first, a change committed while
+            # loading then leaves this copy older than the broadcast
+            version = cache.get(VERSION_KEY, 0)
+            _snapshot = GeographySnapshot(version)
+            _increment('loads')
+        return _snapshot
+
+
+def clear():
+    """Drops this worker's copy"""
+    global _snapshot
+    _snapshot = None
+
+
+def invalidate():
+    """Drops the copy of every worker, call after the change is committed"""
+    clear()
+    _increment('invalidations')
+
+    cache.add(VERSION_KEY, 0, timeout=None)
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # evicted between add and incr
+        version = 1
+        cache.set(VERSION_KEY, version, timeout=None)
+
+    redis_url = os.getenv('REDIS_URL')
+    if not redis_url:
+        return
+    try:
+        redis.Redis.from_url(redis_url).publish(INVALIDATION_CHANNEL, version)
+    except redis.RedisError as e:
+        logger.error(f'Geography invalidation broadcast failed: {e}')
+
+
+def _start_listener():
+    """Subscribes this process to invalidations, once per process"""
+    global _listener_pid
+    redis_url = os.getenv('REDIS_URL')
+    # gunicorn forks after the app may have loaded, so track the pid
+    if not redis_url or _listener_pid == os.getpid():
+        return
+    _listener_pid = os.getpid()
+
+    listener = threading.Thread(
+        target=_listen,
+        args=(redis_url,),
+        name='geography-invalidation',
+        daemon=True
+    )
+    listener.start()
+
+
+def _listen(redis_url):
+    while True:
+        try:
+            pubsub = redis.Redis.from_url(redis_url).pubsub()
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                if message['type'] == 'subscribe':
+                    # changes may have been missed while (re)connecting
+                    clear()
+                    continue
+                snapshot = _snapshot
+                if snapshot is None or snapshot.version < int(message['data']):
+                    clear()
+        except redis.RedisError as e:
+            logger.error(f'Geography invalidation listener failed: {e}')
+            time.sleep(1)
+
+
+def _get(table, pk):
+    try:
+        key = str(uuid.UUID(str(pk)))
+    except ValueError:
+        return None
+    return getattr(get_snapshot(), table).get(key)
+
+
+def get_state(pk):
+    return _get('states', pk)
+
+
+def get_school(pk):
+    return _get('schools', pk)
+
+
+def get_region(pk):
+    return _get('regions', pk)
+
+
+def get_landmark(pk):
+    return _get('landmarks', pk)
+
+
+def get_room_type(pk):
+    return _get('room_types', pk)
+
+
+def get_by_name(model, name):
+    """Returns the cached instance of model with the name, or None"""
+    return get_snapshot().by_name[model].get(name)
+
+
+def get_school_by_abbr(abbr):
+    return get_snapshot().schools_by_abbr.get(abbr)
+
+
+def get_schools():
+    return list(get_snapshot().schools.values())
+
+
+def get_regions_for_school(school_pk):
+    return list(get_snapshot().regions_by_school.get(str(school_pk), []))
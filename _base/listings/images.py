@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Background image pipeline for lodge and room images
+
+Uploads are moved to a staging directory on disk and recorded as
+pending rows, the request returns right away. A celery task then
+renders every staged image into resized WebP and JPEG variants plus a
+blurhash placeholder, stores the original and the variants and
+records their urls on the row. Images are rendered inline, prefork
+workers are daemonic and cannot start a process pool of their own,
+the worker concurrency spreads the uploads over the cores instead.
+"""
+from io import BytesIO
+import logging
+import math
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger('listings')
+
+# (format, pillow save options), the first one is the preferred
+VARIANT_FORMATS = (
+    ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+    ('jpeg', {'format': 'JPEG', 'quality': 82, 'optimize': True,
+              'progressive': True}),
+)
+BLURHASH_COMPONENTS = (4, 3)
+BLURHASH_SAMPLE_SIZE = 32
+
+_BASE83 = ('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+           'abcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~')
+
+
+def stage_upload(upload):
+    """
+    Moves an uploaded file to the staging directory, temporary uploads
+    are moved without copying, in-memory ones written out in chunks
+
+    Raises:
+        ValidationError: The file is not an image.
+
+    Returns:
+        str: The staged path.
+    """
+    try:
+        with Image.open(upload) as image:
+            image_format = image.format
+    except (UnidentifiedImageError, OSError):
+        raise ValidationError(f'{upload.name} is not a valid image')
+    upload.seek(0)
+
+    os.makedirs(settings.IMAGE_UPLOAD_STAGING_DIR, exist_ok=True)
+    path = os.path.join(
+        settings.IMAGE_UPLOAD_STAGING_DIR,
+        f'{uuid.uuid4().hex}.{image_format.lower()}'
+    )
+    if hasattr(upload, 'temporary_file_path'):
+        shutil.move(upload.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as staged:
+            for chunk in upload.chunks():
+                staged.write(chunk)
+    return path
+
+
+def queue_uploads(model, uploads, **parent):
+    """
+    Stages the uploads and records them as pending images of the
+    parent, processing starts once the transaction commits
+
+    Args:
+        model: LodgeImage or RoomProfileImage.
+        uploads (list): Uploaded files.
+        parent: The foreign key to the lodge or room profile.
+
+    Returns:
+        list: The created images.
+    """
+    from .tasks import process_uploaded_images
+
+    staged_paths = []
+    try:
+        for upload in uploads:
+            staged_paths.append(stage_upload(upload))
+    except ValidationError:
+        discard_staged(staged_paths)
+        raise
+
+    images = model.objects.bulk_create([
+        model(staged_path=path, **parent) for path in staged_paths
+    ])
+    pks = [image.pk for image in images]
+    transaction.on_commit(
+        lambda: process_uploaded_images.delay(model._meta.label, pks))
+    return images
+
+
+def discard_staged(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def render_variants(path, widths):
+    """
+    Decodes the staged image once and encodes every variant
+
+    Returns:
+        dict: width, height, blurhash and variants as
+        (width, format, bytes) tuples.
+    """
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+    width, height = image.size
+    targets = sorted({min(target, width) for target in widths})
+
+    variants = []
+    for target in targets:
+        resized = image if target == width else image.resize(
+            (target, max(1, round(height * target / width))),
+            Image.Resampling.LANCZOS
+        )
+        for image_format, options in VARIANT_FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, **options)
+            variants.append((target, image_format, buffer.getvalue()))
+
+    sample = image.copy()
+    sample.thumbnail((BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE))
+    return {
+        'width': width,
+        'height': height,
+        'blurhash': encode_blurhash(sample, *BLURHASH_COMPONENTS),
+        'variants': variants,
+    }
+
+
+def process_images(model, pks):
+    """
+    Renders and stores the variants of the pending images
+
+    Returns:
+        int: The number of images processed.
+    """
+    images = {
+        image.staged_path: image for image in model.objects.filter(
+            pk__in=pks,
+            status=model.Status.PENDING,
+            staged_path__isnull=False
+        )
+    }
+    if not images:
+        return 0
+
+    widths = settings.IMAGE_VARIANT_WIDTHS
+    for path, image in images.items():
+        try:
+            _store(image, path, render_variants(path, widths))
+            image.status = model.Status.READY
+        except Exception as e:
+            logger.error(
+                f'Processing {model._meta.label} {image.pk} failed: {e}')
+            image.status = model.Status.FAILED
+            image.variants = {}
+        finally:
+            discard_staged([path])
+        image.staged_path = None
+        image.save(update_fields=[
+            'image', 'status', 'staged_path', 'variants',
+            'blurhash', 'width', 'height'
+        ])
+
+    model.touch_parents({
+        getattr(image, f'{model.parent_field}_id') for image in images.values()
+    })
+    return len(images)
+
+
+def _store(image, path, result):
+    with open(path, 'rb') as staged:
+        image.image.save(os.path.basename(path), File(staged), save=False)
+
+    variants = {}
+    for width, image_format, content in result['variants']:
+        name = default_storage.save(
+            image.variant_name(width, image_format), ContentFile(content))
+        variants.setdefault(image_format, {})[str(width)] = default_storage.url(name)
+
+    image.variants = variants
+    image.blurhash = result['blurhash']
+    image.width = result['width']
+    image.height = result['height']
+
+
+def _encode83(value, length):
+    return ''.join(
+        _BASE83[value // 83 ** (length - i) % 83] for i in range(1, length + 1)
+    )
+
+
+def _to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def encode_blurhash(image, x_components, y_components):
+    """Blurhash of a small RGB image, see https://blurha.sh"""
+    width, height = image.size
+    pixels = [tuple(_to_linear(c) for c in pixel) for pixel in image.getdata()]
+
+    factors = []
+    for j in range(y_components):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pixel = pixels[row + x]
+                    r += basis * pixel[0]
+                    g += basis * pixel[1]
+                    b += basis * pixel[2]
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+        blurhash += _encode83(quantised_max, 1)
+    else:
+        maximum = 1
+        blurhash += _encode83(0, 1)
+
+    blurhash += _encode83(
+        (_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, int(_sign_pow(c / maximum, 0.5) * 9 + 9.5)))
+            for c in factor
+        )
+        blurhash += _encode83(r * 19 * 19 + g * 19 + b, 2)
+    return blurhash
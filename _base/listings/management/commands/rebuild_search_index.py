@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Rebuilds the lodge search index
+
+    python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from listings.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text lodge search index'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = rebuild_search_index()
+        self.stdout.write(f'Indexed {indexed} lodges')
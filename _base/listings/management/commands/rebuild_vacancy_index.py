@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Rebuilds the vacancy index from the room profiles
+
+    python manage.py rebuild_vacancy_index
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from listings.models import VacantRoom
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per region vacancy index from the room profiles'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = VacantRoom.rebuild()
+        self.stdout.write(f'Indexed {indexed} vacant rooms')
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Finds stored lodge and room images no row refers to
+
+    python manage.py reconcile_media [--queue] [--min-age-hours 24]
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from listings.media import BULK_DELETE_LIMIT, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Lists storage page by page and reports or queues orphaned media'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queue', action='store_true',
+            help='Queue the orphans for purging instead of only listing them')
+        parser.add_argument(
+            '--min-age-hours', type=int, default=24,
+            help='Skip files younger than this, their rows may not be committed')
+        parser.add_argument(
+            '--page-size', type=int, default=BULK_DELETE_LIMIT)
+
+    def handle(self, *args, **options):
+        orphans = reconcile(
+            page_size=options['page_size'],
+            min_age=timedelta(hours=options['min_age_hours']),
+            queue=options['queue']
+        )
+        for name in orphans:
+            self.stdout.write(name)
+        action = 'Queued' if options['queue'] else 'Found'
+        self.stdout.write(f'{action} {len(orphans)} orphaned media files')
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Deferred deletion of stored media
+
+Deleting an image row, directly, through a queryset or by cascade,
+leaves a DeletedMedia tombstone per stored file in the same
+transaction. A periodic task purges the files in batches with the
+storage backend's bulk delete, so requests never wait on storage.
+Reconciliation lists storage page by page and queues files no row
+refers to.
+"""
+from datetime import timedelta
+import logging
+import re
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .images import discard_staged
+from .models import DeletedMedia, LodgeImage, RoomProfileImage
+
+logger = logging.getLogger('listings')
+
+# S3 deletes at most this many keys per request
+BULK_DELETE_LIMIT = 1000
+
+# stored files of these models are reconciled, by upload directory
+MEDIA_MODELS = (LodgeImage, RoomProfileImage)
+
+_VARIANT = re.compile(r'^(?P<directory>[^/]+)/variants/(?P<pk>\d+)/')
+
+
+def queue_deletion(names):
+    """Records tombstones for the storage names, part of the caller's transaction"""
+    names = [name for name in names if name]
+    if names:
+        DeletedMedia.objects.bulk_create(
+            [DeletedMedia(name=name) for name in names])
+
+
+def _is_s3(storage):
+    return hasattr(storage, 'bucket') and hasattr(storage, '_normalize_name')
+
+
+def bulk_delete(names, storage=default_storage):
+    """
+    Deletes the files, in one request per BULK_DELETE_LIMIT files on S3
+
+    Returns:
+        dict: {name: error} of the files that could not be deleted.
+    """
+    failed = {}
+    if not _is_s3(storage):
+        for name in names:
+            try:
+                storage.delete(name)
+            except OSError as e:
+                failed[name] = str(e)
+        return failed
+
+    for start in range(0, len(names), BULK_DELETE_LIMIT):
+        keys = {
+            storage._normalize_name(name): name
+            for name in names[start:start + BULK_DELETE_LIMIT]
+        }
+        response = storage.bucket.delete_objects(Delete={
+            'Objects': [{'Key': key} for key in keys],
+            'Quiet': True
+        })
+        for error in response.get('Errors', []):
+            failed[keys.get(error['Key'], error['Key'])] = (
+                f"{error.get('Code')}: {error.get('Message')}")
+    return failed
+
+
+def purge(batch_size=BULK_DELETE_LIMIT, max_attempts=5):
+    """
+    Deletes one batch of tombstoned files and their tombstones,
+    tombstones held by another worker are skipped
+
+    Returns:
+        int: The number of files deleted.
+    """
+    with transaction.atomic():
+        tombstones = list(
+            DeletedMedia.objects.select_for_update(skip_locked=True).filter(
+                attempts__lt=max_attempts
+            ).order_by('created_at').values_list('pk', 'name')[:batch_size]
+        )
+        if not tombstones:
+            return 0
+
+        # a name tombstoned twice is deleted once
+        names = sorted({name for _, name in tombstones})
+        try:
+            failed = bulk_delete(names)
+        except Exception as e:
+            logger.error(f'Media purge failed: {e}')
+            failed = {name: str(e) for name in names}
+
+        purged = [pk for pk, name in tombstones if name not in failed]
+        DeletedMedia.objects.filter(pk__in=purged).delete()
+        for name, error in failed.items():
+            DeletedMedia.objects.filter(
+                pk__in=[pk for pk, tombstoned in tombstones if tombstoned == name]
+            ).update(attempts=F('attempts') + 1, last_error=error)
+
+    if failed:
+        logger.error(f'{len(failed)} media files could not be purged')
+    return len(names) - len(failed)
+
+
+def iter_storage_pages(prefix, page_size=BULK_DELETE_LIMIT, storage=default_storage):
+    """
+    Lists the files under prefix one page at a time
+
+    Yields:
+        list: (name, last_modified) tuples.
+    """
+    if _is_s3(storage):
+        location = storage._normalize_name('')
+        paginator = storage.connection.meta.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=storage.bucket_name,
+            Prefix=storage._normalize_name(prefix),
+            PaginationConfig={'PageSize': page_size}
+        )
+        for page in pages:
+            yield [
+                (item['Key'][len(location):].lstrip('/'), item['LastModified'])
+                for item in page.get('Contents', [])
+            ]
+        return
+
+    page = []
+    for name in _walk(storage, prefix.rstrip('/')):
+        page.append((name, storage.get_modified_time(name)))
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _walk(storage, directory):
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield f'{directory}/{name}'
+    for name in directories:
+        yield from _walk(storage, f'{directory}/{name}')
+
+
+def find_orphans(names):
+    """
+    Returns the names no image row refers to and not already tombstoned,
+    with one query per model and kind of file for the page
+    """
+    names = set(names)
+    referenced = set(DeletedMedia.objects.filter(
+        name__in=names).values_list('name', flat=True))
+
+    for model in MEDIA_MODELS:
+        directory = model._meta.get_field('image').upload_to.rstrip('/')
+        referenced |= set(model.objects.filter(
+            image__in=names).values_list('image', flat=True))
+
+        variants = {}
+        for name in names:
+            match = _VARIANT.match(name)
+            if match and match['directory'] == directory:
+                variants.setdefault(int(match['pk']), []).append(name)
+        for pk in model.objects.filter(pk__in=variants).values_list('pk', flat=True):
+            referenced.update(variants[pk])
+
+    return sorted(names - referenced)
+
+
+def reconcile(page_size=BULK_DELETE_LIMIT, min_age=timedelta(days=1), queue=False):
+    """
+    Finds stored files of the image models that no row refers to.
+    Files younger than min_age are left alone, their row may not be
+    committed yet.
+
+    Returns:
+        list: The orphaned names, queued for purging when queue is set.
+    """
+    cutoff = timezone.now() - min_age
+    orphans = []
+    for model in MEDIA_MODELS:
+        prefix = model._meta.get_field('image').upload_to.rstrip('/') + '/'
+        for page in iter_storage_pages(prefix, page_size):
+            settled = [
+                name for name, modified in page
+                if _aware(modified) < cutoff
+            ]
+            page_orphans = find_orphans(settled)
+            if queue:
+                queue_deletion(page_orphans)
+            orphans += page_orphans
+    return orphans
+
+
+def _aware(moment):
+    if timezone.is_naive(moment):
+        return timezone.make_aware(moment)
+    return moment
+
+
+def discard_staged_upload(instance):
+    """Removes the staged upload of an image deleted before processing"""
+    if instance.staged_path:
+        path = instance.staged_path
+        transaction.on_commit(lambda: discard_staged([path]))
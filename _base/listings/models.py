@@ -4,7 +4,8 @@
 # import aiohttp
 # import asyncio
 # from decouple import config
-from core.models import BaseModel
+from core.models import BaseModel, TrackedFieldsMixin
+from listings import geo
 import os
 
 from django.db import models
@@ -70,6 +71,9 @@ class School(BaseModel):
     )
     abbr = models.CharField(max_length=30, null=True)
 
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+
     subscribed_clients = models.ManyToManyField(
         Client,
         related_name='subscribed_schools',
@@ -211,6 +215,18 @@ class Lodge(BaseModel):
         default=None
     )
 
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+
+    # kept in sync with the coordinates on save, see listings.geo
+    geohash = models.CharField(
+        max_length=12,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True
+    )
+
     # clients_inquired_for_vacancy = models.ManyToManyField(
     #     Client,
     #     related_name='lodges_inquired_for_vacancy',
@@ -219,22 +235,105 @@ class Lodge(BaseModel):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.geohash = self.compute_geohash()
+        if kwargs.get('update_fields') is not None and (
+                {'latitude', 'longitude'} & set(kwargs['update_fields'])):
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'geohash'}
+        super().save(*args, **kwargs)
+
+    def compute_geohash(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return geo.encode(self.latitude, self.longitude)
+
+
+class ProcessedImage(models.Model):
+    """
+    Uploaded image resized into variants in the background,
+    see listings.images
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        READY = 'READY', 'Ready'
+        FAILED = 'FAILED', 'Failed'
+
+    image = models.ImageField(upload_to='images/', blank=True)
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+    # the upload waiting on local disk for the pipeline
+    staged_path = models.CharField(max_length=500, null=True, blank=True)
+    # {'webp': {'320': url, ...}, 'jpeg': {...}}
+    variants = models.JSONField(default=dict, blank=True)
+    blurhash = models.CharField(max_length=100, null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    def srcset(self, image_format='webp'):
+        return ', '.join(
+            f'{url} {width}w'
+            for width, url in self.variants.get(image_format, {}).items()
+        )
+
+    def variant_url(self, width, image_format='jpeg'):
+        """The smallest variant at least width wide, else the largest"""
+        urls = self.variants.get(image_format)
+        if not urls:
+            return self.image.url if self.image else None
+        widths = sorted(int(w) for w in urls)
+        chosen = next((w for w in widths if w >= width), widths[-1])
+        return urls[str(chosen)]
+
+    @property
+    def src(self):
+        """Fallback url for browsers ignoring srcset"""
+        return self.variant_url(640)
+
+    @classmethod
+    def touch_parents(cls, parent_pks):
+        """
+        Bumps updated_at of the lodges or rooms the images belong to,
+        pages cached on it pick up the images
+        """
+        parent_model = cls._meta.get_field(cls.parent_field).related_model
+        parent_model.objects.filter(pk__in=parent_pks).update(
+            updated_at=timezone.now())
+
+    def variant_name(self, width, image_format):
+        directory = self.image.field.upload_to.rstrip('/')
+        return f'{directory}/variants/{self.pk}/{width}.{image_format}'
+
+    def media_names(self):
+        """Storage names of the original and every variant"""
+        names = [self.image.name] if self.image else []
+        for image_format, urls in self.variants.items():
+            names += [self.variant_name(width, image_format) for width in urls]
+        return names
+
+
+class LodgeImage(ProcessedImage):
+    parent_field = 'lodge'
 
-class LodgeImage(models.Model):
     lodge = models.ForeignKey(
         Lodge, related_name='lodge_images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='lodges/')
-    uploaded_at = models.DateTimeField(auto_now_add=True)
+    image = models.ImageField(upload_to='lodges/', blank=True)
 
     def __str__(self):
-        return f"LodgeId: {self.lodge.id}, ImageId: {self.image.id}, ImageUrl: {self.image.url}" if self.image else "No Image"
+        return f"LodgeId: {self.lodge.id}, ImageId: {self.id}, ImageUrl: {self.image.url}" if self.image else "No Image"
 
-    def delete(self, *args, **kwargs):
-        self.image.delete(save=False)
-        super().delete(*args, **kwargs)
 
+class RoomProfile(TrackedFieldsMixin, BaseModel):
+    # read by the vacancy signals
+    tracked_fields = ('is_vacant', 'vacancy', 'room_type_id', 'price')
 
-class RoomProfile(BaseModel):
     price = models.DecimalField(
         max_digits=6,
         decimal_places=0,
@@ -279,15 +378,192 @@ class RoomProfile(BaseModel):
         return f'{self.lodge} - {self.room_type}'
 
 
-class RoomProfileImage(models.Model):
+class VacantRoom(BaseModel):
+    """
+    Vacancy index, one row per vacant room keyed by region and room type.
+    Kept up to date from RoomProfile and Lodge saves so region scoped
+    lookups read this table alone instead of joining through lodges.
+    """
+    room_profile = models.OneToOneField(
+        RoomProfile,
+        on_delete=models.CASCADE,
+        related_name='vacancy_index'
+    )
+
+    region = models.ForeignKey(
+        Region,
+        on_delete=models.CASCADE,
+        related_name='vacant_rooms'
+    )
+
+    room_type = models.ForeignKey(
+        RoomType,
+        on_delete=models.CASCADE,
+        related_name='vacant_rooms'
+    )
+
+    lodge = models.ForeignKey(
+        Lodge,
+        on_delete=models.CASCADE,
+        related_name='vacant_rooms'
+    )
+
+    creator = models.ForeignKey(
+        Creator,
+        on_delete=models.CASCADE,
+        related_name='vacant_rooms'
+    )
+
+    school = models.ForeignKey(
+        School,
+        on_delete=models.CASCADE,
+        related_name='vacant_rooms',
+        null=True
+    )
+
+    price = models.DecimalField(
+        max_digits=6,
+        decimal_places=0,
+        default=0
+    )
+
+    vacancy = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['region', 'room_type']),
+            # random windows of a region's rooms, see subscriptions.sampling
+            models.Index(fields=['region', 'id']),
+            # the room facets filter a school's rooms by region,
+            # room type and price band
+            models.Index(fields=['school', 'region', 'room_type', 'price']),
+            models.Index(fields=['school', 'price']),
+        ]
+
+    def __str__(self):
+        return f'{self.region_id} - {self.room_profile_id}'
+
+    @classmethod
+    def sync(cls, room_profile):
+        """Adds, updates or removes the index row of a room"""
+        if room_profile.vacancy <= 0:
+            cls.objects.filter(room_profile_id=room_profile.pk).delete()
+            return
+
+        cls.index_rooms(room_profile.lodge, [room_profile])
+
+    @classmethod
+    def index_rooms(cls, lodge, room_profiles):
+        """Adds or updates the index rows of vacant rooms of a lodge in one query"""
+        cls.objects.bulk_create(
+            [cls(
+                room_profile_id=room_profile.pk,
+                region_id=lodge.region_id,
+                room_type_id=room_profile.room_type_id,
+                lodge_id=lodge.pk,
+                creator_id=lodge.creator_id,
+                school_id=lodge.school_id,
+                price=room_profile.price,
+                vacancy=room_profile.vacancy
+            ) for room_profile in room_profiles],
+            update_conflicts=True,
+            unique_fields=['room_profile'],
+            update_fields=['region', 'room_type', 'lodge', 'creator',
+                           'school', 'price', 'vacancy', 'updated_at']
+        )
+
+    @classmethod
+    def sync_lodge(cls, lodge):
+        """Moves the index rows of a lodge's rooms with the lodge"""
+        cls.objects.filter(lodge_id=lodge.pk).exclude(
+            region_id=lodge.region_id,
+            creator_id=lodge.creator_id,
+            school_id=lodge.school_id
+        ).update(
+            region_id=lodge.region_id,
+            creator_id=lodge.creator_id,
+            school_id=lodge.school_id,
+            updated_at=timezone.now()
+        )
+
+    @classmethod
+    def rebuild(cls, batch_size=5000):
+        """
+        Rebuilds the whole index, for rooms written without signals
+        e.g with bulk_create or queryset.update()
+
+        Returns:
+            int: The number of vacant rooms indexed.
+        """
+        rows = RoomProfile.objects.filter(vacancy__gt=0).values_list(
+            'pk', 'lodge__region_id', 'room_type_id', 'lodge_id',
+            'lodge__creator_id', 'lodge__school_id', 'price', 'vacancy'
+        )
+        cls.objects.all().delete()
+        vacant_rooms = cls.objects.bulk_create(
+            (cls(
+                room_profile_id=pk,
+                region_id=region_id,
+                room_type_id=room_type_id,
+                lodge_id=lodge_id,
+                creator_id=creator_id,
+                school_id=school_id,
+                price=price,
+                vacancy=vacancy
+            ) for pk, region_id, room_type_id, lodge_id, creator_id,
+                school_id, price, vacancy in rows.iterator()),
+            batch_size=batch_size
+        )
+        return len(vacant_rooms)
+
+    @classmethod
+    def counts(cls, region_pks):
+        """
+        Returns:
+            dict: {(region_pk, room_type_pk): number of vacant rooms}
+        """
+        rows = cls.objects.filter(region__in=region_pks).values(
+            'region_id', 'room_type_id'
+        ).annotate(
+            rooms=models.Count('pk')
+        ).order_by()
+        return {
+            (row['region_id'], row['room_type_id']): row['rooms']
+            for row in rows
+        }
+
+
+class RoomProfileImage(ProcessedImage):
+    parent_field = 'room_profile'
+
     room_profile = models.ForeignKey(
-        Lodge, related_name='room_images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='rooms/')
-    uploaded_at = models.DateTimeField(auto_now_add=True)
+        RoomProfile, related_name='room_images', on_delete=models.CASCADE)
+    image = models.ImageField(upload_to='rooms/', blank=True)
 
     def __str__(self):
-        return f"RoomId: {self.room_profile.id}, ImageId: {self.image.id}, ImageUrl: {self.image.url}" if self.image else "No Image"
+        return f"RoomId: {self.room_profile.id}, ImageId: {self.id}, ImageUrl: {self.image.url}" if self.image else "No Image"
+
+
+class DeletedMedia(BaseModel):
+    """
+    Tombstone of a stored file whose row is gone, written in the same
+    transaction as the delete, cascades included. The files are removed
+    from storage in batches by listings.tasks.purge_deleted_media.
+
+    Attributes:
+    - name: The storage name of the file.
+    - attempts: Failed purge attempts so far.
+    - last_error: Why the last attempt failed.
+    """
+    name = models.CharField(max_length=500)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['name']),
+        ]
 
-    def delete(self, *args, **kwargs):
-        self.image.delete(save=False)
-        super().delete(*args, **kwargs)
+    def __str__(self):
+        return self.name
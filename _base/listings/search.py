@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Full-text lodge search
+
+Lodges are indexed on their name, alias, address, landmark and region.
+Under sqlite3 the index is a pair of FTS5 virtual tables, one over
+every column and a small one over names, under Postgres a tsvector
+column with a GIN index ranked with ts_rank.
+The index is created after migrate and kept up to date by the lodge,
+landmark and region signals.
+"""
+import re
+from uuid import UUID
+
+from django.db import connection
+
+from .models import Lodge
+
+SEARCH_TABLE = 'listings_lodge_search'
+NAME_SEARCH_TABLE = 'listings_lodge_name_search'
+
+# relative weight of each indexed column
+COLUMN_WEIGHTS = {
+    'name': 10.0,
+    'alias': 8.0,
+    'landmark': 4.0,
+    'region': 4.0,
+    'address': 2.0,
+}
+COLUMNS = tuple(COLUMN_WEIGHTS)
+
+# matches on these columns are ranked ahead of the others
+NAME_COLUMNS = ('name', 'alias')
+
+# only the newest this many matches are ranked per pass, so a common
+# word costs about the same as a rare one, see search_lodge_ids
+RANK_WINDOW = 200
+
+# sqlite tables and the columns they index
+SQLITE_TABLES = (
+    (NAME_SEARCH_TABLE, NAME_COLUMNS),
+    (SEARCH_TABLE, COLUMNS),
+)
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def _is_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def create_search_index():
+    """Creates the index table when missing"""
+    with connection.cursor() as cursor:
+        if _is_postgres():
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+                    lodge_id uuid PRIMARY KEY,
+                    document tsvector NOT NULL
+                )''')
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document
+                ON {SEARCH_TABLE} USING GIN (document)''')
+        else:
+            for table, columns in SQLITE_TABLES:
+                cursor.execute(f'''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+                        lodge_id UNINDEXED, {', '.join(columns)},
+                        tokenize='unicode61 remove_diacritics 2',
+                        prefix='2 3'
+                    )''')
+
+
+def _documents(lodge_pks):
+    rows = Lodge.objects.filter(pk__in=lodge_pks).values_list(
+        'pk', 'name', 'alias', 'address', 'landmark__name', 'region__name')
+    for pk, name, alias, address, landmark, region in rows:
+        yield pk, {
+            'name': name or '',
+            'alias': alias or '',
+            'landmark': landmark or '',
+            'region': region or '',
+            'address': address or '',
+        }
+
+
+def index_lodges(lodge_pks):
+    """Adds or refreshes the index entries of the lodges"""
+    lodge_pks = list(lodge_pks)
+    if not lodge_pks:
+        return
+    documents = list(_documents(lodge_pks))
+
+    with connection.cursor() as cursor:
+        if _is_postgres():
+            weights = dict(zip(COLUMNS, 'AABBC'))
+            document = ' || '.join(
+                f"setweight(to_tsvector('simple', %s), '{weights[column]}')"
+                for column in COLUMNS
+            )
+            cursor.executemany(
+                f'''INSERT INTO {SEARCH_TABLE} (lodge_id, document)
+                    VALUES (%s, {document})
+                    ON CONFLICT (lodge_id) DO UPDATE
+                    SET document = EXCLUDED.document''',
+                [(pk, *(fields[column] for column in COLUMNS))
+                 for pk, fields in documents]
+            )
+            return
+
+        remove_lodges(lodge_pks, cursor)
+        for table, columns in SQLITE_TABLES:
+            cursor.executemany(
+                f'''INSERT INTO {table} (lodge_id, {', '.join(columns)})
+                    VALUES ({', '.join(['%s'] * (len(columns) + 1))})''',
+                [(pk.hex, *(fields[column] for column in columns))
+                 for pk, fields in documents]
+            )
+
+
+def remove_lodges(lodge_pks, cursor=None):
+    """Drops the index entries of the lodges"""
+    if _is_postgres():
+        keys, tables = list(lodge_pks), (SEARCH_TABLE,)
+    else:
+        keys = [_hex(pk) for pk in lodge_pks]
+        tables = [table for table, _ in SQLITE_TABLES]
+    if not keys:
+        return
+
+    if cursor is None:
+        with connection.cursor() as cursor:
+            return remove_lodges(lodge_pks, cursor)
+    for table in tables:
+        cursor.execute(
+            f'''DELETE FROM {table} WHERE lodge_id IN
+                ({", ".join(["%s"] * len(keys))})''',
+            keys
+        )
+
+
+def _hex(pk):
+    return getattr(pk, 'hex', str(pk).replace('-', ''))
+
+
+def rebuild_search_index(batch_size=2000):
+    """
+    Reindexes every lodge, for lodges written without signals
+
+    Returns:
+        int: The number of lodges indexed.
+    """
+    create_search_index()
+    tables = [SEARCH_TABLE] if _is_postgres() else [
+        table for table, _ in SQLITE_TABLES]
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f'DELETE FROM {table}')
+
+    lodge_pks = list(Lodge.objects.values_list('pk', flat=True))
+    for start in range(0, len(lodge_pks), batch_size):
+        index_lodges(lodge_pks[start:start + batch_size])
+
+    if not _is_postgres():
+        # merge the segments written batch by batch into one
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(
+                    f"INSERT INTO {table}({table}) VALUES ('optimize')")
+    return len(lodge_pks)
+
+
+def search_lodge_ids(query, limit=20):
+    """
+    Returns the ids of the lodges matching the query, best match first.
+    Every word of the query has to match, the last one as a prefix
+    so results show up while typing.
+
+    Lodges matching on their name or alias come first.
+
+    The ranking is approximate for common words: each pass only ranks
+    RANK_WINDOW matches, under sqlite the most recently indexed ones,
+    so when a word matches more lodges than that, better matches
+    outside the window are not returned. Ranking every match of a word shared by a third
+    of 100k lodges costs 20-70ms, the window keeps a search under 10ms.
+    """
+    tokens = _TOKEN.findall((query or '').lower())[:10]
+    if not tokens:
+        return []
+
+    with connection.cursor() as cursor:
+        if _is_postgres():
+            return _search_postgres(cursor, tokens, limit)
+        return _search_sqlite(cursor, tokens, limit)
+
+
+def _search_sqlite(cursor, tokens, limit):
+    # bm25 counts every match of each term to weigh it, which costs as
+    # much as the term is common, so the window is scored here instead
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+
+    lodge_ids = []
+    for table, columns in SQLITE_TABLES:
+        cursor.execute(
+            f'''SELECT lodge_id, {', '.join(columns)} FROM {table}
+                WHERE {table} MATCH %s ORDER BY rowid DESC LIMIT %s''',
+            [' '.join(terms), RANK_WINDOW]
+        )
+        scores = {
+            lodge_id: _score(tokens, zip(columns, texts))
+            for lodge_id, *texts in cursor.fetchall()
+            if lodge_id not in lodge_ids
+        }
+        lodge_ids += sorted(scores, key=scores.get, reverse=True)
+        if len(lodge_ids) >= limit:
+            break
+
+    return lodge_ids[:limit]
+
+
+def _score(tokens, texts):
+    """Column weighted share of the words matching the query"""
+    score = 0.0
+    last = len(tokens) - 1
+    for column, text in texts:
+        words = _TOKEN.findall(text.lower())
+        if not words:
+            continue
+        hits = sum(
+            1 for index, token in enumerate(tokens) for word in words
+            if word == token or (index == last and word.startswith(token))
+        )
+        score += COLUMN_WEIGHTS[column] * hits / len(words)
+    return score
+
+
+def _search_postgres(cursor, tokens, limit):
+    terms = [f"'{token}'" for token in tokens]
+    terms[-1] += ':*'
+    cursor.execute(
+        f'''SELECT lodge_id FROM (
+                SELECT lodge_id, document FROM {SEARCH_TABLE}
+                WHERE document @@ to_tsquery('simple', %s)
+                LIMIT %s
+            ) candidates
+            ORDER BY ts_rank('{{0.2, 0.4, 0.8, 1.0}}', document,
+                             to_tsquery('simple', %s)) DESC
+            LIMIT %s''',
+        [' & '.join(terms), RANK_WINDOW, ' & '.join(terms), limit]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def search_lodges(query, limit=20):
+    """
+    Ranked lodge search
+
+    Returns:
+        list: The matching lodges, best match first.
+    """
+    lodge_ids = [
+        lodge_id if isinstance(lodge_id, UUID) else UUID(lodge_id)
+        for lodge_id in search_lodge_ids(query, limit)
+    ]
+    lodges = Lodge.objects.select_related(
+        'region', 'landmark').in_bulk(lodge_ids)
+    return [lodges[lodge_id] for lodge_id in lodge_ids if lodge_id in lodges]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""signals keeping the vacancy index, search index, geography cache
+and media tombstones up to date"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from . import geography, media, search
+from .models import (
+    Landmark,
+    Lodge,
+    LodgeImage,
+    Region,
+    RoomProfile,
+    RoomProfileImage,
+    RoomType,
+    School,
+    State,
+    VacantRoom
+)
+
+# sent once a lodge and all its room profiles are registered,
+# the room profiles are bulk created so no per room signals fire
+# kwargs: lodge, room_profiles
+lodge_registered = Signal()
+
+
+@receiver(post_save, sender=RoomProfile)
+def index_room_vacancy(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and not instance.tracked_fields_changed(
+            'vacancy', 'room_type_id', 'price'):
+        return
+    if instance.vacancy <= 0 and (created or not instance.tracked_fields_changed('vacancy')):
+        # occupied before and after, there is no index row to touch
+        return
+    VacantRoom.sync(instance)
+
+
+@receiver(post_save, sender=Lodge)
+def index_lodge_move(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    VacantRoom.sync_lodge(instance)
+
+
+@receiver(post_save, sender=Lodge)
+def index_lodge_search(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_lodges([instance.pk])
+
+
+@receiver(post_delete, sender=Lodge)
+def remove_lodge_search(sender, instance, **kwargs):
+    search.remove_lodges([instance.pk])
+
+
+@receiver(post_save, sender=Landmark)
+@receiver(post_save, sender=Region)
+def reindex_renamed_place(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    search.index_lodges(instance.lodges.values_list('pk', flat=True))
+
+
+@receiver(lodge_registered)
+def index_registered_rooms(sender, lodge, room_profiles, **kwargs):
+    vacant_rooms = [
+        room_profile for room_profile in room_profiles
+        if room_profile.vacancy > 0
+    ]
+    if vacant_rooms:
+        VacantRoom.index_rooms(lodge, vacant_rooms)
+
+
+def invalidate_geography(sender, **kwargs):
+    # drop this worker's copy right away, the others once committed
+    geography.clear()
+    transaction.on_commit(geography.invalidate)
+
+
+for model in (State, School, Region, Landmark, RoomType):
+    post_save.connect(
+        invalidate_geography, sender=model,
+        dispatch_uid=f'invalidate_geography_save_{model.__name__}')
+    post_delete.connect(
+        invalidate_geography, sender=model,
+        dispatch_uid=f'invalidate_geography_delete_{model.__name__}')
+
+
+@receiver(post_delete, sender=LodgeImage)
+@receiver(post_delete, sender=RoomProfileImage)
+def queue_media_deletion(sender, instance, origin=None, **kwargs):
+    # also sent for queryset and cascade deletes, unlike Model.delete
+    media.queue_deletion(instance.media_names())
+    media.discard_staged_upload(instance)
+
+    # the parent is going too when the delete cascades from it
+    if isinstance(origin, sender) or getattr(origin, 'model', None) is sender:
+        sender.touch_parents([getattr(instance, f'{sender.parent_field}_id')])
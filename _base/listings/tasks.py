@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+from celery import shared_task
+from django.apps import apps
+
+from . import images, media
+import logging
+
+logger = logging.getLogger('listings')
+
+
+@shared_task
+def process_uploaded_images(model_label, pks):
+    """Renders the variants of freshly uploaded lodge or room images"""
+    processed = images.process_images(apps.get_model(model_label), pks)
+    logger.info(f'Processed {processed} {model_label} images')
+
+
+@shared_task
+def purge_deleted_media(batches=10):
+    """
+    Periodic sweep (celery beat) that deletes tombstoned media files
+    in bulk, a few batches per run so one run stays short
+    """
+    purged = 0
+    for _ in range(batches):
+        deleted = media.purge()
+        purged += deleted
+        if not deleted:
+            break
+    if purged:
+        logger.info(f'Purged {purged} deleted media files')
@@ -1,3 +1,779 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import BytesIO, StringIO
+import os
+import random
+import shutil
+import tempfile
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.tests import (
+    create_creator,
+    create_lodge,
+    create_region,
+    create_room_profile
+)
+from listings import geo, geography, images, media
+from listings.facets import filter_rooms, get_facet_counts, parse_filters
+from listings.search import RANK_WINDOW, rebuild_search_index, search_lodges
+from listings.forms import LodgeRegistrationForm
+from listings.models import (
+    DeletedMedia,
+    Landmark,
+    Lodge,
+    LodgeImage,
+    Region,
+    RoomProfile,
+    RoomProfileImage,
+    RoomType,
+    VacantRoom
+)
+from PIL import Image
+
+
+class VacantRoomIndexTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+        self.lodge = create_lodge(self.region, create_creator())
+
+    def test_indexes_vacant_rooms(self):
+        room_profile = create_room_profile(self.lodge, vacancy=2)
+        create_room_profile(self.lodge, vacancy=0)
+
+        vacant_room = VacantRoom.objects.get()
+        self.assertEqual(vacant_room.room_profile, room_profile)
+        self.assertEqual(vacant_room.region, self.region)
+        self.assertEqual(vacant_room.creator, self.lodge.creator)
+        self.assertEqual(vacant_room.vacancy, 2)
+
+    def test_follows_vacancy_changes(self):
+        room_profile = create_room_profile(self.lodge, vacancy=1)
+
+        room_profile.vacancy = 3
+        room_profile.save()
+        self.assertEqual(VacantRoom.objects.get().vacancy, 3)
+
+        room_profile.vacancy = 0
+        room_profile.save()
+        self.assertFalse(VacantRoom.objects.exists())
+
+    def test_refresh_from_db_resets_tracked_fields(self):
+        room_profile = create_room_profile(self.lodge, vacancy=1)
+        RoomProfile.objects.filter(pk=room_profile.pk).update(vacancy=0)
+
+        room_profile.refresh_from_db()
+        self.assertFalse(room_profile.tracked_fields_changed())
+
+        room_profile.vacancy = 1
+        self.assertTrue(room_profile.tracked_fields_changed('vacancy'))
+
+    def test_follows_lodge_moves(self):
+        create_room_profile(self.lodge, vacancy=1)
+        other_region = Region.objects.create(
+            name='Aluu', state=self.region.state, school=self.region.school)
+
+        self.lodge.region = other_region
+        self.lodge.save()
+
+        self.assertEqual(VacantRoom.objects.get().region, other_region)
+
+    def test_rebuild_indexes_rooms_written_without_signals(self):
+        room_type = RoomType.objects.create(name=RoomType.Type.ONE_ROOM)
+        RoomProfile.objects.bulk_create([
+            RoomProfile(lodge=self.lodge, room_type=room_type, vacancy=1)
+            for _ in range(3)
+        ])
+        self.assertFalse(VacantRoom.objects.exists())
+
+        self.assertEqual(VacantRoom.rebuild(), 3)
+        self.assertEqual(VacantRoom.objects.count(), 3)
+
+    def test_counts_per_region_and_room_type(self):
+        room_profile = create_room_profile(self.lodge, vacancy=1)
+        create_room_profile(self.lodge, vacancy=1)
+
+        self.assertEqual(
+            VacantRoom.counts([self.region.pk]),
+            {(self.region.pk, room_profile.room_type_id): 2}
+        )
+
+
+class LodgeRegistrationFormTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+        self.creator = create_creator()
+        self.room_types = [
+            RoomType.objects.create(name=name) for name in RoomType.VALID_TYPES
+        ]
+        geography.get_snapshot()
+
+    def register(self, room_types):
+        form = LodgeRegistrationForm(data={
+            'name': 'test lodge',
+            'address': '1 Choba Road',
+            'phone_number': '08000000000',
+            'state': self.region.state.pk,
+            'school': self.region.school.pk,
+            'region': self.region.pk,
+            'room_types': [room_type.pk for room_type in room_types],
+        })
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(form.is_valid(), form.errors)
+            lodge = form.save(creator=self.creator)
+        return lodge, len(queries)
+
+    def test_registers_room_profile_per_room_type(self):
+        lodge, _ = self.register(self.room_types)
+
+        self.assertEqual(lodge.name, 'Test Lodge')
+        self.assertEqual(lodge.region, self.region)
+        self.assertEqual(lodge.state, self.region.state)
+        self.assertEqual(
+            set(lodge.room_profiles.values_list('room_type', flat=True)),
+            {room_type.pk for room_type in self.room_types}
+        )
+
+    def test_query_count_is_bounded(self):
+        _, one_room_type = self.register(self.room_types[:1])
+        _, five_room_types = self.register(self.room_types)
+
+        self.assertEqual(one_room_type, five_room_types)
+
+
+class GeographyCacheTests(TestCase):
+    def setUp(self):
+        geography.clear()
+        geography.reset_stats()
+        self.region = create_region()
+
+    def test_lookups_are_served_from_memory(self):
+        geography.get_snapshot()
+
+        with self.assertNumQueries(0):
+            school = geography.get_school_by_abbr('UNIPORT')
+            self.assertEqual(geography.get_region(self.region.pk), self.region)
+            self.assertEqual(geography.get_region(str(self.region.pk)), self.region)
+            self.assertEqual(
+                geography.get_regions_for_school(school.pk), [self.region])
+            self.assertEqual(
+                geography.get_by_name(Region, 'Choba'), self.region)
+            self.assertIsNone(geography.get_region('not-a-uuid'))
+
+        stats = geography.get_stats()
+        self.assertEqual(stats['loads'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 5)
+
+    def test_saves_invalidate_the_cache(self):
+        geography.get_snapshot()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            region = Region.objects.create(
+                name='Aluu', state=self.region.state, school=self.region.school)
+
+        self.assertEqual(geography.get_region(region.pk), region)
+        self.assertEqual(geography.get_stats()['loads'], 2)
+        self.assertEqual(geography.get_stats()['invalidations'], 1)
+
+
+class RoomFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        geography.clear()
+        self.choba = create_region()
+        self.aluu = Region.objects.create(
+            name='Aluu', state=self.choba.state, school=self.choba.school)
+        self.one_room = RoomType.objects.create(name=RoomType.Type.ONE_ROOM)
+        self.self_contained = RoomType.objects.create(
+            name=RoomType.Type.SELF_CONTAINED)
+
+        creator = create_creator()
+        choba_lodge = create_lodge(self.choba, creator)
+        aluu_lodge = create_lodge(self.aluu, creator)
+        create_room_profile(choba_lodge, self.one_room, price=80000, vacancy=1)
+        create_room_profile(choba_lodge, self.self_contained, price=150000, vacancy=3)
+        create_room_profile(aluu_lodge, self.one_room, price=90000, vacancy=2)
+        create_room_profile(aluu_lodge, self.self_contained, price=250000, vacancy=0)
+
+    def filters(self, **params):
+        query = QueryDict(mutable=True)
+        query['school'] = str(self.choba.school.pk)
+        for name, values in params.items():
+            query.setlist(name, values if isinstance(values, list) else [values])
+        return parse_filters(query)
+
+    def test_filters_on_every_facet(self):
+        rooms = filter_rooms(self.filters(
+            room_types=[str(self.one_room.pk)],
+            price_bands=['under-100k'],
+            vacancy='2'
+        ))
+
+        self.assertEqual(
+            list(rooms.values_list('region', flat=True)), [self.aluu.pk])
+
+    def test_counts_every_facet_in_one_query(self):
+        filters = self.filters(regions=[str(self.choba.pk)])
+        geography.get_snapshot()
+
+        with self.assertNumQueries(1):
+            counts = get_facet_counts(filters)
+
+        self.assertEqual(counts['total'], 2)
+        # a facet's own selection does not narrow its counts
+        self.assertEqual(counts['regions'], {
+            str(self.choba.pk): 2, str(self.aluu.pk): 1})
+        self.assertEqual(counts['room_types'], {
+            str(self.one_room.pk): 1, str(self.self_contained.pk): 1})
+        self.assertEqual(counts['price_bands']['under-100k'], 1)
+        self.assertEqual(counts['vacancy'], {'1': 2, '2': 1, '5': 0})
+
+        with self.assertNumQueries(0):
+            get_facet_counts(filters)
+
+    def test_unknown_values_are_dropped(self):
+        filters = self.filters(regions=['nope'], price_bands=['free'], vacancy='9')
+
+        self.assertEqual(filters['regions'], [])
+        self.assertEqual(filters['price_bands'], [])
+        self.assertIsNone(filters['vacancy'])
+
+    def test_filter_view_renders_partial(self):
+        response = self.client.get(reverse('filter_rooms'), {
+            'school': str(self.choba.school.pk),
+            'price_bands': 'under-100k'
+        })
+
+        self.assertContains(response, '2 vacant rooms')
+        self.assertTemplateUsed(response, 'listings/room-filter-partial.html')
+
+
+class LodgeSearchTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+        self.creator = create_creator()
+
+    def test_matches_name_prefix_and_places(self):
+        landmark = Landmark.objects.create(
+            name='Delta Park', region=self.region, state=self.region.state)
+        lodge = create_lodge(
+            self.region, self.creator, name='Emerald Court', landmark=landmark)
+        create_lodge(self.region, self.creator, name='Ruby House')
+
+        self.assertEqual(search_lodges('emer'), [lodge])
+        self.assertEqual(search_lodges('emerald delta'), [lodge])
+        self.assertEqual(len(search_lodges('choba')), 2)
+        self.assertEqual(search_lodges('sapphire'), [])
+
+    def test_ranks_name_matches_first(self):
+        by_address = create_lodge(
+            self.region, self.creator, name='Ruby House', address='Opposite Emerald Court')
+        by_name = create_lodge(self.region, self.creator, name='Emerald Court')
+
+        self.assertEqual(search_lodges('emerald'), [by_name, by_address])
+
+    def test_common_words_rank_recent_matches(self):
+        Lodge.objects.bulk_create([
+            Lodge(
+                name=f'Lodge of the Emerald Court Annex {index}',
+                phone_number='08000000000',
+                region=self.region,
+                state=self.region.state,
+                school=self.region.school,
+                creator=self.creator
+            )
+            for index in range(RANK_WINDOW + 100)
+        ])
+        rebuild_search_index()
+        best = create_lodge(self.region, self.creator, name='Lodge')
+
+        self.assertEqual(search_lodges('lodge')[0], best)
+
+    def test_follows_updates_and_deletes(self):
+        lodge = create_lodge(self.region, self.creator, name='Emerald Court')
+
+        self.region.name = 'Alakahia'
+        self.region.save()
+        self.assertEqual(search_lodges('alakahia'), [lodge])
+
+        lodge.name = 'Onyx Villa'
+        lodge.save()
+        self.assertEqual(search_lodges('emerald'), [])
+
+        lodge.delete()
+        self.assertEqual(search_lodges('onyx'), [])
+
+    def test_search_view_renders_partial(self):
+        create_lodge(self.region, self.creator, name='Emerald Court')
+
+        response = self.client.get(reverse('search_lodges'), {'q': 'emerald'})
+
+        self.assertContains(response, 'Emerald Court')
+        self.assertTemplateUsed(response, 'listings/search-results-partial.html')
+
+
+class ProximityTests(TestCase):
+    # around the University of Port Harcourt
+    LATITUDE, LONGITUDE = 4.9027, 6.9228
+
+    def setUp(self):
+        self.region = create_region()
+        self.creator = create_creator()
+        self.school = self.region.school
+        self.school.latitude, self.school.longitude = self.LATITUDE, self.LONGITUDE
+        self.school.save()
+
+    def create_lodge_at(self, latitude, longitude, **kwargs):
+        return create_lodge(self.region, self.creator,
+                            latitude=latitude, longitude=longitude, **kwargs)
+
+    def test_encode(self):
+        self.assertEqual(geo.encode(42.605, -5.603, 5), 'ezs42')
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_lodge_geohash_follows_coordinates(self):
+        lodge = self.create_lodge_at(self.LATITUDE, self.LONGITUDE)
+        self.assertEqual(lodge.geohash, geo.encode(self.LATITUDE, self.LONGITUDE))
+
+        lodge.latitude = 5.0
+        lodge.save(update_fields=['latitude'])
+        lodge.refresh_from_db()
+        self.assertEqual(lodge.geohash, geo.encode(5.0, self.LONGITUDE))
+
+        lodge.latitude = None
+        lodge.save()
+        self.assertIsNone(Lodge.objects.get(pk=lodge.pk).geohash)
+
+    def test_lodges_within_matches_haversine_scan(self):
+        rng = random.Random(0)
+        for _ in range(300):
+            self.create_lodge_at(self.LATITUDE + rng.uniform(-0.2, 0.2),
+                                 self.LONGITUDE + rng.uniform(-0.2, 0.2))
+        points = Lodge.objects.values_list('pk', 'latitude', 'longitude')
+
+        for radius in (0.5, 2, 5, 12):
+            expected = {
+                pk for pk, latitude, longitude in points
+                if geo.haversine(self.LATITUDE, self.LONGITUDE,
+                                 latitude, longitude) <= radius
+            }
+            found = geo.lodges_within(self.LATITUDE, self.LONGITUDE, radius)
+            self.assertEqual({pk for pk, _ in found}, expected)
+            distances = [distance for _, distance in found]
+            self.assertEqual(distances, sorted(distances))
+
+    def test_lodges_within_across_cell_edges(self):
+        # a point on a geohash cell corner, neighbours in every direction
+        latitude, longitude = 0.0, 0.0
+        offsets = (-0.004, 0.004)
+        for dlat in offsets:
+            for dlng in offsets:
+                self.create_lodge_at(latitude + dlat, longitude + dlng)
+
+        self.assertEqual(len(geo.lodges_within(latitude, longitude, 1)), 4)
+
+    def test_vacant_rooms_near_school(self):
+        near = self.create_lodge_at(self.LATITUDE + 0.01, self.LONGITUDE)
+        nearer = self.create_lodge_at(self.LATITUDE, self.LONGITUDE + 0.001)
+        far = self.create_lodge_at(self.LATITUDE + 0.5, self.LONGITUDE)
+        nowhere = create_lodge(self.region, self.creator)
+        rooms = [create_room_profile(lodge, vacancy=1)
+                 for lodge in (near, nearer, far, nowhere)]
+        create_room_profile(nearer, vacancy=0)
+
+        with self.assertNumQueries(2):
+            vacant_rooms = geo.vacant_rooms_near_school(self.school, 5)
+            self.assertEqual(
+                [vacant_room.room_profile for vacant_room in vacant_rooms],
+                [rooms[1], rooms[0]]
+            )
+
+    def test_school_without_coordinates(self):
+        self.school.latitude = None
+        self.assertEqual(geo.vacant_rooms_near_school(self.school, 5), [])
+
+
+@skipUnless(os.getenv('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run benchmarks')
+class ProximityBenchmark(TransactionTestCase):
+    """
+    Times radius searches over BENCHMARK_LODGE_COUNT lodges (default 100000)
+    spread over Nigeria against a haversine scan of every lodge
+    """
+    def test_benchmark(self):
+        number_of_lodges = int(os.getenv('BENCHMARK_LODGE_COUNT', 100000))
+        region = create_region()
+        creator = create_creator()
+        rng = random.Random(0)
+        for start in range(0, number_of_lodges, 5000):
+            lodges = []
+            for index in range(start, min(start + 5000, number_of_lodges)):
+                lodge = Lodge(
+                    name=f'Lodge {index}',
+                    phone_number='08000000000',
+                    latitude=rng.uniform(4.3, 13.8),
+                    longitude=rng.uniform(2.7, 14.6),
+                    region=region,
+                    state=region.state,
+                    school=region.school,
+                    creator=creator
+                )
+                lodge.geohash = lodge.compute_geohash()
+                lodges.append(lodge)
+            Lodge.objects.bulk_create(lodges)
+
+        centres = [(rng.uniform(5, 13), rng.uniform(3.5, 14)) for _ in range(20)]
+        radius = 5
+
+        def naive(latitude, longitude):
+            return {
+                pk for pk, lodge_latitude, lodge_longitude in
+                Lodge.objects.values_list('pk', 'latitude', 'longitude')
+                if geo.haversine(latitude, longitude,
+                                 lodge_latitude, lodge_longitude) <= radius
+            }
+
+        indexed_timings, naive_timings = [], []
+        for latitude, longitude in centres:
+            start = time.perf_counter()
+            found = geo.lodges_within(latitude, longitude, radius)
+            indexed_timings.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            expected = naive(latitude, longitude)
+            naive_timings.append((time.perf_counter() - start) * 1000)
+            self.assertEqual({pk for pk, _ in found}, expected)
+
+        indexed_timings.sort()
+        naive_timings.sort()
+        p95 = int(len(centres) * 0.95)
+        print(f'\n{number_of_lodges} lodges, {radius}km: '
+              f'geohash p50 {indexed_timings[len(centres) // 2]:.2f}ms '
+              f'p95 {indexed_timings[p95]:.2f}ms, '
+              f'haversine scan p50 {naive_timings[len(centres) // 2]:.2f}ms')
+        self.assertLess(indexed_timings[p95], 10)
+
+
+def make_upload(name='photo.jpg', size=(1600, 1200), color=(200, 40, 40)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def use_temporary_media(testcase):
+    """Points storage and staging at a temporary directory for the test"""
+    media_root = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, media_root)
+    settings_override = override_settings(
+        MEDIA_ROOT=media_root,
+        MEDIA_URL='/media/',
+        STORAGES={
+            'default': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {
+                'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        },
+        IMAGE_UPLOAD_STAGING_DIR=os.path.join(media_root, 'staging')
+    )
+    settings_override.enable()
+    testcase.addCleanup(settings_override.disable)
+
+
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        use_temporary_media(self)
+        self.creator = create_creator()
+        self.lodge = create_lodge(create_region(), self.creator)
+
+    @mock.patch('listings.tasks.process_uploaded_images')
+    def test_upload_returns_before_processing(self, task):
+        self.client.force_login(self.creator)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('upload_lodge_images', args=[self.lodge.pk]),
+                {'images': [make_upload(), make_upload('other.jpg')]}
+            )
+
+        self.assertEqual(response.status_code, 202)
+        pks = [image['id'] for image in response.json()['images']]
+        task.delay.assert_called_once_with('listings.LodgeImage', pks)
+        for image in LodgeImage.objects.all():
+            self.assertEqual(image.status, LodgeImage.Status.PENDING)
+            self.assertTrue(os.path.exists(image.staged_path))
+            self.assertFalse(image.image)
+
+    @mock.patch('listings.tasks.process_uploaded_images')
+    def test_upload_rejects_non_images(self, task):
+        self.client.force_login(self.creator)
+        response = self.client.post(
+            reverse('upload_lodge_images', args=[self.lodge.pk]),
+            {'images': [make_upload(),
+                        SimpleUploadedFile('notes.jpg', b'not an image')]}
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(LodgeImage.objects.exists())
+        self.assertEqual(os.listdir(settings.IMAGE_UPLOAD_STAGING_DIR), [])
+
+    def test_upload_to_another_creators_room(self):
+        room_profile = create_room_profile(
+            create_lodge(self.lodge.region, create_creator()))
+        self.client.force_login(self.creator)
+        response = self.client.post(
+            reverse('upload_room_images', args=[room_profile.pk]),
+            {'images': [make_upload()]}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch('listings.tasks.process_uploaded_images')
+    def test_process_renders_variants(self, task):
+        with self.captureOnCommitCallbacks(execute=True):
+            image, = images.queue_uploads(
+                LodgeImage, [make_upload()], lodge=self.lodge)
+        staged_path = image.staged_path
+
+        self.assertEqual(images.process_images(LodgeImage, [image.pk]), 1)
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, LodgeImage.Status.READY)
+        self.assertIsNone(image.staged_path)
+        self.assertFalse(os.path.exists(staged_path))
+        self.assertEqual((image.width, image.height), (1600, 1200))
+        self.assertEqual(len(image.blurhash), 28)
+        self.assertTrue(image.image.name.startswith('lodges/'))
+
+        self.assertEqual(set(image.variants), {'webp', 'jpeg'})
+        self.assertEqual(set(image.variants['webp']), {'320', '640', '1280'})
+        self.assertEqual(image.variant_url(500, 'webp'), image.variants['webp']['640'])
+        self.assertIn('1280w', image.srcset())
+
+        original = os.path.getsize(image.image.path)
+        variant = os.path.join(
+            settings.MEDIA_ROOT, 'lodges', 'variants', str(image.pk), '640.webp')
+        with Image.open(variant) as rendered:
+            self.assertEqual(rendered.size, (640, 480))
+        self.assertLess(os.path.getsize(variant), original)
+
+        # already processed
+        self.assertEqual(images.process_images(LodgeImage, [image.pk]), 0)
+
+    @mock.patch('listings.tasks.process_uploaded_images')
+    def test_batch_of_uploads(self, task):
+        queued = images.queue_uploads(
+            LodgeImage, [make_upload(), make_upload(size=(800, 600))],
+            lodge=self.lodge)
+
+        images.process_images(LodgeImage, [image.pk for image in queued])
+
+        self.assertEqual(
+            sorted(LodgeImage.objects.values_list('width', 'status')),
+            [(800, 'READY'), (1600, 'READY')]
+        )
+        self.assertEqual(os.listdir(settings.IMAGE_UPLOAD_STAGING_DIR), [])
+
+    @mock.patch('listings.tasks.process_uploaded_images')
+    def test_storage_failure_fails_and_discards(self, task):
+        image, = images.queue_uploads(
+            LodgeImage, [make_upload()], lodge=self.lodge)
+
+        with mock.patch('listings.images._store', side_effect=OSError('storage down')):
+            images.process_images(LodgeImage, [image.pk])
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, LodgeImage.Status.FAILED)
+        self.assertIsNone(image.staged_path)
+        self.assertEqual(os.listdir(settings.IMAGE_UPLOAD_STAGING_DIR), [])
+
+    @mock.patch('listings.tasks.process_uploaded_images')
+    def test_small_images_are_not_upscaled(self, task):
+        room_profile = create_room_profile(self.lodge)
+        image, = images.queue_uploads(
+            RoomProfileImage, [make_upload(size=(500, 300))],
+            room_profile=room_profile)
+
+        images.process_images(RoomProfileImage, [image.pk])
+
+        image.refresh_from_db()
+        self.assertEqual(set(image.variants['jpeg']), {'320', '500'})
+        self.assertTrue(image.image.name.startswith('rooms/'))
+
+    @mock.patch('listings.tasks.process_uploaded_images')
+    def test_unreadable_staged_file_fails(self, task):
+        image, = images.queue_uploads(
+            LodgeImage, [make_upload()], lodge=self.lodge)
+        with open(image.staged_path, 'wb') as staged:
+            staged.write(b'truncated')
+
+        images.process_images(LodgeImage, [image.pk])
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, LodgeImage.Status.FAILED)
+        self.assertEqual(image.variants, {})
+
+    def test_blurhash_of_solid_colour(self):
+        blurhash = images.encode_blurhash(Image.new('RGB', (8, 8), (255, 0, 0)), 4, 3)
+        # 4x3 components, then the average colour
+        self.assertEqual(len(blurhash), 28)
+        self.assertEqual(blurhash[0], 'L')
+        self.assertEqual(blurhash[2:6], images._encode83(0xFF0000, 4))
+
+
+@mock.patch('listings.tasks.process_uploaded_images')
+class MediaDeletionTests(TestCase):
+    def setUp(self):
+        use_temporary_media(self)
+        self.lodge = create_lodge(create_region(), create_creator())
+
+    def create_image(self, model=LodgeImage, **parent):
+        parent = parent or {'lodge': self.lodge}
+        image, = images.queue_uploads(model, [make_upload(size=(500, 400))], **parent)
+        images.process_images(model, [image.pk])
+        image.refresh_from_db()
+        return image
+
+    def stored(self, name):
+        return os.path.exists(os.path.join(settings.MEDIA_ROOT, name))
+
+    def test_cascade_delete_leaves_tombstones(self, task):
+        lodge_image = self.create_image()
+        room_image = self.create_image(
+            RoomProfileImage, room_profile=create_room_profile(self.lodge))
+        names = lodge_image.media_names() + room_image.media_names()
+        # original, 2 widths in 2 formats
+        self.assertEqual(len(names), 10)
+
+        self.lodge.delete()
+
+        self.assertEqual(
+            sorted(DeletedMedia.objects.values_list('name', flat=True)),
+            sorted(names)
+        )
+        # files stay until purged
+        self.assertTrue(all(self.stored(name) for name in names))
+
+        self.assertEqual(media.purge(), 10)
+        self.assertFalse(any(self.stored(name) for name in names))
+        self.assertFalse(DeletedMedia.objects.exists())
+
+    def test_queryset_delete_leaves_tombstones(self, task):
+        image = self.create_image()
+        LodgeImage.objects.filter(pk=image.pk).delete()
+        self.assertEqual(DeletedMedia.objects.count(), 5)
+
+    def test_rolled_back_delete_keeps_files(self, task):
+        image = self.create_image()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                image.delete()
+                raise RuntimeError
+        self.assertFalse(DeletedMedia.objects.exists())
+        self.assertTrue(self.stored(image.image.name))
+
+    def test_pending_image_discards_staged_upload(self, task):
+        image, = images.queue_uploads(LodgeImage, [make_upload()], lodge=self.lodge)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(os.path.exists(image.staged_path))
+        self.assertFalse(DeletedMedia.objects.exists())
+
+    def test_bulk_delete_on_s3(self, task):
+        storage = mock.Mock(spec=['bucket', '_normalize_name'])
+        storage._normalize_name.side_effect = lambda name: f'media/{name}'
+        storage.bucket.delete_objects.side_effect = [{}, {'Errors': [
+            {'Key': 'media/lodges/b.jpg', 'Code': 'AccessDenied', 'Message': 'No'}
+        ]}]
+        names = [f'lodges/{index}.jpg' for index in range(1500)] + ['lodges/b.jpg']
+
+        failed = media.bulk_delete(names, storage)
+
+        self.assertEqual(storage.bucket.delete_objects.call_count, 2)
+        first = storage.bucket.delete_objects.call_args_list[0].kwargs['Delete']
+        self.assertEqual(len(first['Objects']), media.BULK_DELETE_LIMIT)
+        self.assertEqual(failed, {'lodges/b.jpg': 'AccessDenied: No'})
+
+    def test_failed_purge_is_retried(self, task):
+        media.queue_deletion(['lodges/a.jpg', 'lodges/b.jpg'])
+        with mock.patch('listings.media.bulk_delete',
+                        return_value={'lodges/b.jpg': 'AccessDenied: No'}):
+            self.assertEqual(media.purge(), 1)
+
+        tombstone = DeletedMedia.objects.get()
+        self.assertEqual(tombstone.name, 'lodges/b.jpg')
+        self.assertEqual(tombstone.attempts, 1)
+        self.assertEqual(tombstone.last_error, 'AccessDenied: No')
+
+        with mock.patch('listings.media.bulk_delete', return_value={}):
+            self.assertEqual(media.purge(max_attempts=1), 0)
+            self.assertEqual(media.purge(), 1)
+
+    def test_reconcile_finds_orphans(self, task):
+        image = self.create_image()
+        storage = LodgeImage._meta.get_field('image').storage
+        orphan = storage.save('lodges/orphan.jpg', make_upload())
+        orphan_variant = storage.save('lodges/variants/999999/320.webp', make_upload())
+        room_orphan = storage.save('rooms/orphan.jpg', make_upload())
+        media.queue_deletion(['lodges/tombstoned.jpg'])
+        storage.save('lodges/tombstoned.jpg', make_upload())
+
+        self.assertEqual(media.reconcile(page_size=2, min_age=timedelta(0)),
+                         [orphan, orphan_variant, room_orphan])
+        self.assertIn('lodges/variants', image.variant_name(320, 'webp'))
+        # too recent to tell
+        self.assertEqual(media.reconcile(), [])
+
+        call_command('reconcile_media', '--queue', '--min-age-hours', '0',
+                     stdout=StringIO())
+        self.assertEqual(
+            set(DeletedMedia.objects.values_list('name', flat=True)),
+            {orphan, orphan_variant, room_orphan, 'lodges/tombstoned.jpg'}
+        )
+
+
+@skipUnless(os.getenv('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run benchmarks')
+class LodgeSearchBenchmark(TransactionTestCase):
+    """
+    Times ranked search over BENCHMARK_LODGE_COUNT lodges (default 100000)
+    """
+    WORDS = ('emerald', 'ruby', 'onyx', 'pearl', 'royal', 'grace', 'court',
+             'villa', 'house', 'lodge', 'heights', 'garden', 'palace', 'haven')
+
+    def test_benchmark(self):
+        number_of_lodges = int(os.getenv('BENCHMARK_LODGE_COUNT', 100000))
+        region = create_region()
+        creator = create_creator()
+        rng = random.Random(0)
+        for start in range(0, number_of_lodges, 5000):
+            Lodge.objects.bulk_create([
+                Lodge(
+                    name=' '.join(rng.sample(self.WORDS, 2)) + f' {index}',
+                    address=f'{index} ' + ' '.join(rng.sample(self.WORDS, 3)),
+                    phone_number='08000000000',
+                    region=region,
+                    state=region.state,
+                    school=region.school,
+                    creator=creator
+                )
+                for index in range(start, min(start + 5000, number_of_lodges))
+            ])
+        rebuild_search_index()
+
+        queries = ['emerald', 'ruby court', 'pal', 'grace villa 12', 'choba haven']
+        timings = []
+        for query in queries * 20:
+            start = time.perf_counter()
+            search_lodges(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+
+        p50, p95 = timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+        print(f'\n{number_of_lodges} lodges: search p50 {p50:.2f}ms, p95 {p95:.2f}ms')
+        self.assertLess(p95, 10)
@@ -14,5 +14,17 @@ urlpatterns = [
         'update_room_profile/<str:pk>',
         views.update_room_profile,
         name='update_room_profile'
-    )
+    ),
+    path(
+        'lodge_images/<str:pk>/',
+        views.upload_lodge_images,
+        name='upload_lodge_images'
+    ),
+    path(
+        'room_images/<str:pk>/',
+        views.upload_room_images,
+        name='upload_room_images'
+    ),
+    path('search/', views.search_lodges_view, name='search_lodges'),
+    path('rooms/', views.filter_rooms_view, name='filter_rooms')
 ]
@@ -1,7 +1,19 @@
 from django.shortcuts import render, redirect
 from auths.decorators import role_required
 from .forms import LodgeRegistrationForm, RoomProfileForm
-from listings.models import Lodge, RoomType, RoomProfile
+from .facets import filter_rooms, get_facets, parse_filters
+from .images import queue_uploads
+from .search import search_lodges
+from listings.models import (
+    Lodge,
+    LodgeImage,
+    RoomProfile,
+    RoomProfileImage,
+    RoomType
+)
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 from django.forms import formset_factory
 from django.views.decorators.http import require_http_methods
 from django_htmx.http import HttpResponseClientRefresh
@@ -89,3 +101,78 @@ def update_room_profile(request, pk):
         form.save(room_profile)
 
     return redirect('get_lodge_profile', pk=room_profile.lodge.pk)
+
+
+def _queue_image_uploads(request, model, **parent):
+    uploads = request.FILES.getlist('images')
+    if not uploads:
+        return JsonResponse({'error': 'No images uploaded'}, status=400)
+    try:
+        images = queue_uploads(model, uploads, **parent)
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
+
+    logger.info(f'Queued {len(images)} {model.__name__} uploads')
+    # processed in the background, the variants show up once ready
+    return JsonResponse(
+        {'images': [{'id': image.pk, 'status': image.status} for image in images]},
+        status=202
+    )
+
+
+@require_http_methods(["POST"])
+@role_required(['CREATOR'])
+def upload_lodge_images(request, pk):
+    lodge = get_object_or_404(Lodge, pk=pk, creator=request.user)
+    return _queue_image_uploads(request, LodgeImage, lodge=lodge)
+
+
+@require_http_methods(["POST"])
+@role_required(['CREATOR'])
+def upload_room_images(request, pk):
+    room_profile = get_object_or_404(
+        RoomProfile, pk=pk, lodge__creator=request.user)
+    return _queue_image_uploads(
+        request, RoomProfileImage, room_profile=room_profile)
+
+
+@require_http_methods(['GET'])
+def search_lodges_view(request):
+    """
+    Ranked lodge search, renders the results partial for htmx
+    """
+    query = request.GET.get('q', '').strip()
+    lodges = search_lodges(query) if query else []
+
+    context = {
+        'query': query,
+        'lodges': lodges
+    }
+    return render(
+        request,
+        'listings/search-results-partial.html',
+        context
+    )
+
+
+@require_http_methods(['GET'])
+def filter_rooms_view(request):
+    """
+    Faceted room filter, renders the facets with their live counts
+    and the first matching rooms for htmx
+    """
+    filters = parse_filters(request.GET)
+    rooms = filter_rooms(filters).select_related(
+        'room_profile', 'room_type', 'lodge', 'region'
+    ).order_by('price')[:20]
+
+    context = {
+        'filters': filters,
+        'facets': get_facets(filters),
+        'rooms': rooms
+    }
+    return render(
+        request,
+        'listings/room-filter-partial.html',
+        context
+    )
@@ -3,11 +3,21 @@ from celery import shared_task
 import os
 from datetime import datetime
 from email.utils import formataddr
+from django.db import transaction
 from django.urls import reverse
 from subscriptions.views import create_subscribed_listing
 import os
 import logging
-from subscriptions.models import Subscription
+from subscriptions.models import (
+    Subscription,
+    SubscribedListing,
+    SubscriberRegion
+)
+from subscriptions.quota import (
+    RESERVATION_BATCH_SIZE,
+    release_slots,
+    reserve_slots
+)
 from listings.models import RoomProfile
 
 logger = logging.getLogger('messaging')
@@ -125,8 +135,6 @@ def send_initial_subscribed_listings(subscription_pk):
             logger.info(
                 f'Initial subscribed listings successfully sent [client_email: {subscription.client.email}]'
             )
-            subscription.number_of_listings_sent = subscription.subscribed_rooms.count()
-            subscription.save()
             subscribed_listings, creator_email_list = create_subscribed_listing(
                 subscription)
 
@@ -375,30 +383,23 @@ def send_creator_subscription_mail(creator_email_list):
 def send_vacancy_update_mail(pk):
     """
     Sends vacancy updates to all subscribed clients
+
+    Slots, subscribed rooms and listings are committed first and the
+    mail is sent after, so no rows stay locked during the SMTP round
+    trip. A failed send releases them again so the room is offered on
+    the next fan-out.
     Args:
         pk: room_profile pk
             type(str, uuid)
     """
 
-    room_profile = RoomProfile.objects.get(pk=pk)
-    region = room_profile.lodge.region
-
-    subscriptions = Subscription.objects.filter(
-        is_expired=False,
-        transaction__regions=region
-    ).distinct()
-
-    subscriptions_without_room = subscriptions.exclude(
-        subscribed_rooms=room_profile
-    )
+    room_profile = RoomProfile.objects.select_related(
+        'lodge').get(pk=pk)
+    lodge = room_profile.lodge
 
-    for subscription in subscriptions_without_room:
-        subscription.subscribed_rooms.add(room_profile)
-
-    client_emails_list = []
-    for subscription in subscriptions:
-        if subscription.client.email not in client_emails_list:
-            client_emails_list.append(subscription.client.email)
+    # the region's subscribers from the inverted index,
+    # minus the subscriptions already holding the room
+    targets = SubscriberRegion.match(lodge.region_id, room_profile.pk)
 
     html_message = f'''
         <html>
@@ -485,34 +486,94 @@ def send_vacancy_update_mail(pk):
     from_email = formataddr((
         'Upperoom', 'upperoom.ng@gmail.com'
     ))
-    response = send_mail(
-        'Vacancy updates!',
-        '',
-        from_email,
-        client_emails_list,
-        html_message=html_message,
-        fail_silently=False,
-    )
+
+    with transaction.atomic():
+        # capped or concurrently filled subscriptions get no slot
+        granted = reserve_slots(targets)
+        subscription_rows = [
+            (subscription_pk, client_pk, email)
+            for subscription_pk, (client_pk, email) in targets.items()
+            if subscription_pk in granted
+        ]
+
+        if not subscription_rows:
+            logger.info(
+                f'No subscriptions to update for room profile with pk: {pk}')
+            return
+
+        SubscribedRoom = Subscription.subscribed_rooms.through
+        SubscribedRoom.objects.bulk_create(
+            [
+                SubscribedRoom(
+                    subscription_id=subscription_pk,
+                    roomprofile_id=room_profile.pk
+                )
+                for subscription_pk, _, _ in subscription_rows
+            ],
+            ignore_conflicts=True
+        )
+
+        SubscribedListing.objects.bulk_create([
+            SubscribedListing(
+                subscription_id=subscription_pk,
+                room_profile=room_profile,
+                creator_id=lodge.creator_id,
+                client_id=client_pk
+            )
+            for subscription_pk, client_pk, _ in subscription_rows
+        ])
+
+    subscription_pks = [subscription_pk for subscription_pk, _, _ in subscription_rows]
+    client_emails_list = list(dict.fromkeys(
+        email for _, _, email in subscription_rows))
+
+    # sent once the rows are committed, no locks are held over SMTP
+    try:
+        response = send_mail(
+            'Vacancy updates!',
+            '',
+            from_email,
+            client_emails_list,
+            html_message=html_message,
+            fail_silently=False,
+        )
+    except Exception:
+        release_vacancy_update(room_profile.pk, subscription_pks)
+        raise
 
     if response == 0:
+        release_vacancy_update(room_profile.pk, subscription_pks)
         logger.error(
             f'No Vacancy updates sent to clients: {client_emails_list}'
         )
         return
 
-    from subscriptions.models import SubscribedListing
-
-    for subscription in subscriptions:
-        SubscribedListing.objects.create(
-            subscription=subscription,
-            room_profile=room_profile,
-            creator=room_profile.lodge.creator,
-            client=subscription.client
-        )
-
     logger.info(
         f'Vacancy updates sent to clients: {client_emails_list}'
     )
     logger.info(
         f'Subscription listings created: {client_emails_list}'
     )
+
+
+def release_vacancy_update(room_profile_pk, subscription_pks):
+    """
+    Undoes a fan-out whose mail was not sent, the slots are handed
+    back and the room is offered again on the next fan-out
+    """
+    SubscribedRoom = Subscription.subscribed_rooms.through
+    with transaction.atomic():
+        for start in range(0, len(subscription_pks), RESERVATION_BATCH_SIZE):
+            batch = subscription_pks[start:start + RESERVATION_BATCH_SIZE]
+            SubscribedListing.objects.filter(
+                room_profile_id=room_profile_pk,
+                subscription_id__in=batch,
+                status=SubscribedListing.Status.UNVERIFIED
+            ).delete()
+            SubscribedRoom.objects.filter(
+                roomprofile_id=room_profile_pk,
+                subscription_id__in=batch
+            ).delete()
+        release_slots(subscription_pks)
+    logger.info(
+        f'Released {len(subscription_pks)} slot(s) for room profile {room_profile_pk}')
@@ -1,3 +1,92 @@
+from smtplib import SMTPException
+from unittest import mock
+
+from django.core import mail
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.tests import (
+    create_creator,
+    create_lodge,
+    create_region,
+    create_room_profile,
+    create_subscription
+)
+from messaging.tasks import send_vacancy_update_mail
+from subscriptions.models import SubscribedListing, Subscription
+
+
+class VacancyFanOutTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+        self.lodge = create_lodge(self.region, create_creator())
+
+    def fan_out(self, number_of_subscribers):
+        room_profile = create_room_profile(self.lodge)
+        for _ in range(number_of_subscribers):
+            create_subscription(self.region)
+
+        with CaptureQueriesContext(connection) as queries:
+            send_vacancy_update_mail(room_profile.pk)
+
+        return room_profile, len(queries)
+
+    def test_fan_out_creates_listings_for_every_subscriber(self):
+        room_profile, _ = self.fan_out(3)
+
+        listings = SubscribedListing.objects.filter(room_profile=room_profile)
+        self.assertEqual(listings.count(), 3)
+        self.assertEqual(room_profile.subscriptions.count(), 3)
+        self.assertEqual(len(mail.outbox[0].to), 3)
+
+    def test_fan_out_skips_subscriptions_holding_room(self):
+        room_profile, _ = self.fan_out(2)
+        send_vacancy_update_mail(room_profile.pk)
+
+        self.assertEqual(
+            SubscribedListing.objects.filter(room_profile=room_profile).count(), 2)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_fan_out_respects_listing_quota(self):
+        full = create_subscription(
+            self.region, number_of_listings_sent=Subscription.LISTING_CAP)
+        room_profile, _ = self.fan_out(2)
+
+        self.assertFalse(full.subscribed_rooms.exists())
+        self.assertEqual(
+            sorted(Subscription.objects.values_list(
+                'number_of_listings_sent', flat=True)),
+            [1, 1, Subscription.LISTING_CAP]
+        )
+
+    def assert_nothing_sent(self, subscription):
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.number_of_listings_sent, 0)
+        self.assertFalse(subscription.subscribed_rooms.exists())
+        self.assertFalse(SubscribedListing.objects.exists())
+
+    def test_failed_send_releases_slots(self):
+        room_profile = create_room_profile(self.lodge)
+        subscription = create_subscription(self.region)
+
+        with mock.patch('messaging.tasks.send_mail', side_effect=SMTPException('down')):
+            with self.assertRaises(SMTPException):
+                send_vacancy_update_mail(room_profile.pk)
+        self.assert_nothing_sent(subscription)
+
+        with mock.patch('messaging.tasks.send_mail', return_value=0):
+            send_vacancy_update_mail(room_profile.pk)
+        self.assert_nothing_sent(subscription)
+
+        # offered again on the next fan-out
+        send_vacancy_update_mail(room_profile.pk)
+        self.assertEqual(
+            SubscribedListing.objects.filter(subscription=subscription).count(), 1)
+
+    def test_query_count_is_constant(self):
+        """benchmark: queries stay flat as the number of subscribers grows"""
+        _, small = self.fan_out(5)
+        _, large = self.fan_out(50)
 
-# Create your tests here.
+        self.assertEqual(small, large)
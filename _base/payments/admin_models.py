@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 '''define user admin models'''
 from django.contrib import admin
-from .models import Transaction
+from .models import PaystackEvent, Transaction
 
 
 class RoomProfileInline(admin.TabularInline):
@@ -19,3 +19,13 @@ class TransactionAdmin(admin.ModelAdmin):
     )
 
     inlines = [RoomProfileInline]
+
+
+@admin.register(PaystackEvent)
+class PaystackEventAdmin(admin.ModelAdmin):
+    list_display = ('event', 'paystack_id', 'status',
+                    'attempts', 'retry_at', 'created_at', 'processed_at')
+    list_filter = ('event', 'status')
+    search_fields = ('paystack_id',)
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at', 'updated_at', 'processed_at')
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Local Paystack stub server for offline load testing
+
+Run it and point the app at it:
+    python manage.py paystack_stub --port 8765
+    PAYSTACK_BASE_URL=http://127.0.0.1:8765
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+import requests
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger('payments')
+
+# the webhook view only accepts events from Paystack's addresses
+WEBHOOK_SOURCE_IP = '52.31.139.75'
+
+# charge ids are unique per stub process, the webhook inbox dedupes on
+# them. Seeded from the clock so a restarted stub does not reuse the ids
+# of an earlier run, kept under the transaction's integer paystack_id,
+# next() on a count is atomic across the server threads
+_charge_ids = itertools.count(int(time.time() * 1000) % 1_000_000_000)
+
+
+def _code(prefix):
+    return f'{prefix}_{uuid4().hex[:15]}'
+
+
+class PaystackStubHandler(BaseHTTPRequestHandler):
+    """Answers the Paystack endpoints used by the app with canned data"""
+
+    server_version = 'PaystackStub/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        logger.debug(f'paystack_stub -> {format % args}')
+
+    def _dispatch(self, method):
+        if self.server.latency:
+            time.sleep(self.server.latency / 1000)
+
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if method == 'GET' and parts == ['bank', 'resolve']:
+            return self._respond(True, {
+                'account_number': params.get('account_number'),
+                'account_name': 'PAYSTACK STUB ACCOUNT',
+                'bank_id': 9
+            })
+        if method == 'POST' and parts == ['customer']:
+            return self._respond(True, {
+                'email': body.get('email'),
+                'customer_code': _code('CUS')
+            })
+        if method == 'POST' and len(parts) == 3 and parts[0] == 'customer' \
+                and parts[2] == 'identification':
+            return self._respond(True, message='Customer Identification in progress')
+        if method == 'DELETE' and len(parts) == 2 and parts[0] == 'customer':
+            return self._respond(True, message='Customer deleted')
+        if method == 'POST' and parts == ['transferrecipient']:
+            return self._respond(True, {
+                'name': body.get('name'),
+                'recipient_code': _code('RCP')
+            })
+        if method == 'POST' and parts == ['transfer']:
+            return self._respond(True, {
+                **body,
+                'status': 'success',
+                'transfer_code': _code('TRF')
+            })
+        if method == 'POST' and parts == ['transfer', 'bulk']:
+            return self._respond(True, [
+                {**transfer, 'status': 'success',
+                    'transfer_code': _code('TRF')}
+                for transfer in body.get('transfers', [])
+            ])
+        if method == 'POST' and parts == ['transaction', 'initialize']:
+            self._schedule_charge_success(body)
+            return self._respond(True, {
+                'authorization_url': f'http://{self.server.server_address[0]}/checkout',
+                'access_code': _code('ACS'),
+                'reference': body.get('reference')
+            })
+
+        return self._respond(False, message='Not found', status_code=404)
+
+    def _respond(self, status, data=None, message='Stub response', status_code=200):
+        payload = json.dumps({
+            'status': status,
+            'message': message,
+            'data': data
+        }).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _schedule_charge_success(self, body):
+        """Pays for the transaction by calling the app's webhook"""
+        if not self.server.webhook_url:
+            return
+
+        payload = json.dumps({
+            'event': 'charge.success',
+            'data': {
+                'id': next(_charge_ids),
+                'reference': body.get('reference'),
+                'amount': int(body.get('amount', 0)),
+                'status': 'success'
+            }
+        }).encode('utf-8')
+        signature = hmac.new(
+            (os.getenv('PAYSTACK_TEST_KEY') or '').encode('utf-8'),
+            payload,
+            hashlib.sha512
+        ).hexdigest()
+
+        def deliver():
+            try:
+                requests.post(
+                    self.server.webhook_url,
+                    data=payload,
+                    headers={
+                        'Content-Type': 'application/json',
+                        'X-Paystack-Signature': signature,
+                        'X-Real-Ip': WEBHOOK_SOURCE_IP
+                    },
+                    timeout=10
+                )
+            except requests.RequestException as e:
+                logger.error(f'paystack_stub -> webhook delivery failed: {e}')
+
+        timer = threading.Timer(self.server.webhook_delay, deliver)
+        timer.daemon = True
+        timer.start()
+
+
+def create_stub_server(host='127.0.0.1', port=8765, latency=0,
+                       webhook_url=None, webhook_delay=1.0):
+    """
+    Creates the stub server, call serve_forever() on it to start answering
+
+    Args:
+        latency (int): Milliseconds to wait before each response.
+        webhook_url (str): Where to send charge.success after a transaction
+            is initialized, the full payment flow runs offline when set.
+        webhook_delay (float): Seconds to wait before sending the webhook.
+    """
+    server = ThreadingHTTPServer((host, port), PaystackStubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.webhook_url = webhook_url
+    server.webhook_delay = webhook_delay
+    return server
+
+
+class Command(BaseCommand):
+    help = 'Runs a local Paystack stub server for offline load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--latency', type=int, default=0,
+            help='Milliseconds to wait before each response')
+        parser.add_argument(
+            '--webhook-url',
+            help='Webhook to send charge.success to, e.g http://127.0.0.1:8000/payments/webhook/')
+        parser.add_argument(
+            '--webhook-delay', type=float, default=1.0,
+            help='Seconds to wait before sending charge.success')
+
+    def handle(self, *args, **options):
+        server = create_stub_server(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            webhook_url=options['webhook_url'],
+            webhook_delay=options['webhook_delay']
+        )
+        host, port = server.server_address[:2]
+        self.stdout.write(
+            f'Paystack stub listening on http://{host}:{port}\n'
+            f'Set PAYSTACK_BASE_URL=http://{host}:{port} to use it')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
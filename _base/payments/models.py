@@ -1,10 +1,13 @@
 from decimal import Decimal
-import os
 from django.db import models
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
 from django.forms import ValidationError
-import requests
-from core.models import BaseModel
+from core.models import BaseModel, TrackedFieldsMixin
+from . import paystack
+from .paystack import increment_stat, resolve_account_name
 from django.core.validators import RegexValidator
+from requests import RequestException
 
 from users.models import Client, Creator
 from listings.models import Region
@@ -48,7 +51,7 @@ class Transaction(BaseModel):
     )
 
 
-class CreatorTransferInfo(BaseModel):
+class CreatorTransferInfo(TrackedFieldsMixin, BaseModel):
     """
     A Django model that stores transfer-related information for a creator.
 
@@ -128,66 +131,72 @@ class CreatorTransferInfo(BaseModel):
         default=False,
     )
 
-    def increment_balance(self):
-        """Increment the balance by a given amount."""
-        self.balance += BASE_FARE
-        self.save()
+    def increment_balance(self, amount=BASE_FARE):
+        """
+        Atomically increment the balance by a given amount.
+        Uses an UPDATE so account resolution in save() is skipped.
+        """
+        amount = Decimal(amount)
+        if amount < Decimal('0.00'):
+            raise ValidationError("Amount must be non-negative.")
+        CreatorTransferInfo.objects.filter(pk=self.pk).update(
+            balance=F('balance') + amount,
+            updated_at=timezone.now()
+        )
+        self.refresh_from_db(fields=['balance', 'updated_at'])
 
     def decrement_balance(self, amount):
-        """Decrement the balance by a given amount."""
+        """
+        Atomically decrement the balance by a given amount.
+        The update only applies while the balance covers the amount.
+        """
         amount = Decimal(amount)
         if amount < Decimal('0.00'):
             raise ValidationError("Amount must be non-negative.")
-        if self.balance - amount < Decimal('0.00'):
+        updated = CreatorTransferInfo.objects.filter(
+            pk=self.pk,
+            balance__gte=amount
+        ).update(
+            balance=F('balance') - amount,
+            updated_at=timezone.now()
+        )
+        if not updated:
             raise ValidationError("Balance cannot be negative.")
-        self.balance -= amount
-        self.save()
+        self.refresh_from_db(fields=['balance', 'updated_at'])
 
-    def save(self, *args, **kwargs):
-        """Override the save method to perform additional validations and resolve account details before saving the record."""
-        # Step 1: Resolve account details from Paystack
-        resolve_url = f'https://api.paystack.co/bank/resolve?account_number={self.account_number}&bank_code={self.bank_code}'
-        headers = {
-            'Authorization': f'Bearer {os.getenv("PAYSTACK_TEST_KEY")}'
-        }
-
-        resolve_response = requests.get(resolve_url, headers=headers)
-        resolve_data = resolve_response.json()
-
-        if resolve_data.get("status"):
-            self.account_name = resolve_data['data']['account_name']
-        else:
-            raise ValidationError(
-                "Failed to resolve account details. Please check the account number and bank code.")
-
-        if not self.is_validated:
-            # Step 2: Verify creator name with BVN and bank account using Paystack
-            creator_first_name = self.creator.first_name
-            creator_last_name = self.creator.last_name
-
-            verification_url = f'https://api.paystack.co/customer/{self.creator.customer_code}/identification'
-            verification_data = {
-                "country": "NG",
-                "type": "bank_account",
-                "account_number": self.account_number,
-                "bvn": self.bvn,
-                "bank_code": self.bank_code,
-                "first_name": creator_first_name,
-                "last_name": creator_last_name
-            }
+    @classmethod
+    def credit_creators(cls, creator_credits, amount=BASE_FARE):
+        """
+        Credit many creators in a single UPDATE statement.
 
-            verification_response = requests.post(
-                verification_url, headers=headers, json=verification_data)
-            verification_result = verification_response.json()
+        Args:
+            creator_credits (dict): Maps a creator pk to the number of credits.
+            amount (Decimal): The amount of a single credit.
 
-            if not verification_result.get("status"):
-                if verification_result.get("message") != "Customer already validated using the same credentials":
-                    raise ValidationError(
-                        "Failed to verify account details. The name on the bank account does not match the creator's name.")
+        Returns:
+            int: The number of transfer profiles credited.
+        """
+        if not creator_credits:
+            return 0
 
-            self.is_validated = True
+        amount = Decimal(amount)
+        credit = Case(
+            *[
+                When(creator_id=creator_id, then=Value(amount * count))
+                for creator_id, count in creator_credits.items()
+            ],
+            default=Value(Decimal('0.00')),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        )
+        return cls.objects.filter(creator_id__in=creator_credits).update(
+            balance=F('balance') + credit,
+            updated_at=timezone.now()
+        )
+
+    # fields that require the account to be resolved again when changed
+    tracked_fields = ('account_number', 'bank_code', 'bvn')
 
-        super().save(*args, **kwargs)
+    def save(self, *args, **kwargs):
         """
         Override the save method to perform additional validations and resolve account details before saving the record.
 
@@ -196,31 +205,39 @@ class CreatorTransferInfo(BaseModel):
             2. Verify that the resolved account name matches the creator's name and the BVN is correct.
             3. Save the record if all checks pass.
 
+        Both steps only run when the banking details changed since the record was loaded,
+        and resolutions are cached per account number and bank code.
+
         Raises:
-            ValidationError: If account details cannot be resolved or if the creator's name does not match the bank account.
+            ValidationError: If account details cannot be resolved, Paystack cannot be reached
+            or if the creator's name does not match the bank account.
         """
+        if not self.tracked_fields_changed() and self.account_name:
+            increment_stat('resolve_skipped_unchanged')
+            super().save(*args, **kwargs)
+            return
+
+        if not self._state.adding and self.tracked_fields_changed():
+            # new banking details have to be verified again
+            self.is_validated = False
+
         # Step 1: Resolve account details from Paystack
-        resolve_url = f'https://api.paystack.co/bank/resolve?account_number={self.account_number}&bank_code={self.bank_code}'
-        headers = {
-            'Authorization': f'Bearer {os.getenv("PAYSTACK_TEST_KEY")}'
-        }
-
-        resolve_response = requests.get(resolve_url, headers=headers)
-        resolve_data = resolve_response.json()
-
-        # Check if the account resolution API call was successful
-        if resolve_data.get("status"):
-            self.account_name = resolve_data['data']['account_name']
-        else:
+        try:
+            account_name = resolve_account_name(
+                self.account_number, self.bank_code)
+        except RequestException as e:
+            raise ValidationError(
+                "Could not reach Paystack to resolve the account details. Please try again.") from e
+        if account_name is None:
             raise ValidationError(
                 "Failed to resolve account details. Please check the account number and bank code.")
+        self.account_name = account_name
 
         if not self.is_validated:
             # Step 2: Verify creator name with BVN and bank account using Paystack
             creator_first_name = self.creator.first_name
             creator_last_name = self.creator.last_name
 
-            verification_url = f'https://api.paystack.co/customer/{self.creator.customer_code}/identification'
             verification_data = {
                 "country": "NG",
                 "type": "bank_account",
@@ -231,14 +248,19 @@ class CreatorTransferInfo(BaseModel):
                 "last_name": creator_last_name
             }
 
-            verification_response = requests.post(
-                verification_url, headers=headers, json=verification_data)
-            verification_result = verification_response.json()
-            print(verification_result)
+            try:
+                verification_response = paystack.post(
+                    f'customer/{self.creator.get_customer_code()}/identification',
+                    endpoint='customer/identification',
+                    json=verification_data
+                )
+                verification_result = verification_response.json()
+            except (RequestException, ValueError) as e:
+                raise ValidationError(
+                    "Could not reach Paystack to verify the account details. Please try again.") from e
+
             if not verification_result.get("status"):
-                if verification_result.get("message") == "Customer already validated using the same credentials":
-                    pass
-                else:
+                if verification_result.get("message") != "Customer already validated using the same credentials":
                     raise ValidationError(
                         "Failed to verify account details. The name on the bank account does not match the creator's name.")
 
@@ -303,3 +325,56 @@ class CreatorTransaction(BaseModel):
         null=True,
         help_text="The reason for the transfer. Provides context or explanation for why the transaction was made."
     )
+
+
+class PaystackEvent(BaseModel):
+    """
+    Inbox of verified Paystack webhook events.
+
+    The webhook stores each event and answers right away,
+    a worker drains the inbox in batches.
+
+    Attributes:
+    - event: The Paystack event type, e.g 'charge.success'.
+    - paystack_id: The id of the Paystack object the event is about.
+      Retried deliveries share it, so they are stored once.
+    - payload: The event data.
+    - status: Whether the event is pending, processed or failed.
+    - attempts: The number of times processing was attempted.
+    - error: The last processing error.
+    - retry_at: When a failed event is tried again, it stays pending
+      until it runs out of attempts.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        PROCESSED = 'PROCESSED', 'Processed'
+        FAILED = 'FAILED', 'Failed'
+
+    event = models.CharField(max_length=50)
+    paystack_id = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    retry_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['event', 'paystack_id'],
+                name='unique_paystack_event'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at'])
+        ]
+
+    def __str__(self):
+        return f'{self.event} - {self.paystack_id}'
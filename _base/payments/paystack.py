@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Paystack API client shared across the app
+
+All Paystack calls go through one pooled session with keep-alive
+connections, per endpoint timeouts, retries with backoff and a
+latency histogram per endpoint.
+"""
+import os
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('payments')
+
+STATS_KEY_PREFIX = 'paystack:stats:'
+RESOLUTION_KEY_PREFIX = 'paystack:resolve:'
+
+# counters kept in the shared cache so every worker reports the same numbers
+RESOLUTION_STATS = (
+    'resolve_remote_calls',
+    'resolve_cache_hits',
+    'resolve_skipped_unchanged',
+)
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 15)
+ENDPOINT_TIMEOUTS = {
+    'bank/resolve': (3.05, 10),
+    'customer': (3.05, 10),
+    'customer/identification': (3.05, 20),
+    'transaction/initialize': (3.05, 10),
+    'transferrecipient': (3.05, 15),
+    'transfer': (3.05, 30),
+    'transfer/bulk': (3.05, 60),
+}
+
+# upper bounds of the latency buckets in milliseconds, the last is +inf
+LATENCY_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PaystackError(Exception):
+    """Raised when Paystack rejects a request"""
+
+
+_session = None
+_session_lock = threading.Lock()
+
+_latency_lock = threading.Lock()
+_latencies = {}
+
+
+def get_session():
+    """
+    Returns the process wide session, keep-alive connections
+    to Paystack are reused across calls
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def _create_session():
+    # POSTs are only retried when the connection could not be made,
+    # so a transfer is never sent twice
+    retry = Retry(
+        total=settings.PAYSTACK_MAX_RETRIES,
+        connect=settings.PAYSTACK_MAX_RETRIES,
+        read=settings.PAYSTACK_MAX_RETRIES,
+        status=settings.PAYSTACK_MAX_RETRIES,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET', 'DELETE'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=settings.PAYSTACK_POOL_MAXSIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
+
+
+def paystack_request(method, path, endpoint=None, **kwargs):
+    """
+    Sends a request to the Paystack API.
+
+    Args:
+        method (str): The HTTP method.
+        path (str): The path relative to PAYSTACK_BASE_URL, e.g 'transfer/bulk'.
+        endpoint (str): The name used for timeouts and latency metrics,
+            defaults to the path. Set it for paths with ids in them.
+        **kwargs: Passed on to requests, e.g params or json.
+
+    Returns:
+        requests.Response: The Paystack response.
+    """
+    endpoint = endpoint or path
+    headers = {
+        'Authorization': f'Bearer {os.getenv("PAYSTACK_TEST_KEY")}',
+        **kwargs.pop('headers', {})
+    }
+    kwargs.setdefault(
+        'timeout', ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT))
+
+    url = f'{settings.PAYSTACK_BASE_URL}/{path}'
+    start = time.perf_counter()
+    try:
+        return get_session().request(method, url, headers=headers, **kwargs)
+    finally:
+        record_latency(endpoint, (time.perf_counter() - start) * 1000)
+
+
+def get(path, endpoint=None, **kwargs):
+    return paystack_request('GET', path, endpoint, **kwargs)
+
+
+def post(path, endpoint=None, **kwargs):
+    return paystack_request('POST', path, endpoint, **kwargs)
+
+
+def delete(path, endpoint=None, **kwargs):
+    return paystack_request('DELETE', path, endpoint, **kwargs)
+
+
+def record_latency(endpoint, milliseconds):
+    """Adds a call to the latency histogram of the endpoint"""
+    bucket = bisect_left(LATENCY_BUCKETS, milliseconds)
+    with _latency_lock:
+        histogram = _latencies.setdefault(endpoint, {
+            'count': 0,
+            'total_ms': 0.0,
+            'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        })
+        histogram['count'] += 1
+        histogram['total_ms'] += milliseconds
+        histogram['buckets'][bucket] += 1
+
+
+def get_latency_histograms():
+    """
+    Returns the latency histogram of every endpoint called by this process,
+    buckets are keyed by their upper bound in milliseconds
+    """
+    labels = [f'<={bound}ms' for bound in LATENCY_BUCKETS] + [
+        f'>{LATENCY_BUCKETS[-1]}ms']
+    with _latency_lock:
+        return {
+            endpoint: {
+                'count': histogram['count'],
+                'mean_ms': histogram['total_ms'] / histogram['count'],
+                'buckets': dict(zip(labels, histogram['buckets'])),
+            }
+            for endpoint, histogram in _latencies.items()
+        }
+
+
+def reset_latency_histograms():
+    with _latency_lock:
+        _latencies.clear()
+
+
+def increment_stat(name):
+    """Increment a named Paystack counter"""
+    key = f'{STATS_KEY_PREFIX}{name}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.set(key, 1, timeout=None)
+
+
+def get_stats():
+    """
+    Returns the Paystack counters, e.g how many account
+    resolutions were served without a remote call
+    """
+    keys = {f'{STATS_KEY_PREFIX}{name}': name for name in RESOLUTION_STATS}
+    values = cache.get_many(keys.keys())
+    return {name: values.get(key, 0) for key, name in keys.items()}
+
+
+def resolve_account_name(account_number, bank_code):
+    """
+    Resolves the account name for a bank account.
+    Successful resolutions are cached per (account_number, bank_code)
+    for PAYSTACK_RESOLUTION_CACHE_TTL seconds.
+
+    Returns:
+        str: The account name, or None when Paystack cannot resolve it.
+    """
+    key = f'{RESOLUTION_KEY_PREFIX}{account_number}:{bank_code}'
+    account_name = cache.get(key)
+    if account_name is not None:
+        increment_stat('resolve_cache_hits')
+        return account_name
+
+    increment_stat('resolve_remote_calls')
+    response = get(
+        'bank/resolve',
+        params={'account_number': account_number, 'bank_code': bank_code}
+    )
+    resolve_data = response.json()
+
+    if not resolve_data.get('status'):
+        logger.error(
+            f'Account resolution failed: {resolve_data.get("message")}')
+        return None
+
+    account_name = resolve_data['data']['account_name']
+    cache.set(key, account_name, settings.PAYSTACK_RESOLUTION_CACHE_TTL)
+    return account_name
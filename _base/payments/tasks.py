@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+from datetime import timedelta
+
+from celery import shared_task
+from django.db import transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+import logging
+
+from .models import PaystackEvent
+from .utils import handle_charge_success, handle_transfer_event
+
+logger = logging.getLogger('payments')
+
+EVENT_BATCH_SIZE = 100
+# failed events are retried after 1, 2, 4... minutes, about 2 hours in all
+EVENT_MAX_ATTEMPTS = 8
+EVENT_RETRY_DELAY = timedelta(minutes=1)
+TRANSFER_EVENTS = ('transfer.success', 'transfer.failed', 'transfer.reversed')
+
+
+def handle_paystack_event(event, data):
+    if event == 'charge.success':
+        handle_charge_success(data)
+        logger.info('Charge success event handled.')
+    elif event in TRANSFER_EVENTS:
+        handle_transfer_event(event, data)
+        logger.info(f'Transfer event handled: {event}')
+
+
+@shared_task
+def process_paystack_events(batch_size=EVENT_BATCH_SIZE, max_attempts=EVENT_MAX_ATTEMPTS):
+    """
+    Drains pending webhook events from the inbox in batches.
+    Runs after each webhook and periodically (celery beat) for leftovers.
+
+    Paystack's redeliveries are deduplicated by the inbox, so a failed
+    event stays pending and is retried with a growing delay, it is only
+    marked failed once it has used max_attempts.
+    """
+    processed_count = 0
+    now = timezone.now()
+
+    while True:
+        with db_transaction.atomic():
+            events = list(
+                PaystackEvent.objects.select_for_update(
+                    skip_locked=True
+                ).filter(
+                    Q(retry_at__isnull=True) | Q(retry_at__lte=now),
+                    status=PaystackEvent.Status.PENDING
+                ).order_by('created_at')[:batch_size]
+            )
+
+            for paystack_event in events:
+                paystack_event.attempts += 1
+                paystack_event.updated_at = timezone.now()
+                try:
+                    with db_transaction.atomic():
+                        handle_paystack_event(
+                            paystack_event.event, paystack_event.payload)
+                except Exception as e:
+                    logger.error(
+                        f'Paystack event {paystack_event} failed with exception '
+                        f'(attempt {paystack_event.attempts}): {e}')
+                    paystack_event.error = str(e)
+                    if paystack_event.attempts >= max_attempts:
+                        paystack_event.status = PaystackEvent.Status.FAILED
+                        paystack_event.retry_at = None
+                    else:
+                        paystack_event.retry_at = paystack_event.updated_at + (
+                            EVENT_RETRY_DELAY * 2 ** (paystack_event.attempts - 1))
+                else:
+                    paystack_event.status = PaystackEvent.Status.PROCESSED
+                    paystack_event.processed_at = paystack_event.updated_at
+                    paystack_event.retry_at = None
+                    processed_count += 1
+
+            PaystackEvent.objects.bulk_update(
+                events,
+                ['status', 'attempts', 'error', 'retry_at',
+                 'processed_at', 'updated_at']
+            )
+
+        if len(events) < batch_size:
+            break
+
+    return processed_count
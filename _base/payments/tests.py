@@ -1,3 +1,360 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import os
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.core.cache import cache
+from django.forms import ValidationError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.tests import (
+    create_client,
+    create_creator,
+    create_region,
+    create_transfer_profile
+)
+from payments.models import (
+    BASE_FARE,
+    CreatorTransferInfo,
+    PaystackEvent,
+    Transaction
+)
+from payments import paystack
+from payments.management.commands.paystack_stub import create_stub_server
+from payments.paystack import get_stats, resolve_account_name
+from payments.tasks import process_paystack_events
+from payments.utils import create_transfer_recipient, initiate_single_transfer
+from subscriptions.models import Subscription
+
+
+@mock.patch('payments.paystack.paystack_request')
+class CreatorBalanceTests(TestCase):
+    def setUp(self):
+        self.transfer_profile = create_transfer_profile(create_creator())
+
+    def test_increment_balance_skips_account_resolution(self, paystack_request):
+        self.transfer_profile.increment_balance()
+        self.transfer_profile.increment_balance()
+
+        self.assertEqual(self.transfer_profile.balance, BASE_FARE * 2)
+        paystack_request.assert_not_called()
+
+    def test_increment_balance_uses_stored_balance(self, paystack_request):
+        stale = CreatorTransferInfo.objects.get(pk=self.transfer_profile.pk)
+        self.transfer_profile.increment_balance()
+        stale.increment_balance()
+
+        self.assertEqual(stale.balance, BASE_FARE * 2)
+
+    def test_decrement_balance(self, paystack_request):
+        self.transfer_profile.increment_balance(Decimal('120.00'))
+        self.transfer_profile.decrement_balance(Decimal('20.00'))
+
+        self.assertEqual(self.transfer_profile.balance, Decimal('100.00'))
+
+    def test_decrement_balance_cannot_overdraw(self, paystack_request):
+        self.transfer_profile.increment_balance()
+
+        with self.assertRaises(ValidationError):
+            self.transfer_profile.decrement_balance(BASE_FARE + 1)
+
+        self.transfer_profile.refresh_from_db()
+        self.assertEqual(self.transfer_profile.balance, BASE_FARE)
+
+    def test_credit_creators_in_one_query(self, paystack_request):
+        other = create_transfer_profile(create_creator())
+
+        with self.assertNumQueries(1):
+            credited = CreatorTransferInfo.credit_creators({
+                self.transfer_profile.creator_id: 2,
+                other.creator_id: 1,
+            })
+
+        self.assertEqual(credited, 2)
+        self.transfer_profile.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.transfer_profile.balance, BASE_FARE * 2)
+        self.assertEqual(other.balance, BASE_FARE)
+
+
+@mock.patch('payments.paystack.post')
+@mock.patch('payments.paystack.get')
+class CreatorTransferInfoResolutionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.creator = create_creator()
+
+    def mock_paystack(self, paystack_get, paystack_post):
+        paystack_get.return_value.json.return_value = {
+            'status': True,
+            'data': {'account_name': 'ADA OBI'}
+        }
+        paystack_post.return_value.json.return_value = {
+            'status': True
+        }
+
+    def test_save_resolves_new_account(self, paystack_get, paystack_post):
+        self.mock_paystack(paystack_get, paystack_post)
+
+        transfer_info = CreatorTransferInfo.objects.create(
+            creator=self.creator,
+            account_number='0123456789',
+            bank_code='058',
+            bvn='12345678901',
+            currency='NGN'
+        )
+
+        self.assertEqual(transfer_info.account_name, 'ADA OBI')
+        self.assertTrue(transfer_info.is_validated)
+        self.assertEqual(paystack_get.call_count, 1)
+        self.assertEqual(paystack_post.call_count, 1)
+
+    def test_paystack_timeouts_become_validation_errors(self, paystack_get, paystack_post):
+        self.mock_paystack(paystack_get, paystack_post)
+        fields = {
+            'creator': self.creator,
+            'account_number': '0123456789',
+            'bank_code': '058',
+            'bvn': '12345678901',
+            'currency': 'NGN'
+        }
+
+        paystack_get.side_effect = requests.Timeout('read timed out')
+        with self.assertRaises(ValidationError):
+            CreatorTransferInfo.objects.create(**fields)
+
+        paystack_get.side_effect = None
+        paystack_post.side_effect = requests.ConnectionError('reset')
+        with self.assertRaises(ValidationError):
+            CreatorTransferInfo.objects.create(**fields)
+        self.assertFalse(CreatorTransferInfo.objects.exists())
+
+    def test_unchanged_save_skips_paystack(self, paystack_get, paystack_post):
+        self.mock_paystack(paystack_get, paystack_post)
+        CreatorTransferInfo.objects.create(
+            creator=self.creator,
+            account_number='0123456789',
+            bank_code='058',
+            bvn='12345678901',
+            currency='NGN'
+        )
+
+        transfer_info = CreatorTransferInfo.objects.get(creator=self.creator)
+        transfer_info.recipient_code = 'RCP_test'
+        transfer_info.save()
+
+        self.assertEqual(paystack_get.call_count, 1)
+        self.assertEqual(paystack_post.call_count, 1)
+        self.assertEqual(get_stats()['resolve_skipped_unchanged'], 1)
+
+    def test_changed_account_is_resolved_and_verified_again(self, paystack_get, paystack_post):
+        self.mock_paystack(paystack_get, paystack_post)
+        CreatorTransferInfo.objects.create(
+            creator=self.creator,
+            account_number='0123456789',
+            bank_code='058',
+            bvn='12345678901',
+            currency='NGN'
+        )
+
+        transfer_info = CreatorTransferInfo.objects.get(creator=self.creator)
+        transfer_info.account_number = '9876543210'
+        transfer_info.save()
+
+        self.assertEqual(paystack_get.call_count, 2)
+        self.assertEqual(paystack_post.call_count, 2)
+
+    def test_resolution_is_cached(self, paystack_get, paystack_post):
+        self.mock_paystack(paystack_get, paystack_post)
+
+        self.assertEqual(resolve_account_name('0123456789', '058'), 'ADA OBI')
+        self.assertEqual(resolve_account_name('0123456789', '058'), 'ADA OBI')
+
+        self.assertEqual(paystack_get.call_count, 1)
+        stats = get_stats()
+        self.assertEqual(stats['resolve_remote_calls'], 1)
+        self.assertEqual(stats['resolve_cache_hits'], 1)
+
+
+class PaystackClientTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = create_stub_server(port=0)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        host, port = cls.server.server_address[:2]
+        cls.settings_override = override_settings(
+            PAYSTACK_BASE_URL=f'http://{host}:{port}')
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        paystack.reset_latency_histograms()
+
+    def test_requests_reuse_pooled_session(self):
+        paystack.post('customer', json={'email': 'ada@upperoom.test'})
+        paystack.post('customer', json={'email': 'obi@upperoom.test'})
+
+        self.assertIs(paystack.get_session(), paystack.get_session())
+        histograms = paystack.get_latency_histograms()
+        self.assertEqual(histograms['customer']['count'], 2)
+        self.assertEqual(sum(histograms['customer']['buckets'].values()), 2)
+
+    def test_endpoint_timeouts(self):
+        with mock.patch.object(paystack.get_session(), 'request') as request:
+            paystack.post('transfer/bulk', json={})
+            paystack.get('unknown')
+
+        self.assertEqual(
+            request.call_args_list[0].kwargs['timeout'],
+            paystack.ENDPOINT_TIMEOUTS['transfer/bulk'])
+        self.assertEqual(
+            request.call_args_list[1].kwargs['timeout'],
+            paystack.DEFAULT_TIMEOUT)
+
+    def test_payment_flow_against_stub(self):
+        self.assertEqual(
+            paystack.resolve_account_name('0123456789', '058'),
+            'PAYSTACK STUB ACCOUNT')
+
+        transfer_profile = create_transfer_profile(
+            create_creator(), account_name='PAYSTACK STUB ACCOUNT')
+        recipient_code = create_transfer_recipient(transfer_profile)
+        self.assertTrue(recipient_code.startswith('RCP_'))
+
+        response = initiate_single_transfer(
+            recipient_code, Decimal('50.00'), 'reference')
+        self.assertTrue(response['status'])
+        self.assertEqual(
+            set(paystack.get_latency_histograms()),
+            {'bank/resolve', 'transferrecipient', 'transfer'})
+
+
+@mock.patch.dict(os.environ, {'PAYSTACK_TEST_KEY': 'sk_test_webhook'})
+@mock.patch('payments.tasks.process_paystack_events.delay')
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        self.client_user = create_client()
+        self.transaction = Transaction.objects.create(
+            amount=1500,
+            reference='charge-reference',
+            client=self.client_user
+        )
+        self.transaction.regions.add(create_region())
+
+    def deliver(self, event='charge.success', **data):
+        body = json.dumps({
+            'event': event,
+            'data': {
+                'id': 1001,
+                'reference': 'charge-reference',
+                'amount': 150000,
+                **data
+            }
+        }).encode('utf-8')
+        signature = hmac.new(
+            b'sk_test_webhook', body, hashlib.sha512).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('webhook'),
+                data=body,
+                content_type='application/json',
+                headers={
+                    'X-Real-Ip': '52.31.139.75',
+                    'X-Paystack-Signature': signature
+                }
+            )
+
+    def test_webhook_stores_event_and_answers_immediately(self, delay):
+        response = self.deliver()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PaystackEvent.objects.count(), 1)
+        delay.assert_called_once()
+        self.transaction.refresh_from_db()
+        self.assertFalse(self.transaction.is_fully_paid)
+
+    def test_retried_delivery_is_stored_once(self, delay):
+        self.deliver()
+        self.deliver()
+
+        self.assertEqual(PaystackEvent.objects.count(), 1)
+
+    def test_rejects_bad_signature(self, delay):
+        response = self.client.post(
+            reverse('webhook'),
+            data=b'{}',
+            content_type='application/json',
+            headers={
+                'X-Real-Ip': '52.31.139.75',
+                'X-Paystack-Signature': 'invalid'
+            }
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(PaystackEvent.objects.exists())
+
+    @mock.patch('messaging.tasks.send_initial_subscribed_listings.delay')
+    def test_worker_drains_inbox(self, send_listings, delay):
+        self.deliver()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_paystack_events(), 1)
+        self.assertEqual(process_paystack_events(), 0)
+
+        paystack_event = PaystackEvent.objects.get()
+        self.assertEqual(paystack_event.status, PaystackEvent.Status.PROCESSED)
+        self.transaction.refresh_from_db()
+        self.assertTrue(self.transaction.is_fully_paid)
+        self.assertTrue(
+            Subscription.objects.filter(transaction=self.transaction).exists())
+
+    def test_failed_event_is_retried(self, delay):
+        self.deliver()
+
+        with mock.patch('payments.tasks.handle_charge_success',
+                        side_effect=ValueError('boom')):
+            process_paystack_events()
+            # not due again yet
+            process_paystack_events()
+
+        paystack_event = PaystackEvent.objects.get()
+        self.assertEqual(paystack_event.status, PaystackEvent.Status.PENDING)
+        self.assertEqual(paystack_event.attempts, 1)
+        self.assertEqual(paystack_event.error, 'boom')
+        self.assertGreater(paystack_event.retry_at, paystack_event.updated_at)
+
+        PaystackEvent.objects.update(retry_at=timezone.now())
+        with mock.patch('messaging.tasks.send_initial_subscribed_listings.delay'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_paystack_events(), 1)
+        self.transaction.refresh_from_db()
+        self.assertTrue(self.transaction.is_fully_paid)
+
+    def test_event_fails_after_max_attempts(self, delay):
+        self.deliver()
+
+        with mock.patch('payments.tasks.handle_charge_success',
+                        side_effect=ValueError('boom')):
+            for _ in range(3):
+                PaystackEvent.objects.update(retry_at=None)
+                process_paystack_events(max_attempts=3)
+
+        paystack_event = PaystackEvent.objects.get()
+        self.assertEqual(paystack_event.status, PaystackEvent.Status.FAILED)
+        self.assertEqual(paystack_event.attempts, 3)
+        self.assertIsNone(paystack_event.retry_at)
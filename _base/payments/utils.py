@@ -1,15 +1,14 @@
-import os
 import random
 import string
 from typing import List, Union
 
-from django.http import JsonResponse
-import requests
+from django.db import transaction as db_transaction
 
 from subscriptions.models import SubscribedListing
 from messaging.tasks import send_initial_subscribed_listings
 from subscriptions.views import subscribe_for_listing
 from users.models import Creator, User
+from . import paystack
 from .models import CreatorTransaction, CreatorTransferInfo, Transaction
 
 import logging
@@ -59,11 +58,6 @@ def create_transfer_recipient(creator_transfer_info):
     Returns:
         str: The recipient code.
     """
-    url = 'https://api.paystack.co/transferrecipient'
-    headers = {
-        'Authorization': f'Bearer {os.getenv("PAYSTACK_TEST_KEY")}',
-        'Content-Type': 'application/json'
-    }
     data = {
         'type': 'nuban',  # Change as needed based on the recipient's bank account type
         'name': creator_transfer_info.account_name,
@@ -72,7 +66,7 @@ def create_transfer_recipient(creator_transfer_info):
         'currency': creator_transfer_info.currency
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = paystack.post('transferrecipient', json=data)
     response_data = response.json()
 
     if response_data.get('status'):
@@ -100,11 +94,6 @@ def initiate_single_transfer(recipient_code, amount, reference, reason=""):
     Returns:
         dict: The response from the Paystack API.
     """
-    url = 'https://api.paystack.co/transfer'
-    headers = {
-        'Authorization': f'Bearer {os.getenv("PAYSTACK_TEST_KEY")}',
-        'Content-Type': 'application/json'
-    }
     data = {
         'source': 'balance',  # Can be 'balance' or 'subaccount' depending on the source of funds
         'amount': int(amount * 100),  # Convert amount to kobo
@@ -113,7 +102,7 @@ def initiate_single_transfer(recipient_code, amount, reference, reason=""):
         'reason': reason
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = paystack.post('transfer', json=data)
     response_data = response.json()
     return response_data
 
@@ -125,18 +114,13 @@ def initiate_bulk_transfer(transfers: List[dict]):
     Args:
         transfers (List[dict]): A list of transfer objects.
     """
-    url = 'https://api.paystack.co/transfer/bulk'
-    headers = {
-        'Authorization': f'Bearer {os.getenv("PAYSTACK_TEST_KEY")}',
-        'Content-Type': 'application/json'
-    }
     data = {
         'currency': 'NGN',
         'source': 'balance',
         'transfers': transfers
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = paystack.post('transfer/bulk', json=data)
     response_data = response.json()
 
     transactions = []
@@ -199,7 +183,12 @@ def handle_charge_success(data):
     except Transaction.DoesNotExist:
         logger.error(
             f'Transaction not found for reference: {remote_reference}')
-        return JsonResponse({'status': 'not found'}, status=404)
+        return
+
+    if transaction.is_fully_paid:
+        logger.info(
+            f'Transaction already fully paid: ID {transaction.pk}')
+        return
 
     transaction.paystack_id = data.get('id')
 
@@ -208,7 +197,7 @@ def handle_charge_success(data):
     if paid_amount != transaction.amount:
         logger.warning(
             f'Incomplete payment: Paid: {paid_amount}, Expected: {transaction.amount}')
-        return JsonResponse({'status': 'bad request'}, status=400)
+        return
 
     transaction.is_fully_paid = True
     transaction.save()
@@ -217,7 +206,8 @@ def handle_charge_success(data):
     subscription, subscribed_rooms = subscribe_for_listing(transaction)
 
     if subscribed_rooms.exists():
-        send_initial_subscribed_listings(subscription.pk)
+        db_transaction.on_commit(
+            lambda: send_initial_subscribed_listings.delay(subscription.pk))
 
     logger.info('Subscription for listing added')
 
@@ -4,7 +4,6 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import os
-import requests
 from django.http import HttpResponse
 from django_htmx.http import trigger_client_event
 from django.contrib import messages
@@ -14,23 +13,24 @@ import json
 from subscriptions.models import SubscribedListing
 from .forms import CreatorTransferInfoForm, PaymentRequestForm
 from auths.decorators import role_required
+from listings import geography
 from listings.models import Region
 import hmac
 import hashlib
-from .utils import creator_payment_pipeline, generate_unique_reference, handle_charge_success, handle_transfer_event
-from .models import CreatorTransferInfo, Transaction
+from .utils import creator_payment_pipeline, generate_unique_reference
+from . import paystack
+from .models import CreatorTransferInfo, PaystackEvent, Transaction
+from .tasks import TRANSFER_EVENTS, process_paystack_events
 from django.db import transaction as db_transaction
 import logging
 
-PAYSTACK_BASE_URL = 'https://api.paystack.co/transaction'
-
 logger = logging.getLogger('payments')
 
 
 def get_order_summary(request):
     if request.method != 'POST':
-        from listings.models import School
-        regions = list(School.objects.get(abbr='UNIPORT').regions.all())
+        regions = geography.get_regions_for_school(
+            geography.get_school_by_abbr('UNIPORT').pk)
 
         context = {
             'regions': regions,
@@ -48,12 +48,8 @@ def get_order_summary(request):
         messages.error(request, "Select at least one region")
         return redirect('get_home')
 
-    try:
-        regions = []
-        for pk in regions_pk_list:
-            region = Region.objects.get(pk=pk)
-            regions.append(region)
-    except:
+    regions = [geography.get_region(pk) for pk in regions_pk_list]
+    if None in regions:
         return redirect('get_home')
 
     # regions = list(School.objects.get(abbr='UNIPORT').regions.all())
@@ -121,18 +117,12 @@ def initialize_transaction(request):
     regions_pk_list = request.POST.getlist('region')
 
     try:
-        regions = []
-        for pk in regions_pk_list:
-            region = Region.objects.get(pk=pk)
-            regions.append(region)
+        regions = [geography.get_region(pk) for pk in regions_pk_list]
+        if None in regions:
+            raise Region.DoesNotExist('Unknown region selected')
 
         amount = len(regions) * 1500
 
-        url = f"{PAYSTACK_BASE_URL}/initialize"
-        headers = {
-            "Authorization": f"Bearer {os.getenv('PAYSTACK_TEST_KEY')}",
-            "Content-Type": "application/json"
-        }
         reference = generate_unique_reference(12)
         data = {
             "email": request.user.email,
@@ -141,7 +131,7 @@ def initialize_transaction(request):
             'reference': reference
         }
 
-        response = requests.post(url, headers=headers, json=data)
+        response = paystack.post('transaction/initialize', json=data)
         json_response = response.json()
 
         if response.status_code != 200 or not json_response.get('status'):
@@ -288,11 +278,16 @@ def webhook_view(request):
     event = payload.get('event')
     data = payload.get('data', {})
 
-    if event == 'charge.success':
-        handle_charge_success(data)
-        logger.info('Charge success event handled.')
-    elif event in ['transfer.success', 'transfer.failed', 'transfer.reversed']:
-        handle_transfer_event(event, data)
-        logger.info(f'Transfer event handled: {event}')
+    if event == 'charge.success' or event in TRANSFER_EVENTS:
+        # stored in the inbox and handled by a worker, retried deliveries are ignored
+        PaystackEvent.objects.bulk_create([
+            PaystackEvent(
+                event=event,
+                paystack_id=str(data.get('id') or data.get('reference')),
+                payload=data
+            )
+        ], ignore_conflicts=True)
+        db_transaction.on_commit(process_paystack_events.delay)
+        logger.info(f'Paystack event queued: {event}')
 
     return JsonResponse({'status': 'success'}, status=200)
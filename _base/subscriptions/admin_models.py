@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 '''define user admin models'''
 from django.contrib import admin
-from .models import Subscription, SubscribedListing
+from .models import Subscription, SubscribedListing, VacancyNotification
 
 
 @admin.register(SubscribedListing)
@@ -20,6 +20,14 @@ class SubscribedListingAdmin(admin.ModelAdmin):
         return obj.client.name
 
 
+@admin.register(VacancyNotification)
+class VacancyNotificationAdmin(admin.ModelAdmin):
+    list_display = ('room_profile', 'status', 'created_at', 'dispatched_at')
+    list_filter = ('status',)
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at', 'updated_at', 'dispatched_at')
+
+
 class LodgeInline(admin.TabularInline):
     model = Subscription.lodges.through
     extra = 1
@@ -35,6 +43,8 @@ class SubscriptionAdmin(admin.ModelAdmin):
         'is_expired',
         'client',
         'transaction',
+        'expires_at',
+        'number_of_listings_sent',
     )
 
     inlines = [LodgeInline, RoomProfileInline]
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Rebuilds the subscriber index from the active subscriptions
+
+    python manage.py rebuild_subscriber_index
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from subscriptions.models import SubscriberRegion
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per region subscriber index from the active subscriptions'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = SubscriberRegion.rebuild()
+        self.stdout.write(f'Indexed {indexed} subscription regions')
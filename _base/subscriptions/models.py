@@ -1,17 +1,31 @@
+from django.conf import settings
 from django.db import models
-from core.models import BaseModel
+from django.db.models import Q
+from core.models import BaseModel, TrackedFieldsMixin
 from payments.models import Transaction
 from listings.models import Lodge, RoomProfile, Region
 from users.models import Client, Creator
 from django.core.validators import MaxValueValidator
 
+# listings a subscription receives at most
+LISTING_CAP = 20
+
+
+class Subscription(TrackedFieldsMixin, BaseModel):
+    LISTING_CAP = LISTING_CAP
+
+    # read by the subscriber index signal
+    tracked_fields = ('is_expired',)
 
-class Subscription(BaseModel):
     is_expired = models.BooleanField(null=False, default=False)
 
+    # derived from the transaction on creation,
+    # the expiry sweep flips is_expired once it passes
+    expires_at = models.DateTimeField(null=True, blank=True)
+
     number_of_listings_sent = models.PositiveIntegerField(
         default=0,
-        validators=[MaxValueValidator(20)]
+        validators=[MaxValueValidator(LISTING_CAP)]
     )
 
     client = models.ForeignKey(
@@ -38,6 +52,158 @@ class Subscription(BaseModel):
         related_name='subscriptions'
     )
 
+    class Meta:
+        constraints = [
+            # backstop for the quota service, see subscriptions.quota
+            models.CheckConstraint(
+                check=Q(number_of_listings_sent__lte=LISTING_CAP),
+                name='subscription_listing_cap'
+            ),
+        ]
+        indexes = [
+            # the active set stays small while expired rows pile up
+            models.Index(
+                fields=['client'],
+                condition=Q(is_expired=False),
+                name='subscription_active_client'
+            ),
+            models.Index(
+                fields=['expires_at'],
+                condition=Q(is_expired=False),
+                name='subscription_active_expiry'
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.expires_at is None:
+            self.expires_at = self.compute_expiry()
+        super().save(*args, **kwargs)
+
+    def compute_expiry(self):
+        """The subscription lasts SUBSCRIPTION_DURATION from payment"""
+        paid_at = self.transaction.created_at if self.transaction_id else self.created_at
+        return paid_at + settings.SUBSCRIPTION_DURATION
+
+
+class SubscriberRegion(BaseModel):
+    """
+    Inverted index of the active subscriptions of each region.
+
+    A vacant room is matched by reading its region's rows with their
+    clients' emails and dropping the subscriptions already holding it,
+    instead of joining subscriptions, transactions and their regions.
+    Rows are added on payment and removed on expiry in the same
+    database transaction as the subscription change, so the index
+    never disagrees with the subscriptions it was built from.
+    Subscriptions pick regions, not room types, so the region is the
+    whole key.
+    """
+    region = models.ForeignKey(
+        Region,
+        on_delete=models.CASCADE,
+        related_name='subscriber_index'
+    )
+
+    subscription = models.ForeignKey(
+        'subscriptions.Subscription',
+        on_delete=models.CASCADE,
+        related_name='region_index'
+    )
+
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name='subscriber_index'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['region', 'subscription'],
+                name='subscriber_region_unique'
+            ),
+        ]
+        indexes = [
+            # matching reads the region's rows through this index
+            models.Index(fields=['region', 'subscription', 'client']),
+        ]
+
+    def __str__(self):
+        return f'{self.region_id} - {self.subscription_id}'
+
+    @classmethod
+    def index_subscription(cls, subscription):
+        """Adds the rows of an active subscription's regions"""
+        if subscription.is_expired or not subscription.transaction_id:
+            return
+        region_pks = Transaction.regions.through.objects.filter(
+            transaction_id=subscription.transaction_id
+        ).values_list('region_id', flat=True)
+        cls.objects.bulk_create(
+            [cls(
+                region_id=region_pk,
+                subscription_id=subscription.pk,
+                client_id=subscription.client_id
+            ) for region_pk in region_pks],
+            ignore_conflicts=True
+        )
+
+    @classmethod
+    def remove_subscriptions(cls, subscription_pks):
+        cls.objects.filter(subscription_id__in=list(subscription_pks)).delete()
+
+    @classmethod
+    def match(cls, region_pk, room_profile_pk):
+        """
+        Returns the active subscriptions of the region not holding the
+        room yet and their clients, from two index reads and a set
+        difference
+
+        Returns:
+            dict: {subscription_pk: (client_pk, client_email)}
+        """
+        subscribers = {
+            subscription_pk: (client_pk, email)
+            for subscription_pk, client_pk, email in cls.objects.filter(
+                region_id=region_pk
+            ).values_list(
+                'subscription_id', 'client_id', 'client__email'
+            ).iterator(chunk_size=5000)
+        }
+        if not subscribers:
+            return {}
+        holding = Subscription.subscribed_rooms.through.objects.filter(
+            roomprofile_id=room_profile_pk
+        ).values_list('subscription_id', flat=True)
+        for subscription_pk in holding.iterator(chunk_size=5000):
+            subscribers.pop(subscription_pk, None)
+        return subscribers
+
+    @classmethod
+    def rebuild(cls, batch_size=5000):
+        """
+        Rebuilds the whole index, for subscriptions written without
+        signals e.g with bulk_create or queryset.update()
+
+        Returns:
+            int: The number of rows indexed.
+        """
+        rows = Transaction.regions.through.objects.filter(
+            transaction__subscription__is_expired=False
+        ).values_list(
+            'region_id', 'transaction__subscription', 'transaction__client_id')
+        cls.objects.all().delete()
+        indexed = cls.objects.bulk_create(
+            (cls(
+                region_id=region_pk,
+                subscription_id=subscription_pk,
+                client_id=client_pk
+            ) for region_pk, subscription_pk, client_pk in rows.iterator()),
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+        return len(indexed)
+
 
 class SubscribedListing(BaseModel):
     class Status(models.TextChoices):
@@ -78,8 +244,6 @@ class SubscribedListing(BaseModel):
         related_name='subscribed_listings'
     )
 
-    status_task_id = models.CharField(max_length=255, blank=True, null=True)
-
 
 class SubscriptionHandler(BaseModel):
     """
@@ -99,3 +263,42 @@ class SubscriptionHandler(BaseModel):
         on_delete=models.CASCADE,
         related_name='subscription_handlers'
     )
+
+
+class VacancyNotification(BaseModel):
+    """
+    Outbox of rooms that became vacant.
+
+    Rows are written in the same transaction as the room,
+    a dispatcher coalesces them per room once the room has been
+    left alone for the debounce window and runs the fan-out.
+
+    Attributes:
+    - room_profile: The room that became vacant.
+    - status: Whether the change is pending, dispatched or skipped
+      because the room was occupied again before dispatch.
+    - dispatched_at: When the change was handled.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        DISPATCHED = 'DISPATCHED', 'Dispatched'
+        SKIPPED = 'SKIPPED', 'Skipped'
+
+    room_profile = models.ForeignKey(
+        RoomProfile,
+        on_delete=models.CASCADE,
+        related_name='vacancy_notifications'
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'])
+        ]
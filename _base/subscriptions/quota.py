@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Listing quota of subscriptions
+
+A subscription receives at most Subscription.LISTING_CAP listings.
+Slots are reserved with one conditional increment per batch,
+UPDATE ... SET n = n + k WHERE n + k <= cap RETURNING id, so
+concurrent fan-outs never push a subscription past its cap, without
+row locks and without counting the subscribed rooms. Slots of
+listings that never reached the client are handed back with
+release_slots.
+"""
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Subscription
+
+# subscriptions reserved per statement, keeps under the parameter limit
+RESERVATION_BATCH_SIZE = 500
+
+
+def reserve_slots(subscription_pks, slots=1):
+    """
+    Takes slots on every active subscription with room left for them
+
+    Returns:
+        set: The pks of the subscriptions that got their slots.
+    """
+    subscription_pks = list(subscription_pks)
+    pk_field = Subscription._meta.pk
+    table = Subscription._meta.db_table
+    updated_at = Subscription._meta.get_field('updated_at').get_db_prep_value(
+        timezone.now(), connection)
+    granted = set()
+
+    for start in range(0, len(subscription_pks), RESERVATION_BATCH_SIZE):
+        batch = [
+            pk_field.get_db_prep_value(pk, connection)
+            for pk in subscription_pks[start:start + RESERVATION_BATCH_SIZE]
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''UPDATE {table}
+                    SET number_of_listings_sent = number_of_listings_sent + %s,
+                        updated_at = %s
+                    WHERE id IN ({", ".join(["%s"] * len(batch))})
+                    AND is_expired = %s
+                    AND number_of_listings_sent + %s <= %s
+                    RETURNING id''',
+                [slots, updated_at, *batch, False,
+                 slots, Subscription.LISTING_CAP]
+            )
+            granted.update(pk_field.to_python(row[0]) for row in cursor.fetchall())
+
+    return granted
+
+
+def release_slots(subscription_pks, slots=1):
+    """
+    Hands back slots reserved for listings that were not delivered
+
+    Returns:
+        int: The number of subscriptions updated.
+    """
+    subscription_pks = list(subscription_pks)
+    released = 0
+    for start in range(0, len(subscription_pks), RESERVATION_BATCH_SIZE):
+        released += Subscription.objects.filter(
+            pk__in=subscription_pks[start:start + RESERVATION_BATCH_SIZE],
+            number_of_listings_sent__gte=slots
+        ).update(
+            number_of_listings_sent=F('number_of_listings_sent') - slots,
+            updated_at=timezone.now()
+        )
+    return released
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Random room selection without ORDER BY RANDOM()
+
+Vacancy index rows have random uuid4 keys, so the rows following a
+random uuid in key order are a random sample of the vacant rooms.
+Each region's window is read with a range scan over its
+(region, id) index, the windows are merged in key order, and the picks
+are spread across creators and lodges. A purchase never sorts or loads
+every vacant room in its regions.
+"""
+from collections import deque
+import uuid
+
+from django.db import connection
+
+from listings.models import Lodge, RoomProfile, VacantRoom
+
+# candidates drawn per room selected, the spread picks from this pool
+OVERSAMPLE_FACTOR = 5
+
+
+def _hex(value):
+    return getattr(value, 'hex', value)
+
+
+def _windows(region_pks, size, operator, start):
+    """
+    Reads up to size rooms of each region on one side of start in key
+    order, with a range scan of the region's index, in one query
+    """
+    region_field = VacantRoom._meta.get_field('region')
+    windows, params = [], []
+    # the index skips saves made without signals, the joins keep
+    # rooms that are still vacant in the region
+    for index, region_pk in enumerate(region_pks):
+        windows.append(f'''SELECT * FROM (
+            SELECT room.id, room.room_profile_id, room.lodge_id, room.creator_id
+            FROM {VacantRoom._meta.db_table} room
+            JOIN {RoomProfile._meta.db_table} room_profile
+                ON room_profile.id = room.room_profile_id
+                AND room_profile.vacancy > 0
+            JOIN {Lodge._meta.db_table} lodge
+                ON lodge.id = room_profile.lodge_id
+                AND lodge.region_id = room.region_id
+            WHERE room.region_id = %s AND room.id {operator} %s
+            ORDER BY room.id LIMIT %s
+        ) window_{index}''')
+        params += [region_field.get_db_prep_value(region_pk, connection), start, size]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{" UNION ALL ".join(windows)} ORDER BY id LIMIT %s',
+            [*params, size]
+        )
+        return [
+            (_hex(pk), _hex(lodge_id), _hex(creator_id))
+            for _, pk, lodge_id, creator_id in cursor.fetchall()
+        ]
+
+
+def get_region_candidates(region_pks, size):
+    """
+    Returns up to size random vacant room candidates of the regions,
+    the first rooms at or after a random key, wrapping around to the
+    first keys when there are too few, so every room is equally likely
+    to be drawn
+
+    Returns:
+        list: (room_pk, lodge_pk, creator_pk) tuples as hex strings.
+    """
+    if not region_pks:
+        return []
+    start = VacantRoom._meta.pk.get_db_prep_value(uuid.uuid4(), connection)
+
+    candidates = _windows(region_pks, size, '>=', start)
+    if len(candidates) < size:
+        candidates += _windows(region_pks, size - len(candidates), '<', start)
+    return candidates
+
+
+def spread_selection(candidates, limit):
+    """
+    Picks up to limit rooms from the candidates, taking turns between
+    creators and, for each creator, between their lodges
+
+    Args:
+        candidates (list): (pk, lodge_id, creator_id) tuples.
+        limit (int): The number of rooms to select.
+
+    Returns:
+        list: The selected room profile pks.
+    """
+    creators = {}
+    for pk, lodge_id, creator_id in candidates:
+        lodges = creators.setdefault(creator_id, {})
+        lodges.setdefault(lodge_id, deque()).append(pk)
+
+    turns = deque(deque(lodges.values()) for lodges in creators.values())
+    selected = []
+    while turns and len(selected) < limit:
+        creator_lodges = turns.popleft()
+        lodge_rooms = creator_lodges.popleft()
+        selected.append(lodge_rooms.popleft())
+
+        if lodge_rooms:
+            creator_lodges.append(lodge_rooms)
+        if creator_lodges:
+            turns.append(creator_lodges)
+
+    return selected
+
+
+def sample_rooms(region_pks, limit, oversample=OVERSAMPLE_FACTOR):
+    """
+    Selects up to limit random vacant rooms in the regions,
+    spread across creators and lodges
+
+    Returns:
+        QuerySet: The selected room profiles.
+    """
+    region_pks = list(region_pks)
+    candidates = get_region_candidates(region_pks, limit * oversample)
+    selected = spread_selection(candidates, limit)
+
+    return RoomProfile.objects.filter(pk__in=selected)
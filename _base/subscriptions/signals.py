@@ -1,23 +1,39 @@
 #!/usr/bin/env python3
 """signals for subscription models"""
-from django.db.models.signals import (
-    pre_save, post_save
-)
+from django.db import transaction
+from django.db.models.signals import post_save
 from django.dispatch import receiver
+from listings.signals import lodge_registered
 from .models import RoomProfile
 import logging
-from messaging.tasks import send_vacancy_update_mail
-from .models import Subscription, SubscribedListing
-from .tasks import change_status_to_verified
+from .models import (
+    Subscription,
+    SubscribedListing,
+    SubscriberRegion,
+    VacancyNotification
+)
 
 logger = logging.getLogger('subscriptions')
 
 
-@receiver(pre_save, sender=RoomProfile)
-def process_vacancy(sender, instance, **kwargs):
+def queue_vacancy_notification(*room_profiles):
+    """
+    Writes the change to the outbox in the room's transaction,
+    the periodic dispatcher picks it up once the debounce window has passed
+    """
+    VacancyNotification.objects.bulk_create([
+        VacancyNotification(room_profile=room_profile)
+        for room_profile in room_profiles
+    ])
+
+
+@receiver(post_save, sender=RoomProfile)
+def process_vacancy(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
     logger.info(f'process_vacancy: {instance.pk}')
 
-    if not RoomProfile.objects.filter(pk=instance.pk).exists():
+    if created:
         if instance.is_vacant == False:
             logger.info(
                 f'Room profile with id {instance.pk} created and is occupied')
@@ -25,49 +41,53 @@ def process_vacancy(sender, instance, **kwargs):
 
         logger.info(
             f'Room profile with id {instance.pk} created and is vacant')
-        send_vacancy_update_mail(instance.pk)
+        queue_vacancy_notification(instance)
         return
-    try:
-        original_instance = RoomProfile.objects.get(pk=instance.pk)
-        if original_instance.is_vacant == instance.is_vacant:
-            return
 
-        if instance.is_vacant == False:
-            subscriptions = Subscription.objects.filter(
-                subscribed_rooms=instance,
-                is_expired=False
-            )
+    if not instance.tracked_fields_changed('is_vacant'):
+        return
 
-            for subscription in subscriptions:
-                subscription.subscribed_rooms.remove(instance)
+    if instance.is_vacant == False:
+        SubscribedRoom = Subscription.subscribed_rooms.through
+        with transaction.atomic():
+            SubscribedRoom.objects.filter(
+                roomprofile_id=instance.pk,
+                subscription__is_expired=False
+            ).delete()
 
             SubscribedListing.objects.filter(
                 subscription__is_expired=False,
                 room_profile=instance
             ).update(status=SubscribedListing.Status.REJECTED)
 
-            logger.info(
-                'room profile removed from subscriptions and substriction lisitng set to rejected')
-            return
-
         logger.info(
-            f'Room profile with id {instance.pk} updated and is vacant')
+            'room profile removed from subscriptions and substriction lisitng set to rejected')
+        return
 
-        send_vacancy_update_mail(instance.pk)
-    except RoomProfile.DoesNotExist as e:
-        logger.error(f'Room profile update failed with exception: {e}')
+    logger.info(
+        f'Room profile with id {instance.pk} updated and is vacant')
 
+    queue_vacancy_notification(instance)
 
-@receiver(post_save, sender=SubscribedListing)
-def schedule_status_change(sender, instance, created, **kwargs):
-    logger.info('Begin subscribed lisiting scheduling')
-    if created:
-        logger.info(
-            f'Calling change status to verified function for subscribed listing {instance.pk}')
-        result = change_status_to_verified.apply_async(
-            args=[instance.id],
-            countdown=60  # 600s - 10 minutes
-        )
-
-        instance.status_task_id = result.id
-        instance.save()
+
+@receiver(lodge_registered)
+def process_registered_vacancies(sender, lodge, room_profiles, **kwargs):
+    vacant_rooms = [
+        room_profile for room_profile in room_profiles
+        if room_profile.is_vacant
+    ]
+    if vacant_rooms:
+        queue_vacancy_notification(*vacant_rooms)
+
+
+@receiver(post_save, sender=Subscription)
+def update_subscriber_index(sender, instance, created, raw=False, **kwargs):
+    """Keeps the subscription's regions in the subscriber index while it is active"""
+    if raw:
+        return
+    if instance.is_expired:
+        if not created and instance.tracked_fields_changed('is_expired'):
+            SubscriberRegion.remove_subscriptions([instance.pk])
+        return
+    if created or instance.tracked_fields_changed('is_expired'):
+        SubscriberRegion.index_subscription(instance)
@@ -1,28 +1,216 @@
 #!/usr/bin/env python3
+from collections import Counter
+
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    DateTimeField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    Max,
+    OuterRef,
+    Q,
+    Subquery
+)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from .models import SubscribedListing
+from listings.models import RoomProfile
+from messaging.tasks import send_vacancy_update_mail
+from payments.models import CreatorTransferInfo, Transaction
+from .models import (
+    Subscription,
+    SubscribedListing,
+    SubscriberRegion,
+    VacancyNotification
+)
 import logging
 
 logger = logging.getLogger('subscriptions')
 
+VERIFICATION_BATCH_SIZE = 500
+NOTIFICATION_BATCH_SIZE = 200
+EXPIRY_BATCH_SIZE = 1000
+
+
+@shared_task
+def verify_subscribed_listings(batch_size=VERIFICATION_BATCH_SIZE):
+    """
+    Periodic sweep (celery beat) that verifies unverified listings
+    older than the verification window
+
+    Each batch is promoted with one conditional UPDATE, so listings
+    reported occupied in the meantime are left untouched, and the
+    creators are credited with another
+    """
+    cutoff = timezone.now() - settings.SUBSCRIBED_LISTING_VERIFICATION_WINDOW
+    verified_count = 0
+
+    while True:
+        with transaction.atomic():
+            listing_ids = list(
+                SubscribedListing.objects.select_for_update(
+                    skip_locked=True
+                ).filter(
+                    status=SubscribedListing.Status.UNVERIFIED,
+                    created_at__lte=cutoff
+                ).values_list('pk', flat=True)[:batch_size]
+            )
+            if not listing_ids:
+                break
+
+            SubscribedListing.objects.filter(
+                pk__in=listing_ids,
+                status=SubscribedListing.Status.UNVERIFIED
+            ).update(
+                status=SubscribedListing.Status.VERIFIED,
+                updated_at=timezone.now()
+            )
+
+            creator_credits = Counter(
+                SubscribedListing.objects.filter(
+                    pk__in=listing_ids,
+                    status=SubscribedListing.Status.VERIFIED
+                ).values_list('creator_id', flat=True)
+            )
+            verified_count += sum(creator_credits.values())
+
+            credited = CreatorTransferInfo.credit_creators(creator_credits)
+            if credited != len(creator_credits):
+                logger.error(
+                    f'{len(creator_credits) - credited} creator(s) have no transfer profile to credit')
+
+        if len(listing_ids) < batch_size:
+            break
+
+    logger.info(
+        f'verify_subscribed_listings -> {verified_count} listing(s) verified')
+    return verified_count
+
 
 @shared_task
-def change_status_to_verified(subscribed_listing_id):
-    logger.info('In change_status_to_verified -> subscriptions.task')
-    try:
-        subscribed_listing = SubscribedListing.objects.get(
-            id=subscribed_listing_id)
-
-        if subscribed_listing.status == SubscribedListing.Status.UNVERIFIED:
-            subscribed_listing.status = SubscribedListing.Status.VERIFIED
-            subscribed_listing.creator.transfer_profile.increment_balance()
-            subscribed_listing.save()
-            logger.info(
-                f'Status changed to verified for subscribed_listing with id {subscribed_listing_id}')
-        else:
-            logger.info(
-                f'Cannot verify listing with status: {subscribed_listing.status}\nlisting pk: {subscribed_listing_id}')
-    except SubscribedListing.DoesNotExist:
-        logger.error(
-            f'subscribed_listing does not exist for id: {subscribed_listing_id}')
+def dispatch_vacancy_notifications(batch_size=NOTIFICATION_BATCH_SIZE):
+    """
+    Drains the vacancy notification outbox
+
+    Changes are coalesced per room and a room is only dispatched once
+    its last change is older than the debounce window, so a creator
+    toggling a room sends one fan-out for the final state, and none
+    when the room ends up occupied
+    """
+    cutoff = timezone.now() - settings.VACANCY_NOTIFICATION_DEBOUNCE
+    dispatched_count = 0
+
+    with transaction.atomic():
+        room_ids = list(
+            VacancyNotification.objects.filter(
+                status=VacancyNotification.Status.PENDING
+            ).values('room_profile_id').annotate(
+                last_change=Max('created_at')
+            ).filter(
+                last_change__lte=cutoff
+            ).order_by('last_change').values_list(
+                'room_profile_id', flat=True
+            )[:batch_size]
+        )
+        notification_ids = list(
+            VacancyNotification.objects.select_for_update(
+                skip_locked=True
+            ).filter(
+                room_profile_id__in=room_ids,
+                status=VacancyNotification.Status.PENDING
+            ).values_list('pk', flat=True)
+        )
+        if not notification_ids:
+            return 0
+
+        vacant_room_ids = list(
+            RoomProfile.objects.filter(
+                pk__in=room_ids,
+                is_vacant=True
+            ).values_list('pk', flat=True)
+        )
+
+        now = timezone.now()
+        pending = VacancyNotification.objects.filter(
+            pk__in=notification_ids,
+            status=VacancyNotification.Status.PENDING
+        )
+        pending.filter(room_profile_id__in=vacant_room_ids).update(
+            status=VacancyNotification.Status.DISPATCHED,
+            dispatched_at=now,
+            updated_at=now
+        )
+        pending.exclude(room_profile_id__in=vacant_room_ids).update(
+            status=VacancyNotification.Status.SKIPPED,
+            dispatched_at=now,
+            updated_at=now
+        )
+
+        for room_id in vacant_room_ids:
+            transaction.on_commit(
+                lambda room_id=room_id: send_vacancy_update_mail.delay(room_id))
+        dispatched_count = len(vacant_room_ids)
+
+    logger.info(
+        f'dispatch_vacancy_notifications -> {dispatched_count} room(s) dispatched')
+    return dispatched_count
+
+
+@shared_task
+def expire_subscriptions(batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Periodic sweep (celery beat) that expires subscriptions past their
+    expires_at, or holding their full listing cap once none of their
+    listings are still awaiting verification
+
+    Subscriptions without an expiry yet get one derived from their
+    transaction first. Each batch is flipped with one UPDATE on the
+    active set, so the sweep only reads the partial indexes, and is
+    removed from the subscriber index in the same transaction
+    """
+    paid_at = Transaction.objects.filter(
+        pk=OuterRef('transaction_id')).values('created_at')
+    Subscription.objects.filter(
+        is_expired=False,
+        expires_at__isnull=True
+    ).update(expires_at=ExpressionWrapper(
+        Coalesce(Subquery(paid_at), F('created_at')) + settings.SUBSCRIPTION_DURATION,
+        output_field=DateTimeField()
+    ))
+
+    now = timezone.now()
+    listings = SubscribedListing.objects.filter(subscription=OuterRef('pk'))
+    awaiting = listings.filter(status__in=[
+        SubscribedListing.Status.UNVERIFIED,
+        SubscribedListing.Status.PROBATION
+    ])
+    due = Q(expires_at__lte=now) | (
+        Q(number_of_listings_sent__gte=Subscription.LISTING_CAP) &
+        Exists(listings) & ~Exists(awaiting)
+    )
+    expired_count = 0
+
+    while True:
+        subscription_ids = list(
+            Subscription.objects.filter(due, is_expired=False).values_list(
+                'pk', flat=True)[:batch_size]
+        )
+        if not subscription_ids:
+            break
+
+        with transaction.atomic():
+            expired_count += Subscription.objects.filter(
+                pk__in=subscription_ids,
+                is_expired=False
+            ).update(is_expired=True, updated_at=now)
+            # update() skips post_save, drop them from the subscriber index here
+            SubscriberRegion.remove_subscriptions(subscription_ids)
+
+        if len(subscription_ids) < batch_size:
+            break
+
+    logger.info(
+        f'expire_subscriptions -> {expired_count} subscription(s) expired')
+    return expired_count
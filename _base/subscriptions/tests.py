@@ -1,3 +1,789 @@
-from django.test import TestCase
+import os
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.tests import (
+    create_creator,
+    create_lodge,
+    create_region,
+    create_room_profile,
+    create_subscription,
+    create_transfer_profile
+)
+from listings import geography
+from listings.models import (
+    Lodge,
+    LodgeImage,
+    Region,
+    RoomProfile,
+    RoomProfileImage,
+    RoomType,
+    VacantRoom
+)
+from payments.models import BASE_FARE, Transaction
+from subscriptions.models import (
+    SubscribedListing,
+    SubscriberRegion,
+    Subscription,
+    VacancyNotification
+)
+from subscriptions.quota import release_slots, reserve_slots
+from subscriptions.sampling import sample_rooms, spread_selection
+from subscriptions.tasks import (
+    dispatch_vacancy_notifications,
+    expire_subscriptions,
+    verify_subscribed_listings
+)
+from subscriptions.views import create_subscribed_listing, subscribe_for_listing
+
+
+class CreateSubscribedListingTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+
+    def subscribe(self, number_of_rooms):
+        subscription = create_subscription(self.region)
+        for _ in range(number_of_rooms):
+            lodge = create_lodge(self.region, create_creator())
+            subscription.subscribed_rooms.add(create_room_profile(lodge))
+        return subscription
+
+    def test_creates_listing_per_room(self):
+        subscription = self.subscribe(3)
+
+        subscribed_listings, creator_email_list = create_subscribed_listing(
+            subscription)
+
+        self.assertEqual(len(subscribed_listings), 3)
+        self.assertEqual(len(creator_email_list), 3)
+        self.assertEqual(
+            SubscribedListing.objects.filter(subscription=subscription).count(), 3)
+
+    def test_query_count_is_constant(self):
+        small_subscription = self.subscribe(2)
+        large_subscription = self.subscribe(20)
+
+        with CaptureQueriesContext(connection) as small:
+            create_subscribed_listing(small_subscription)
+        with CaptureQueriesContext(connection) as large:
+            create_subscribed_listing(large_subscription)
+
+        self.assertEqual(len(small), len(large))
+
+
+class SubscribedListingsPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.region = create_region()
+
+    def subscribe(self, number_of_rooms):
+        subscription = create_subscription(self.region)
+        for index in range(number_of_rooms):
+            lodge = create_lodge(self.region, create_creator(), name=f'Lodge {index}')
+            room_profile = create_room_profile(lodge)
+            variants = {'webp': {'320': f'/media/{index}/320.webp'},
+                        'jpeg': {'320': f'/media/{index}/320.jpeg'}}
+            LodgeImage.objects.create(
+                lodge=lodge, status=LodgeImage.Status.READY, variants=variants)
+            RoomProfileImage.objects.create(
+                room_profile=room_profile, status=RoomProfileImage.Status.READY,
+                variants=variants)
+            subscription.subscribed_rooms.add(room_profile)
+        create_subscribed_listing(subscription)
+        return subscription
+
+    def get(self, subscription, etag=None):
+        extra = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(
+            reverse('get_subscribed_listings', args=[subscription.pk]), **extra)
+
+    def test_query_count_is_constant(self):
+        small_subscription = self.subscribe(1)
+        large_subscription = self.subscribe(5)
+        geography.get_snapshot()
+
+        with CaptureQueriesContext(connection) as small:
+            self.get(small_subscription)
+        with CaptureQueriesContext(connection) as large:
+            response = self.get(large_subscription)
+
+        self.assertEqual(len(small), len(large))
+        self.assertContains(response, '/media/4/320.webp 320w', count=2)
+
+    def test_repeat_visit_is_not_modified(self):
+        subscription = self.subscribe(2)
+        response = self.get(subscription)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.get(subscription, etag)
+        self.assertEqual(response.status_code, 304)
+
+        listing = subscription.subscribed_listings.first()
+        listing.status = SubscribedListing.Status.REJECTED
+        listing.save()
+
+        response = self.get(subscription, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_cards_are_cached_until_updated(self):
+        subscription = self.subscribe(1)
+        self.get(subscription)
+        lodge = Lodge.objects.get(name='Lodge 0')
+
+        # updates skipping updated_at leave the cached card alone
+        Lodge.objects.filter(pk=lodge.pk).update(name='Renamed Lodge')
+        self.assertNotContains(self.get(subscription), 'Renamed Lodge')
+
+        lodge.refresh_from_db()
+        lodge.save()
+        self.assertContains(self.get(subscription), 'Renamed Lodge')
+
+    def test_school_rename_refreshes_cards(self):
+        subscription = self.subscribe(1)
+        self.get(subscription)
+
+        school = Lodge.objects.get(name='Lodge 0').school
+        school.name = 'Renamed School'
+        with self.captureOnCommitCallbacks(execute=True):
+            school.save()
+
+        self.assertContains(self.get(subscription), 'Renamed School')
+
+    def test_image_changes_refresh_cards(self):
+        subscription = self.subscribe(1)
+        etag = self.get(subscription)['ETag']
+
+        LodgeImage.objects.get().delete()
+        response = self.get(subscription, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '320w', count=1)
+
+
+class ExpireSubscriptionsTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+
+    def test_expiry_is_derived_from_the_transaction(self):
+        subscription = create_subscription(self.region)
+        self.assertEqual(
+            subscription.expires_at,
+            subscription.transaction.created_at + settings.SUBSCRIPTION_DURATION
+        )
+
+    def test_expires_past_expiry_in_batches(self):
+        past = timezone.now() - timedelta(minutes=1)
+        expired = [create_subscription(self.region, expires_at=past) for _ in range(5)]
+        active = create_subscription(self.region)
+
+        self.assertEqual(expire_subscriptions(batch_size=2), 5)
+
+        self.assertEqual(
+            Subscription.objects.filter(is_expired=True).count(), len(expired))
+        active.refresh_from_db()
+        self.assertFalse(active.is_expired)
+        self.assertEqual(expire_subscriptions(), 0)
+
+    def test_backfills_missing_expiry(self):
+        subscription = create_subscription(self.region)
+        Transaction = type(subscription.transaction)
+        Transaction.objects.filter(pk=subscription.transaction_id).update(
+            created_at=timezone.now() - settings.SUBSCRIPTION_DURATION * 2)
+        Subscription.objects.filter(pk=subscription.pk).update(expires_at=None)
+
+        self.assertEqual(expire_subscriptions(), 1)
+        subscription.refresh_from_db()
+        self.assertIsNotNone(subscription.expires_at)
+
+    def test_full_subscription_expires_once_listings_settle(self):
+        subscription = create_subscription(
+            self.region, number_of_listings_sent=Subscription.LISTING_CAP)
+        room_profile = create_room_profile(create_lodge(self.region, create_creator()))
+        listing = SubscribedListing.objects.create(
+            subscription=subscription,
+            room_profile=room_profile,
+            creator=room_profile.lodge.creator,
+            client=subscription.client
+        )
+
+        # still awaiting verification, occupied reports must reach it
+        self.assertEqual(expire_subscriptions(), 0)
+
+        listing.status = SubscribedListing.Status.VERIFIED
+        listing.save()
+        self.assertEqual(expire_subscriptions(), 1)
+
+    def test_active_filters_use_partial_indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Subscription._meta.db_table)
+        self.assertIn('subscription_active_client', constraints)
+        self.assertIn('subscription_active_expiry', constraints)
+
+        client = create_subscription(self.region).client
+        plan = Subscription.objects.filter(client=client, is_expired=False).explain()
+        self.assertIn('subscription_active_client', plan)
+
+
+class ListingQuotaTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+
+    def test_reserves_within_cap(self):
+        open_subscription = create_subscription(self.region, number_of_listings_sent=3)
+        nearly_full = create_subscription(
+            self.region, number_of_listings_sent=Subscription.LISTING_CAP - 1)
+        full = create_subscription(
+            self.region, number_of_listings_sent=Subscription.LISTING_CAP)
+        expired = create_subscription(self.region, is_expired=True)
+        pks = [open_subscription.pk, nearly_full.pk, full.pk, expired.pk]
+
+        with self.assertNumQueries(1):
+            granted = reserve_slots(pks)
+        self.assertEqual(granted, {open_subscription.pk, nearly_full.pk})
+
+        self.assertEqual(reserve_slots(pks), {open_subscription.pk})
+        self.assertEqual(reserve_slots(pks, slots=15), {open_subscription.pk})
+        self.assertEqual(reserve_slots(pks), set())
+        self.assertEqual(
+            list(Subscription.objects.filter(pk__in=pks).order_by(
+                'number_of_listings_sent').values_list('number_of_listings_sent', flat=True)),
+            [0, 20, 20, 20]
+        )
+
+    def test_release_hands_slots_back(self):
+        subscription = create_subscription(self.region, number_of_listings_sent=1)
+        empty = create_subscription(self.region)
+
+        self.assertEqual(release_slots([subscription.pk, empty.pk]), 1)
+
+        subscription.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(subscription.number_of_listings_sent, 0)
+        self.assertEqual(empty.number_of_listings_sent, 0)
+
+    def test_cap_is_enforced_by_the_database(self):
+        subscription = create_subscription(self.region)
+        with self.assertRaises(IntegrityError):
+            Subscription.objects.filter(pk=subscription.pk).update(
+                number_of_listings_sent=Subscription.LISTING_CAP + 1)
+
+    def test_initial_rooms_take_their_slots(self):
+        for _ in range(3):
+            create_room_profile(
+                create_lodge(self.region, create_creator()), vacancy=1, is_vacant=True)
+        transaction = create_subscription(self.region).transaction
+        transaction.subscription.delete()
+
+        subscription, _ = subscribe_for_listing(transaction)
+
+        self.assertEqual(subscription.number_of_listings_sent, 3)
+        self.assertEqual(subscription.subscribed_rooms.count(), 3)
+
+
+class ConcurrentListingQuotaTests(TransactionTestCase):
+    def test_concurrent_fan_outs_stay_within_cap(self):
+        subscription = create_subscription(
+            create_region(), number_of_listings_sent=Subscription.LISTING_CAP - 5)
+        results = []
+
+        def reserve():
+            try:
+                results.append(subscription.pk in reserve_slots([subscription.pk]))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 5)
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.number_of_listings_sent, Subscription.LISTING_CAP)
+
+
+class SubscriberIndexTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+        self.other_region = Region.objects.create(
+            name='Other region', state=self.region.state, school=self.region.school)
+
+    def indexed(self, subscription):
+        return set(subscription.region_index.values_list('region_id', flat=True))
+
+    def test_active_subscriptions_are_indexed(self):
+        subscription = create_subscription(self.region)
+        subscription.transaction.regions.add(self.other_region)
+        SubscriberRegion.index_subscription(subscription)
+
+        self.assertEqual(self.indexed(subscription), {self.region.pk, self.other_region.pk})
+        self.assertFalse(SubscriberRegion.objects.filter(
+            subscription=create_subscription(self.region, is_expired=True)).exists())
+
+    def test_expiry_and_reactivation_update_index(self):
+        subscription = create_subscription(self.region)
+        subscription.is_expired = True
+        subscription.save()
+        self.assertEqual(self.indexed(subscription), set())
+
+        subscription.is_expired = False
+        subscription.save()
+        self.assertEqual(self.indexed(subscription), {self.region.pk})
+
+    def test_expiry_sweep_removes_subscriptions(self):
+        lapsed = create_subscription(self.region)
+        active = create_subscription(self.region)
+        Subscription.objects.filter(pk=lapsed.pk).update(
+            expires_at=timezone.now() - timedelta(days=1))
+
+        expire_subscriptions()
+
+        self.assertEqual(self.indexed(lapsed), set())
+        self.assertEqual(self.indexed(active), {self.region.pk})
+
+    def test_match_skips_subscriptions_holding_room(self):
+        room_profile = create_room_profile(create_lodge(self.region, create_creator()))
+        holding = create_subscription(self.region)
+        holding.subscribed_rooms.add(room_profile)
+        waiting = create_subscription(self.region)
+        create_subscription(self.other_region)
+
+        with self.assertNumQueries(2):
+            matched = SubscriberRegion.match(self.region.pk, room_profile.pk)
+        self.assertEqual(
+            matched, {waiting.pk: (waiting.client_id, waiting.client.email)})
+
+    def test_rebuild_matches_signals(self):
+        subscriptions = [create_subscription(self.region) for _ in range(3)]
+        create_subscription(self.region, is_expired=True)
+        SubscriberRegion.objects.all().delete()
+
+        self.assertEqual(SubscriberRegion.rebuild(), 3)
+        self.assertEqual(
+            set(SubscriberRegion.objects.values_list('subscription_id', flat=True)),
+            {subscription.pk for subscription in subscriptions}
+        )
+
+
+class VerifySubscribedListingsTests(TestCase):
+    def setUp(self):
+        region = create_region()
+        self.subscription = create_subscription(region)
+        self.room_profile = create_room_profile(
+            create_lodge(region, create_creator()))
+
+    def create_listing(self, age, **kwargs):
+        return SubscribedListing.objects.create(
+            subscription=self.subscription,
+            room_profile=self.room_profile,
+            creator=self.room_profile.lodge.creator,
+            client=self.subscription.client,
+            created_at=timezone.now() - age,
+            **kwargs
+        )
+
+    def test_verifies_listings_past_window(self):
+        window = settings.SUBSCRIBED_LISTING_VERIFICATION_WINDOW
+        expired = self.create_listing(window + timedelta(seconds=1))
+        fresh = self.create_listing(timedelta(0))
+        reported = self.create_listing(
+            window + timedelta(seconds=1),
+            status=SubscribedListing.Status.PROBATION
+        )
+
+        self.assertEqual(verify_subscribed_listings(), 1)
+
+        expired.refresh_from_db()
+        fresh.refresh_from_db()
+        reported.refresh_from_db()
+        self.assertEqual(expired.status, SubscribedListing.Status.VERIFIED)
+        self.assertEqual(fresh.status, SubscribedListing.Status.UNVERIFIED)
+        self.assertEqual(reported.status, SubscribedListing.Status.PROBATION)
+
+    def test_sweeps_in_batches(self):
+        window = settings.SUBSCRIBED_LISTING_VERIFICATION_WINDOW
+        for _ in range(5):
+            self.create_listing(window + timedelta(seconds=1))
+
+        self.assertEqual(verify_subscribed_listings(batch_size=2), 5)
+        self.assertFalse(SubscribedListing.objects.filter(
+            status=SubscribedListing.Status.UNVERIFIED).exists())
+
+    def test_credits_creators_once_per_listing(self):
+        transfer_profile = create_transfer_profile(
+            self.room_profile.lodge.creator)
+        window = settings.SUBSCRIBED_LISTING_VERIFICATION_WINDOW
+        for _ in range(3):
+            self.create_listing(window + timedelta(seconds=1))
+
+        verify_subscribed_listings()
+        verify_subscribed_listings()
+
+        transfer_profile.refresh_from_db()
+        self.assertEqual(transfer_profile.balance, BASE_FARE * 3)
+
+
+class ProcessVacancyTests(TestCase):
+    def setUp(self):
+        region = create_region()
+        self.lodge = create_lodge(region, create_creator())
+
+    def test_room_update_runs_no_extra_queries(self):
+        room_profile = RoomProfile.objects.get(
+            pk=create_room_profile(self.lodge).pk)
+
+        room_profile.price = 150000
+        with self.assertNumQueries(1):
+            room_profile.save()
+
+    def test_queues_notification_only_on_vacancy_transitions(self):
+        room_profile = create_room_profile(self.lodge)
+        self.assertFalse(VacancyNotification.objects.exists())
+
+        room_profile.is_vacant = True
+        room_profile.save()
+        room_profile.price = 150000
+        room_profile.save()
+
+        self.assertEqual(
+            VacancyNotification.objects.filter(room_profile=room_profile).count(), 1)
+
+
+class OccupiedRoomRemovalTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+        self.room_profile = create_room_profile(
+            create_lodge(self.region, create_creator()), is_vacant=True)
+
+    def hold_room(self, number_of_subscriptions, **kwargs):
+        subscriptions = []
+        for _ in range(number_of_subscriptions):
+            subscription = create_subscription(self.region, **kwargs)
+            subscription.subscribed_rooms.add(self.room_profile)
+            SubscribedListing.objects.create(
+                subscription=subscription,
+                room_profile=self.room_profile,
+                creator=self.room_profile.lodge.creator,
+                client=subscription.client
+            )
+            subscriptions.append(subscription)
+        return subscriptions
+
+    def occupy(self):
+        self.room_profile.is_vacant = False
+        with CaptureQueriesContext(connection) as queries:
+            self.room_profile.save()
+        self.room_profile.is_vacant = True
+        self.room_profile.save()
+        return len(queries)
+
+    def test_removes_room_from_active_subscriptions_only(self):
+        active, = self.hold_room(1)
+        expired, = self.hold_room(1, is_expired=True)
+
+        self.occupy()
+
+        self.assertFalse(active.subscribed_rooms.exists())
+        self.assertTrue(expired.subscribed_rooms.exists())
+        self.assertEqual(
+            SubscribedListing.objects.get(subscription=active).status,
+            SubscribedListing.Status.REJECTED
+        )
+        self.assertEqual(
+            SubscribedListing.objects.get(subscription=expired).status,
+            SubscribedListing.Status.UNVERIFIED
+        )
+
+    def test_query_count_is_constant(self):
+        self.hold_room(5)
+        few = self.occupy()
+
+        self.hold_room(50)
+        many = self.occupy()
+
+        self.assertEqual(few, many)
+
+
+@mock.patch('subscriptions.tasks.send_vacancy_update_mail')
+class DispatchVacancyNotificationsTests(TestCase):
+    def setUp(self):
+        region = create_region()
+        self.room_profile = create_room_profile(
+            create_lodge(region, create_creator()))
+
+    def toggle(self, *states):
+        for is_vacant in states:
+            self.room_profile.is_vacant = is_vacant
+            self.room_profile.save()
+
+    def age_notifications(self):
+        debounce = settings.VACANCY_NOTIFICATION_DEBOUNCE
+        VacancyNotification.objects.update(
+            created_at=timezone.now() - debounce - timedelta(seconds=1))
+
+    def test_coalesces_toggles_into_one_fan_out(self, send_vacancy_update_mail):
+        self.toggle(True, False, True, False, True)
+        self.age_notifications()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(dispatch_vacancy_notifications(), 1)
+
+        send_vacancy_update_mail.delay.assert_called_once_with(
+            self.room_profile.pk)
+        self.assertFalse(VacancyNotification.objects.filter(
+            status=VacancyNotification.Status.PENDING).exists())
+
+    def test_waits_for_debounce_window(self, send_vacancy_update_mail):
+        self.toggle(True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(dispatch_vacancy_notifications(), 0)
+
+        send_vacancy_update_mail.delay.assert_not_called()
+
+    def test_skips_rooms_occupied_again(self, send_vacancy_update_mail):
+        self.toggle(True, False)
+        self.age_notifications()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(dispatch_vacancy_notifications(), 0)
+
+        send_vacancy_update_mail.delay.assert_not_called()
+        self.assertEqual(
+            VacancyNotification.objects.get().status,
+            VacancyNotification.Status.SKIPPED
+        )
+
+
+class SampleRoomsTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+
+    def create_rooms(self, creator, number_of_lodges, rooms_per_lodge,
+                     region=None, **kwargs):
+        kwargs.setdefault('vacancy', 1)
+        for _ in range(number_of_lodges):
+            lodge = create_lodge(region or self.region, creator)
+            for _ in range(rooms_per_lodge):
+                create_room_profile(lodge, **kwargs)
+
+    def test_selects_only_vacant_rooms_in_regions(self):
+        self.create_rooms(create_creator(), 2, 5)
+        self.create_rooms(create_creator(), 2, 5, vacancy=0)
+        other_region = Region.objects.create(
+            name='Aluu', state=self.region.state, school=self.region.school)
+        self.create_rooms(create_creator(), 2, 5, region=other_region)
+
+        rooms = sample_rooms([self.region.pk], 20)
+
+        self.assertEqual(rooms.count(), 10)
+        self.assertFalse(rooms.filter(vacancy=0).exists())
+        self.assertFalse(rooms.filter(lodge__region=other_region).exists())
+
+    def test_selection_is_capped(self):
+        self.create_rooms(create_creator(), 5, 10)
+
+        rooms = sample_rooms([self.region.pk], 20)
+
+        self.assertEqual(rooms.count(), 20)
+
+    def test_selection_is_spread_across_creators_and_lodges(self):
+        for _ in range(3):
+            self.create_rooms(create_creator(), 2, 10)
+
+        rooms = sample_rooms([self.region.pk], 6)
+
+        creators = Counter(rooms.values_list('lodge__creator', flat=True))
+        lodges = Counter(rooms.values_list('lodge', flat=True))
+        self.assertEqual(sorted(creators.values()), [2, 2, 2])
+        self.assertEqual(sorted(lodges.values()), [1] * 6)
+
+    def test_skips_rooms_updated_without_signals(self):
+        self.create_rooms(create_creator(), 1, 5)
+        RoomProfile.objects.filter(
+            pk=RoomProfile.objects.first().pk).update(vacancy=0)
+
+        # rooms after a random key, the wrapped ones before it, the rooms
+        with self.assertNumQueries(3):
+            rooms = list(sample_rooms([self.region.pk], 20))
+
+        self.assertEqual(len(rooms), 4)
+
+    def test_samples_are_random(self):
+        self.create_rooms(create_creator(), 4, 10)
+
+        samples = {
+            frozenset(sample_rooms([self.region.pk], 2).values_list('pk', flat=True))
+            for _ in range(10)
+        }
+
+        self.assertGreater(len(samples), 1)
+
+    def test_rooms_turning_vacant_are_sampled(self):
+        self.create_rooms(create_creator(), 1, 2)
+        self.assertEqual(sample_rooms([self.region.pk], 20).count(), 2)
+
+        room_profile = create_room_profile(
+            create_lodge(self.region, create_creator()), vacancy=0)
+        room_profile.vacancy = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            room_profile.save()
+
+        self.assertIn(room_profile, sample_rooms([self.region.pk], 20))
+
+    def test_spread_selection(self):
+        candidates = [
+            ('a', 'lodge-1', 'creator-1'),
+            ('b', 'lodge-1', 'creator-1'),
+            ('c', 'lodge-2', 'creator-1'),
+            ('d', 'lodge-3', 'creator-2'),
+        ]
+
+        self.assertEqual(spread_selection(candidates, 3), ['a', 'd', 'c'])
+
+
+@skipUnless(os.getenv('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run benchmarks')
+class SampleRoomsBenchmark(TransactionTestCase):
+    """
+    Compares ORDER BY RANDOM() with sampling random key windows,
+    room counts are read from BENCHMARK_ROOM_COUNTS (default 10000,100000,1000000)
+    and spread over 100 regions, a subscription covers 3 of them
+    """
+
+    def seed(self, number_of_rooms, regions, creators, room_type):
+        existing = RoomProfile.objects.count()
+        lodges = Lodge.objects.bulk_create([
+            Lodge(
+                name=f'Lodge {index}',
+                phone_number='08000000000',
+                region=regions[index % len(regions)],
+                state=regions[0].state,
+                school=regions[0].school,
+                creator=creators[index % len(creators)]
+            )
+            for index in range((number_of_rooms - existing) // 10)
+        ], batch_size=5000)
+        for start in range(0, len(lodges), 5000):
+            RoomProfile.objects.bulk_create([
+                RoomProfile(lodge=lodge, room_type=room_type, vacancy=1)
+                for lodge in lodges[start:start + 5000]
+                for _ in range(10)
+            ], batch_size=5000)
+        VacantRoom.rebuild()
+
+    def time(self, select, repeat=5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(select())
+        return (time.perf_counter() - start) / repeat * 1000
+
+    def test_benchmark(self):
+        counts = os.getenv('BENCHMARK_ROOM_COUNTS', '10000,100000,1000000')
+        region = create_region()
+        regions = [region] + [
+            Region.objects.create(
+                name=f'Region {index}', state=region.state, school=region.school)
+            for index in range(99)
+        ]
+        subscribed_regions = [region.pk for region in regions[:3]]
+        creators = [create_creator() for _ in range(50)]
+        room_type = RoomType.objects.create(name=RoomType.Type.ONE_ROOM)
+        vacant_rooms = RoomProfile.objects.filter(
+            lodge__in=Lodge.objects.filter(region__in=subscribed_regions),
+            vacancy__gt=0
+        )
+
+        for number_of_rooms in sorted(int(count) for count in counts.split(',')):
+            self.seed(number_of_rooms, regions, creators, room_type)
+            random_sort = self.time(lambda: vacant_rooms.order_by('?')[:20])
+            sampled = self.time(lambda: sample_rooms(subscribed_regions, 20))
+            print(
+                f'\n{number_of_rooms} rooms: order_by(?) {random_sort:.1f}ms, '
+                f'sample_rooms {sampled:.1f}ms')
+            if number_of_rooms >= 1000000:
+                self.assertLess(sampled, random_sort)
+
+
+@skipUnless(os.getenv('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run benchmarks')
+class SubscriberIndexBenchmark(TransactionTestCase):
+    """
+    Compares joining subscriptions to their transactions' regions with
+    reading the subscriber index, subscription counts are read from
+    BENCHMARK_SUBSCRIPTION_COUNTS (default 10000,100000,300000) and
+    spread over 20 regions
+    """
+
+    def seed(self, number_of_subscriptions, regions, client):
+        existing = Subscription.objects.count()
+        RegionLink = Transaction.regions.through
+        for start in range(existing, number_of_subscriptions, 5000):
+            size = min(5000, number_of_subscriptions - start)
+            transactions = Transaction.objects.bulk_create([
+                Transaction(
+                    amount=1500,
+                    reference=f'bench-{start + index}',
+                    client=client,
+                    is_fully_paid=True
+                )
+                for index in range(size)
+            ])
+            RegionLink.objects.bulk_create([
+                RegionLink(
+                    transaction_id=transaction.pk,
+                    region_id=regions[index % len(regions)].pk
+                )
+                for index, transaction in enumerate(transactions)
+            ])
+            Subscription.objects.bulk_create([
+                Subscription(client=client, transaction=transaction)
+                for transaction in transactions
+            ])
+        SubscriberRegion.rebuild()
+
+    def time(self, match, repeat=5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            match()
+        return (time.perf_counter() - start) / repeat * 1000
+
+    def test_benchmark(self):
+        counts = os.getenv('BENCHMARK_SUBSCRIPTION_COUNTS', '10000,100000,300000')
+        region = create_region()
+        regions = [region] + [
+            Region.objects.create(
+                name=f'Region {index}', state=region.state, school=region.school)
+            for index in range(19)
+        ]
+        room_profile = create_room_profile(create_lodge(region, create_creator()))
+        client = create_subscription(regions[1]).client
+
+        def join():
+            return list(Subscription.objects.filter(
+                is_expired=False,
+                transaction__regions=region.pk
+            ).exclude(
+                subscribed_rooms=room_profile
+            ).values_list('pk', 'client_id').distinct())
+
+        for number_of_subscriptions in sorted(int(count) for count in counts.split(',')):
+            self.seed(number_of_subscriptions, regions, client)
+            joined = self.time(join)
+            indexed = self.time(
+                lambda: SubscriberRegion.match(region.pk, room_profile.pk))
+            print(
+                f'\n{number_of_subscriptions} subscriptions: join {joined:.1f}ms, '
+                f'subscriber index {indexed:.1f}ms')
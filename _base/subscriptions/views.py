@@ -1,12 +1,20 @@
+import hashlib
+
 from django.shortcuts import render, redirect, get_object_or_404
-from listings.models import School, Region, RoomProfile, Lodge
-from django.views.decorators.http import require_http_methods
+from listings import geography
+from listings.models import LodgeImage, RoomProfileImage
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, Prefetch
+from django.middleware.csrf import get_token
+from django.views.decorators.http import condition, require_http_methods
 from .models import Subscription, SubscribedListing
+from .sampling import sample_rooms
 from core.views import handle_http_errors
 import logging
 from auths.decorators import role_required
 from django.http import HttpResponse
-from celery import current_app
+from django.utils import timezone
 from django_htmx.http import retarget
 
 # from messaging.tasks import send_creator_subscription_mail
@@ -17,9 +25,7 @@ logger = logging.getLogger('subscriptions')
 @require_http_methods(['GET'])
 def get_regions(request):
     school_id = request.GET.get('schools')
-    school = School.objects.get(pk=school_id)
-
-    regions = school.regions.all()
+    regions = geography.get_regions_for_school(school_id)
     print(regions)
     context = {
         'regions': regions
@@ -35,39 +41,78 @@ def get_regions(request):
 def subscribe_for_listing(transaction):
     """
     Handle initial subscription when client pays
+
+    The initial rooms take their quota slots as the subscription is
+    created, vacancy updates reserve theirs through subscriptions.quota
     """
+    regions = transaction.regions.values_list('pk', flat=True)
+
+    subscribed_rooms = subscription_algorithm(regions)
+    room_pks = list(subscribed_rooms.values_list('pk', flat=True))
+
     subscription = Subscription.objects.create(
         client=transaction.client,
-        transaction=transaction
+        transaction=transaction,
+        number_of_listings_sent=len(room_pks)
     )
 
-    regions = transaction.regions.all()
-    lodges = Lodge.objects.filter(region__in=regions)
-
-    subscribed_rooms = subscription_algorithm(lodges)
-
-    subscription.subscribed_rooms.set(subscribed_rooms)
+    subscription.subscribed_rooms.set(room_pks)
     return subscription, subscribed_rooms
 
 
-def subscription_algorithm(lodges):
+def subscription_algorithm(regions):
     """
-    Algorithm to select rooms, using basic randomization for now.
+    Algorithm to select rooms, using random sampling spread across
+    creators and lodges.
     This function limits the selection to a maximum of 20 randomly chosen rooms.
     """
-    vacant_rooms = RoomProfile.objects.filter(
-        lodge__in=lodges,
-        vacancy__gt=0
-    ).order_by('?')[:20]
+    return sample_rooms(regions, Subscription.LISTING_CAP)
+
+
+def subscribed_listings_etag(request, pk):
+    """
+    Fingerprint of everything the subscribed listings page shows,
+    from one aggregate query, repeat visits get a 304
+    """
+    if get_messages(request):
+        # flash messages are rendered once, never replay them
+        return None
+
+    row = SubscribedListing.objects.filter(subscription_id=pk).aggregate(
+        listings=Count('pk'),
+        listing=Max('updated_at'),
+        room=Max('room_profile__updated_at'),
+        lodge=Max('room_profile__lodge__updated_at')
+    )
+    if not row['listings']:
+        return None
 
-    return vacant_rooms
+    fingerprint = '|'.join([
+        str(pk),
+        *(str(row[key]) for key in ('listings', 'listing', 'room', 'lodge')),
+        # school names come from the geography cache
+        str(geography.get_snapshot().version),
+        # the page embeds a csrf token of this secret, set on first visit
+        _csrf_secret(request),
+    ])
+    return hashlib.sha1(fingerprint.encode()).hexdigest()
 
 
+def _csrf_secret(request):
+    get_token(request)
+    return request.META.get('CSRF_COOKIE', '')
+
+
+@condition(etag_func=subscribed_listings_etag)
 def get_subscribed_listings(request, pk):
     """
     Get all listings client subscribed for
     The link sent to the client is handled by this function
 
+    The listings are fetched with their rooms, lodges and images in a
+    fixed number of queries, each card is cached as a fragment keyed
+    on the listing, room and lodge updated_at.
+
     Return: A html page containing all the listings for current subscription
     """
     try:
@@ -77,9 +122,29 @@ def get_subscribed_listings(request, pk):
             f'Cannot get subscribed listing with pk: {pk}, error: {e}')
         return handle_http_errors(request, 404)
 
-    subscribed_listings = subscription.subscribed_listings.all()
+    subscribed_listings = subscription.subscribed_listings.select_related(
+        'room_profile__room_type',
+        'room_profile__lodge__school',
+        'room_profile__lodge__region',
+        'room_profile__lodge__landmark'
+    ).prefetch_related(
+        Prefetch(
+            'room_profile__lodge__lodge_images',
+            queryset=LodgeImage.objects.filter(
+                status=LodgeImage.Status.READY).order_by('uploaded_at')
+        ),
+        Prefetch(
+            'room_profile__room_images',
+            queryset=RoomProfileImage.objects.filter(
+                status=RoomProfileImage.Status.READY).order_by('uploaded_at')
+        )
+    ).order_by('created_at')
+
     context = {
-        'subscribed_listings': subscribed_listings
+        'subscribed_listings': subscribed_listings,
+        'fragment_ttl': settings.SUBSCRIBED_LISTING_FRAGMENT_TTL,
+        # cards show school, region and landmark names
+        'geography_version': geography.get_snapshot().version
     }
 
     return render(
@@ -90,19 +155,28 @@ def get_subscribed_listings(request, pk):
 
 
 def create_subscribed_listing(subscription):
+    """
+    Creates a subscribed listing for every room in the subscription
+    in one insert, verification is left to the periodic sweep
+    """
+    room_profiles = subscription.subscribed_rooms.select_related(
+        'lodge__creator')
+
     subscribed_listings = []
     creator_email_set = set()
 
-    # check if subscribed listing already exists
-    for room_profile in subscription.subscribed_rooms.all():
-        subscribed_listing = SubscribedListing.objects.create(
+    for room_profile in room_profiles:
+        creator = room_profile.lodge.creator
+        subscribed_listings.append(SubscribedListing(
             subscription=subscription,
             room_profile=room_profile,
-            creator=room_profile.lodge.creator,
-            client=subscription.client
-        )
-        subscribed_listings.append(subscribed_listing)
-        creator_email_set.add(room_profile.lodge.creator.email)
+            creator_id=creator.pk,
+            client_id=subscription.client_id
+        ))
+        creator_email_set.add(creator.email)
+
+    subscribed_listings = SubscribedListing.objects.bulk_create(
+        subscribed_listings)
 
     logger.info(
         f'subscribed listings listing successfully created for subscription {subscription.pk}'
@@ -126,14 +200,19 @@ def handle_occupied_report(request, pk):
 
         return handle_http_errors(request, 404)
 
-    if listing.status == SubscribedListing.Status.UNVERIFIED:
-        listing.status = SubscribedListing.Status.PROBATION
+    # conditional update so a concurrent verification sweep cannot be undone
+    reported = SubscribedListing.objects.filter(
+        pk=listing.pk,
+        status=SubscribedListing.Status.UNVERIFIED
+    ).update(
+        status=SubscribedListing.Status.PROBATION,
+        updated_at=timezone.now()
+    )
 
-        current_app.control.revoke(listing.status_task_id, terminate=True)
-        listing.status_task_id = None
-        listing.save()
+    if reported:
+        listing.refresh_from_db()
         logger.info(
-            f'Subscribed listing status changed from unverified to probation for pk: {pk}\ntask_status_id for subscribed_listing set to None')
+            f'Subscribed listing status changed from unverified to probation for pk: {pk}')
 
         context = {
             'listing': listing
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Client dashboard data
+
+Everything the client dashboard shows is read in a fixed number of
+queries: the client's listings once with their rooms and lodges,
+grouped by status here, the transaction and subscription counts in one
+conditional aggregate, and the regions of the active subscriptions
+resolved through the geography cache.
+"""
+from django.db.models import Count, Q
+
+from listings import geography
+from payments.models import Transaction
+from subscriptions.models import SubscribedListing
+
+
+def get_client_dashboard(client):
+    """
+    Returns:
+        dict: the listings of each status as '<status>_listings', the
+        counts and the subscribed regions.
+    """
+    listings = {status: [] for status in SubscribedListing.Status.values}
+    for listing in client.subscribed_listings.select_related(
+            'room_profile__room_type', 'room_profile__lodge'
+    ).order_by('-created_at'):
+        listings[listing.status].append(listing)
+
+    # subscriptions are created from their transaction,
+    # so the one-to-one join counts them without fanning out
+    counts = Transaction.objects.filter(client=client).aggregate(
+        complete_transactions=Count('pk', filter=Q(is_fully_paid=True)),
+        incomplete_transactions=Count('pk', filter=Q(is_fully_paid=False)),
+        active_subscriptions=Count(
+            'subscription', filter=Q(subscription__is_expired=False))
+    )
+
+    region_pks = Transaction.regions.through.objects.filter(
+        transaction__subscription__client=client,
+        transaction__subscription__is_expired=False
+    ).values_list('region_id', flat=True).distinct()
+    subscribed_regions = [
+        region for region in map(geography.get_region, region_pks) if region
+    ]
+
+    dashboard = {
+        f'{status.lower()}_listings': status_listings
+        for status, status_listings in listings.items()
+    }
+    dashboard.update({
+        'listing_counts': {
+            status: len(status_listings)
+            for status, status_listings in listings.items()
+        },
+        'subscribed_regions': subscribed_regions,
+        **{f'{name}_count': count for name, count in counts.items()},
+    })
+    return dashboard
@@ -1,7 +1,7 @@
-import os
-
-import requests
 from core.models import BaseModel
+from payments import paystack
+from requests import RequestException
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import (
     AbstractUser,
@@ -9,7 +9,6 @@ from django.contrib.auth.models import (
     Group,
     Permission
 )
-from django.core.exceptions import ValidationError
 
 
 class User(BaseModel, AbstractUser):
@@ -31,39 +30,39 @@ class User(BaseModel, AbstractUser):
     last_name = models.CharField(max_length=50, null=False)
     customer_code = models.CharField(max_length=50, default="")
 
-    def save(self, *args, **kwargs):
-        """Override save to create a Paystack customer when a user is created."""
-        # Check if it's a new user
-        if not self.customer_code:
-            super().save(*args, **kwargs)  # Save user first to get the ID
-            self._create_paystack_customer()
-        else:
-            super().save(*args, **kwargs)  # Update existing user
+    def get_customer_code(self):
+        """
+        Returns the Paystack customer code.
+        Customers are provisioned by a deferred job after signup,
+        the customer is provisioned here if the job has not run yet.
 
+        Raises:
+            ValidationError: If Paystack cannot be reached or rejects the customer.
+        """
+        if not self.customer_code:
+            from users.tasks import provision_paystack_customer
+            try:
+                self.customer_code = provision_paystack_customer(self.pk) or ""
+            except (paystack.PaystackError, RequestException) as e:
+                raise ValidationError(
+                    "Could not set up the Paystack customer. Please try again.") from e
+        return self.customer_code
 
     def _create_paystack_customer(self):
-        print("Creating customer on paystack...")
-        """Create a Paystack customer and save the customer code."""
-        url = "https://api.paystack.co/customer"
-        headers = {
-            "Authorization": f"Bearer {os.getenv('PAYSTACK_TEST_KEY')}",
-            "Content-Type": "application/json"
-        }
+        """Create a Paystack customer and return the customer code."""
         data = {
             "email": self.email,
             "first_name": self.first_name,
             "last_name": self.last_name,
         }
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code == 200:
-            response_data = response.json()
-            self.customer_code = response_data['data']['customer_code']
-            print(f"Paystack customer created successfully. Code: {self.customer_code}")
-            self.save()
-        else:
-            response_data = response.json()
-            raise ValidationError("Failed to create Paystack customer.")
-    
+        response = paystack.post('customer', json=data)
+        response_data = response.json()
+        if response.status_code == 200 and response_data.get('status'):
+            return response_data['data']['customer_code']
+
+        raise paystack.PaystackError(
+            f"Failed to create Paystack customer: {response_data.get('message')}")
+
     def delete(self, *args, **kwargs):
         """Override delete to remove the customer from Paystack before deleting the user."""
         # if self.customer_code:
@@ -75,12 +74,8 @@ class User(BaseModel, AbstractUser):
     def _delete_paystack_customer(self):
         """Delete the Paystack customer associated with this user."""
         print(f"Deleting customer from Paystack with code: {self.customer_code}")
-        url = f"https://api.paystack.co/customer/{self.customer_code}"
-        headers = {
-            "Authorization": f"Bearer {os.getenv('PAYSTACK_TEST_KEY')}",
-            "Content-Type": "application/json"
-        }
-        response = requests.delete(url, headers=headers)
+        response = paystack.delete(
+            f'customer/{self.customer_code}', endpoint='customer')
         print(response)
         if response.status_code == 200:
             print(f"Paystack customer deleted successfully.")
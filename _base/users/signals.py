@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 """signals for user queries"""
 
-from django.conf import settings
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.db import transaction
@@ -11,22 +10,30 @@ from users.models import (
     ClientProfile,
     Creator,
     CreatorProfile,
+    User,
 )
+from users.tasks import provision_paystack_customer
 
 
 @receiver(post_save, sender=Client)
 def create_client_profile(sender, instance, created, **kwargs):
     '''creates client profile when customer user is saved'''
     if created and instance.role == 'CLIENT':
-        with transaction.atomic():
-            ClientProfile.objects.create(user=instance)
-            instance.save()
+        ClientProfile.objects.create(user=instance)
 
 
 @receiver(post_save, sender=Creator)
 def create_creator_profile(sender, instance, created, **kwargs):
     '''creates creator profile when business is saved'''
     if created and instance.role == 'CREATOR':
-        with transaction.atomic():
-            CreatorProfile.objects.create(user=instance)
-            instance.save()
+        CreatorProfile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Creator)
+def schedule_paystack_customer(sender, instance, created, **kwargs):
+    '''provisions the paystack customer after signup is committed'''
+    if created and not instance.customer_code:
+        transaction.on_commit(
+            lambda: provision_paystack_customer.delay(instance.pk))
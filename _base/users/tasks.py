@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+from celery import shared_task
+import logging
+import requests
+
+from payments.paystack import PaystackError
+from users.models import User
+
+logger = logging.getLogger('users')
+
+
+@shared_task(
+    autoretry_for=(requests.RequestException, PaystackError),
+    retry_backoff=True,
+    retry_jitter=True,
+    max_retries=5
+)
+def provision_paystack_customer(user_pk):
+    """
+    Creates the Paystack customer for a user and stores the customer code.
+    Safe to run more than once, users with a code are left untouched.
+
+    Returns:
+        str: The customer code, or None if the user no longer exists.
+    """
+    try:
+        user = User.objects.get(pk=user_pk)
+    except User.DoesNotExist:
+        logger.error(f'Cannot provision paystack customer, no user with pk: {user_pk}')
+        return None
+
+    if user.customer_code:
+        return user.customer_code
+
+    customer_code = user._create_paystack_customer()
+
+    # a concurrent run may have stored a code already
+    updated = User.objects.filter(
+        pk=user_pk,
+        customer_code=''
+    ).update(customer_code=customer_code)
+    if not updated:
+        customer_code = User.objects.values_list(
+            'customer_code', flat=True).get(pk=user_pk)
+
+    logger.info(f'Paystack customer provisioned for user: {user_pk}')
+    return customer_code
@@ -1,3 +1,155 @@
+from unittest import mock
+
+import requests
+
+from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.tests import (
+    create_client,
+    create_creator,
+    create_lodge,
+    create_region,
+    create_room_profile,
+    create_subscription
+)
+from listings import geography
+from payments import paystack
+from payments.models import Transaction
+from subscriptions.models import SubscribedListing
+from users.dashboard import get_client_dashboard
+from users.models import Client
+from users.tasks import provision_paystack_customer
+
+
+def paystack_customer_response(customer_code='CUS_test'):
+    response = mock.Mock(status_code=200)
+    response.json.return_value = {
+        'status': True,
+        'data': {'customer_code': customer_code}
+    }
+    return response
+
+
+@mock.patch('payments.paystack.post')
+class PaystackCustomerProvisioningTests(TestCase):
+    def create_client(self):
+        return Client.objects.create(
+            email='ada@upperoom.test',
+            username='adaobi1234567',
+            first_name='Ada',
+            last_name='Obi'
+        )
+
+    def test_signup_does_not_call_paystack(self, paystack_post):
+        with mock.patch('users.tasks.provision_paystack_customer.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                client = self.create_client()
+
+        paystack_post.assert_not_called()
+        delay.assert_called_once_with(client.pk)
+
+    def test_provisioning_is_idempotent(self, paystack_post):
+        paystack_post.return_value = paystack_customer_response()
+        client = self.create_client()
+
+        self.assertEqual(provision_paystack_customer(client.pk), 'CUS_test')
+        self.assertEqual(provision_paystack_customer(client.pk), 'CUS_test')
+
+        paystack_post.assert_called_once()
+        client.refresh_from_db()
+        self.assertEqual(client.customer_code, 'CUS_test')
+
+    def test_failed_provisioning_raises_for_retry(self, paystack_post):
+        response = mock.Mock(status_code=400)
+        response.json.return_value = {'status': False, 'message': 'Invalid'}
+        paystack_post.return_value = response
+        client = self.create_client()
+
+        with self.assertRaises(paystack.PaystackError):
+            provision_paystack_customer.run(client.pk)
+
+    def test_customer_code_is_fetched_lazily(self, paystack_post):
+        paystack_post.return_value = paystack_customer_response('CUS_lazy')
+        client = self.create_client()
+
+        self.assertEqual(client.get_customer_code(), 'CUS_lazy')
+        self.assertEqual(client.get_customer_code(), 'CUS_lazy')
+        paystack_post.assert_called_once()
+
+    def test_lazy_provisioning_failures_become_validation_errors(self, paystack_post):
+        client = self.create_client()
+
+        paystack_post.side_effect = requests.Timeout('read timed out')
+        with self.assertRaises(ValidationError):
+            client.get_customer_code()
+
+        paystack_post.side_effect = None
+        response = mock.Mock(status_code=400)
+        response.json.return_value = {'status': False, 'message': 'Invalid'}
+        paystack_post.return_value = response
+        with self.assertRaises(ValidationError):
+            client.get_customer_code()
+        self.assertEqual(client.customer_code, '')
+
+
+class ClientDashboardTests(TestCase):
+    def setUp(self):
+        self.region = create_region()
+        self.client_user = create_client()
+
+    def subscribe(self, statuses, **kwargs):
+        subscription = create_subscription(self.region, self.client_user, **kwargs)
+        for status in statuses:
+            room_profile = create_room_profile(
+                create_lodge(self.region, create_creator()), vacancy=1)
+            SubscribedListing.objects.create(
+                subscription=subscription,
+                room_profile=room_profile,
+                creator=room_profile.lodge.creator,
+                client=self.client_user,
+                status=status
+            )
+        return subscription
+
+    def test_groups_and_counts(self):
+        Status = SubscribedListing.Status
+        self.subscribe([Status.UNVERIFIED, Status.UNVERIFIED, Status.VERIFIED])
+        self.subscribe([Status.REJECTED], is_expired=True)
+        Transaction.objects.create(
+            amount=1500, reference='aborted', client=self.client_user)
+
+        dashboard = get_client_dashboard(self.client_user)
+
+        self.assertEqual(len(dashboard['unverified_listings']), 2)
+        self.assertEqual(dashboard['listing_counts'], {
+            'UNVERIFIED': 2, 'VERIFIED': 1, 'PROBATION': 0,
+            'REJECTED': 1, 'SETTLED': 0
+        })
+        self.assertEqual(dashboard['active_subscriptions_count'], 1)
+        self.assertEqual(dashboard['complete_transactions_count'], 2)
+        self.assertEqual(dashboard['incomplete_transactions_count'], 1)
+        self.assertEqual(dashboard['subscribed_regions'], [self.region])
+
+    def test_query_count(self):
+        Status = SubscribedListing.Status
+        self.subscribe([Status.UNVERIFIED])
+        self.client.force_login(self.client_user)
+        geography.get_snapshot()
+
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(reverse('get_client'))
+        self.assertEqual(response.status_code, 200)
+
+        self.subscribe([Status.VERIFIED, Status.PROBATION] * 5)
+        self.subscribe([Status.REJECTED] * 3)
+        geography.get_snapshot()
 
-# Create your tests here.
+        # session, user, listings, counts, regions
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('get_client'))
+        self.assertEqual(len(few), 5)
+        self.assertContains(response, 'Active Subscriptions: 3')